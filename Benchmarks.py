@@ -0,0 +1,278 @@
+"""
+Year End Project
+Program:                Data Science
+@author:                Marco Corsi
+@Description: Scaling benchmarks of the hot paths of the project (network construction, stats, layout, debt rank and
+              database reads) on synthetic networks (see Synthetic_Networks) of increasing size. For each benchmark,
+              structure and size the wall time (best of several runs), the peak memory and the number of rounds of the
+              debt rank are stored in a JSON file. Two result files can be compared to flag the regressions.
+
+Usage:
+    python Benchmarks.py [--sizes 300 1000 3000] [--kinds corePeriphery completeDAG] [--benchmarks debtRankCentrality ...]
+                         [--repeat 3] [--output benchmarks.json]
+    python Benchmarks.py --compare old.json new.json [--tolerance 0.2]
+"""
+
+# File Structure:
+#       1. Libraries
+#       2. Benchmarks (each benchmark is a function of a synthetic network)
+#       3. Runner and comparison of two runs
+
+
+
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import scipy
+import networkx as nx
+
+import settings
+import Financial_Network as fn
+import DB_Utilities as dbm
+import Synthetic_Networks as sn
+
+
+
+
+# Benchmarks ###############################################################################
+
+
+##  Synthetic network shared by all the benchmarks of a (kind, size), with the objects derived from it
+#   built once (the construction is not part of the timings)
+#
+class Case():
+
+    def __init__(self, N, kind, seed):
+
+        self.N = N
+        self.kind = kind
+        self.weights, self.nodes, self.staticAttributes, self.marketCaps = sn.syntheticNetwork(N, kind, seed)
+        self.network = fn.FinancialNetwork.fromMatrix(self.weights, self.nodes, self.staticAttributes, ['name', 'currency', 'benchmark'])
+        self.W, self.nodeList = fn.weightsMatrix(self.network)
+        self.split = self.network.weightsSplit
+
+        # the seed of the single node shocks is the node with the largest impact on the others
+        self.seed = self.nodes[int(np.argmax(np.asarray(self.weights.sum(axis = 0)).ravel()))]
+        self._db = None
+
+
+    ## Temporary database with the network in the nodesWeights and nodesEdges tables (built at the first access)
+    #
+    @property
+    def db(self):
+
+        if self._db is None:
+            self._db = os.path.join(tempfile.mkdtemp(), 'benchmark_db')
+            dbm.createNodesEdges(self._db)
+            attributes = {n: [self.marketCaps[n], n, 'USD', 'SPX'] for n in self.nodes}
+            dbm.populateNodesEdgesSparse(self._db, '2018', attributes, self.weights, self.nodes, 'synthetic')
+            dbm.createNodesAttributes(self._db)
+            dbm.populateNodes(self._db, attributes)
+
+            # nodesWeights has one column per node and is only built below the column limit of SQLite
+            if self.N <= MAX_COLUMNS:
+                dbm.createNodesWeights(self._db, attributes)
+                dense = self.weights.toarray()
+                columns = ', '.join("OWNED_OF_" + n for n in self.nodes)
+                statement = ("INSERT INTO nodesWeights (node_id, date, method, " + columns + ") VALUES (?,?,?"
+                             + ",?" * self.N + ")")
+                with sqlite3.connect(self._db) as db:
+                    db.executemany(statement, ([self.nodes[i], '2018', 'synthetic'] + dense[i].tolist() for i in range(self.N)))
+
+        return self._db
+
+
+    ## Remove the temporary database
+    #
+    def close(self):
+
+        if self._db is not None:
+            for suffix in ['', '-wal', '-shm']:
+                if os.path.exists(self._db + suffix):
+                    os.remove(self._db + suffix)
+            os.rmdir(os.path.dirname(self._db))
+
+
+# maximum number of columns of a SQLite table (SQLITE_MAX_COLUMN) minus the key columns of nodesWeights
+MAX_COLUMNS = 1990
+
+
+def _init(case):
+    fn.FinancialNetwork(pd.DataFrame(case.weights.toarray(), index = case.nodes, columns = case.nodes),
+                        case.staticAttributes, ['name', 'currency', 'benchmark'])
+
+def _fromMatrix(case):
+    fn.FinancialNetwork.fromMatrix(case.weights, case.nodes, case.staticAttributes, ['name', 'currency', 'benchmark'])
+
+def _mainStats(case):
+    case.network.mainStats()
+
+def _generateLayout(case):
+    case.network.generateLayout(settings.SCALE, settings.LIMIT, settings.IDEAL_DIST, settings.MAX_ITER)
+
+def _debtRank(case, collector = None):
+    fn.debtRank(case.network, {case.seed}, 1, dict(case.marketCaps), collector = collector)
+
+def _debtRankVectorized(case, collector = None):
+    fn.debtRankVectorized(case.network, {case.seed}, 1, case.marketCaps, W = case.split, nodes = case.nodeList, collector = collector)
+
+def _debtRankCentrality(case, collector = None):
+    case.network.debtRankCentrality(case.marketCaps, collector)
+
+def _getNodesWeights(case):
+    dbm.getNodesWeights(case.db, '2018', 'synthetic')
+
+def _getNodesEdges(case):
+    dbm.getNodesEdges(case.db, '2018', 'synthetic', sparse = True)
+
+
+# name of each benchmark: function run on a Case, largest size for which it is run (the dense and O(N^2) paths
+# do not fit in memory or time above it) and flag for the benchmarks of the debt rank (the function accepts a
+# DebtRankCollector and the number of rounds is recorded)
+BENCHMARKS = {'FinancialNetwork.__init__': (_init, 3000, False),
+              'FinancialNetwork.fromMatrix': (_fromMatrix, 30000, False),
+              'mainStats': (_mainStats, 30000, False),
+              'generateLayout': (_generateLayout, 30000, False),
+              'debtRank': (_debtRank, 3000, True),
+              'debtRankVectorized': (_debtRankVectorized, 30000, True),
+              'debtRankCentrality': (_debtRankCentrality, 3000, True),
+              'getNodesWeights': (_getNodesWeights, MAX_COLUMNS, False),
+              'getNodesEdges': (_getNodesEdges, 30000, False)}
+
+
+
+
+# Runner ###################################################################################
+
+
+## Run a benchmark: best wall time over repeat runs and peak memory (traced separately, as tracing slows down the code)
+#  @return dictionary with the results
+#
+def runBenchmark(name, case, repeat = 3):
+
+    function, maxNodes, instrumented = BENCHMARKS[name]
+    times = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        function(case)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(case)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # the rounds are counted in a separate run, so that the timings do not include the instrumentation
+    nbRounds = None
+    if instrumented:
+        collector = fn.DebtRankCollector()
+        function(case, collector)
+        nbRounds = collector.report()['maxRounds']
+
+    return {'benchmark': name, 'kind': case.kind, 'N': case.N, 'nbEdges': int(case.weights.nnz),
+            'time': min(times), 'meanTime': float(np.mean(times)), 'peakMB': peak / 1e6, 'nbRounds': nbRounds}
+
+
+## Run the benchmarks for all the combinations of sizes and kinds of networks and write the results into a JSON file
+#  @param sizes: list with the number of nodes of the networks
+#  @param kinds: list of structures of the networks (see Synthetic_Networks.KINDS)
+#  @param benchmarks: list of benchmarks (see BENCHMARKS), default is all
+#  @param repeat: number of timed runs of each benchmark
+#  @param output: name of the JSON file
+#  @param seed: seed of the synthetic networks
+#  @return list with the results
+#
+def runBenchmarks(sizes, kinds, benchmarks = None, repeat = 3, output = None, seed = 0):
+
+    if benchmarks is None:
+        benchmarks = list(BENCHMARKS.keys())
+
+    results = []
+    for N in sizes:
+        for kind in kinds:
+            if kind in ('dense', 'completeDAG') and N > sn.MAX_DENSE_NODES:
+                print('{:<28} {:<14} {:>6}   skipped (above {} nodes)'.format('all', kind, N, sn.MAX_DENSE_NODES))
+                continue
+            case = Case(N, kind, seed)
+            try:
+                for name in benchmarks:
+                    if N > BENCHMARKS[name][1]:
+                        print('{:<28} {:<14} {:>6}   skipped (above {} nodes)'.format(name, kind, N, BENCHMARKS[name][1]))
+                        continue
+                    r = runBenchmark(name, case, repeat)
+                    results.append(r)
+                    print('{:<28} {:<14} {:>6} {:>10.4f}s {:>10.1f}MB   rounds {}'.format(name, kind, N, r['time'], r['peakMB'],
+                                                                                    r['nbRounds']))
+            finally:
+                case.close()
+
+    if output is not None:
+        info = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                'platform': platform.platform(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+                'networkx': nx.__version__, 'pandas': pd.__version__, 'repeat': repeat, 'seed': seed}
+        with open(output, 'w') as f:
+            json.dump({'info': info, 'results': results}, f, indent = 1)
+
+    return results
+
+
+## Compare two result files and return the regressions: benchmarks (same name, kind and size in both files)
+#  whose time or peak memory has increased by more than tolerance (relative)
+#  @param oldFile, newFile: names of the JSON files written by runBenchmarks
+#  @return list of tuples (benchmark, kind, N, measure, old value, new value)
+#
+def compareResults(oldFile, newFile, tolerance = 0.2):
+
+    with open(oldFile) as f:
+        old = {(r['benchmark'], r['kind'], r['N']): r for r in json.load(f)['results']}
+    with open(newFile) as f:
+        new = {(r['benchmark'], r['kind'], r['N']): r for r in json.load(f)['results']}
+
+    regressions = []
+    for k in sorted(set(old.keys()) & set(new.keys()), key = str):
+        for measure in ['time', 'peakMB']:
+            ratio = new[k][measure] / old[k][measure] if old[k][measure] > 0 else 1
+            flag = 'REGRESSION' if ratio > 1 + tolerance else ''
+            print('{:<28} {:<14} {:>6} {:<7} {:>12.4f} {:>12.4f} {:>7.2f}x {}'.format(k[0], k[1], k[2], measure,
+                                                                               old[k][measure], new[k][measure], ratio, flag))
+            if flag:
+                regressions.append(k + (measure, old[k][measure], new[k][measure]))
+
+    return regressions
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Scaling benchmarks on synthetic financial networks')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = settings.BENCHMARK_SIZES)
+    parser.add_argument('--kinds', nargs = '+', default = sn.KINDS, choices = sn.KINDS)
+    parser.add_argument('--benchmarks', nargs = '+', default = None, choices = list(BENCHMARKS.keys()))
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', default = settings.BENCHMARK_FILE)
+    parser.add_argument('--compare', nargs = 2, metavar = ('OLD', 'NEW'))
+    parser.add_argument('--tolerance', type = float, default = 0.2)
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compareResults(args.compare[0], args.compare[1], args.tolerance)
+        print(len(regressions), 'regression(s)')
+        sys.exit(1 if regressions else 0)
+
+    runBenchmarks(args.sizes, args.kinds, args.benchmarks, args.repeat, args.output, args.seed)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Year End Project
+Program:                Data Science
+@author:                Marco Corsi
+@Description: On-disk cache for the build steps of Graph_Builder. Each artifact is stored under a key obtained by hashing
+              the inputs of the step (data and relevant parameters), so that a step is run again only if its inputs change.
+              The size of the cache is bounded: the least recently used artifacts are removed first.
+"""
+
+
+
+
+import os
+import pickle
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+# version of the code of the cached build steps, included in every key: increase it whenever a change of the code
+# (Financial_Network, Force_Layout, the build steps of Graph_Builder) changes the artifacts, so that they are rebuilt
+CACHE_VERSION = 2
+
+
+
+
+##  Cache of build artifacts stored as pickle files in a folder. Can be shared by several processes:
+#   files are written atomically and missing files (e.g. removed by another process) are treated as cache misses.
+#
+class BuildCache():
+
+    ## @param path: folder of the cache (created if needed)
+    #  @param maxBytes: maximum size of the cache in bytes
+    #
+    def __init__(self, path, maxBytes):
+
+        self.path = path
+        self.maxBytes = maxBytes
+        os.makedirs(path, exist_ok = True)
+
+
+    ## Key of a build step: hash of all its inputs and of CACHE_VERSION. Arrays, sparse matrices, dataframes,
+    #  dictionaries, lists and scalars are supported
+    #  @param parts: name of the step followed by all its inputs
+    #
+    def key(self, *parts):
+
+        h = hashlib.sha256()
+        for p in (CACHE_VERSION,) + parts:
+            _update(h, p)
+
+        return h.hexdigest()
+
+
+    ## Return the artifact stored under key, or None if it is not in the cache
+    #
+    def get(self, key):
+
+        fileName = os.path.join(self.path, key + '.pkl')
+        try:
+            with open(fileName, 'rb') as f:
+                artifact = pickle.load(f)
+            os.utime(fileName) # mark as recently used
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        return artifact
+
+
+    ## Store the artifact under key and remove the least recently used artifacts if the cache is too large
+    #
+    def put(self, key, artifact):
+
+        f, tempName = tempfile.mkstemp(dir = self.path, suffix = '.tmp')
+        with os.fdopen(f, 'wb') as f:
+            pickle.dump(artifact, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tempName, os.path.join(self.path, key + '.pkl'))
+
+        self._evict()
+
+
+    ## Remove the least recently used artifacts until the size of the cache is below maxBytes
+    #
+    def _evict(self):
+
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.pkl'):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                    files.append((stat.st_mtime, stat.st_size, name))
+                except FileNotFoundError:
+                    pass
+
+        total = sum(f[1] for f in files)
+        for mtime, size, name in sorted(files):
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total = total - size
+
+
+
+
+## Add an input to the hash (the type of each input is included so that e.g. 1 and '1' give different keys)
+#
+def _update(h, p):
+
+    h.update(type(p).__name__.encode())
+
+    if isinstance(p, np.ndarray):
+        h.update(str((p.shape, p.dtype.str)).encode())
+        h.update(np.ascontiguousarray(p).tobytes())
+    elif sp.issparse(p):
+        p = sp.csr_matrix(p)
+        for a in (np.array(p.shape), p.data, p.indices, p.indptr):
+            _update(h, a)
+    elif isinstance(p, pd.DataFrame):
+        for a in (list(p.index), list(p.columns), np.asarray(p.values, dtype = float)):
+            _update(h, a)
+    elif isinstance(p, dict):
+        for k in sorted(p.keys(), key = str):
+            _update(h, k)
+            _update(h, p[k])
+    elif isinstance(p, (list, tuple)):
+        h.update(str(len(p)).encode())
+        for a in p:
+            _update(h, a)
+    else:
+        h.update(repr(p).encode())
+    h.update(b'|')
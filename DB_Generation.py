@@ -9,8 +9,13 @@ consolidate the data and then store the final results into a series of SQL table
 
 
 
+import sys
+import re
+import json
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+from concurrent.futures import ThreadPoolExecutor
 import DB_Utilities as db
 import settings
 
@@ -70,45 +75,167 @@ def createNodesAttributes():
 
 
 
+## Load the table of aliases used to map the holders to their parent entity. 
+#  @param fileName: json file containing a dictionary where the keys are the parent entities (factset names of the nodes)
+#                   and the values are lists of regular expressions matching the names of their subsidiaries
+#  @return list of (parent, regular expression) pairs, in the order of the file
+#
+def loadEntityAliases(fileName):
+    
+    with open(fileName, encoding = 'utf-8') as f:
+        table = json.load(f)
+    
+    return [(parent, pattern) for parent in table.keys() for pattern in table[parent]]
+
+
+
+## Compile the alias table into two regular expressions: one finding the positions where an alias starts 
+#  (lookahead, so that overlapping matches are all found) and one with one optional named group for each alias,
+#  capturing all the aliases matching at a given position
+#  @param aliases: list of (parent, regular expression) pairs
+#  @return the expression of the positions, the parent of each group, the list of parents and the expression 
+#          of the aliases
+#
+def compileAliases(aliases):
+    
+    pattern = re.compile('(?=' + '|'.join('(?:' + a[1] + ')' for a in aliases) + ')')
+    groupParents = {'a' + str(i): aliases[i][0] for i in range(len(aliases))}
+    parents = list(dict.fromkeys(a[0] for a in aliases))
+    aliasPattern = re.compile(''.join('(?=(?P<a' + str(i) + '>' + aliases[i][1] + '))?' for i in range(len(aliases))))
+    
+    return pattern, groupParents, parents, aliasPattern
+
+
+
+## Map each holder to its parent entity with a single pass over the name: the aliases matching at each position
+#  where one starts are collected, so that an alias contained in the match of another entity is also found. 
+#  If the name of a holder matches the aliases of several entities, the leftmost match wins (first alias of the 
+#  table at the same position, e.g. 'ICBC Credit Suisse' goes to ICBC) and the holder is reported as ambiguous.
+#  @param holders: index (or list) with the names of the holders
+#  @param classifier: compiled alias table (see compileAliases)
+#  @return series with the parent of each holder (None if not matched), list of unmatched holders and 
+#          dictionary with the ambiguous holders and all the entities they match
+#
+def classifyHolders(holders, classifier):
+    
+    pattern, groupParents, parents, aliasPattern = classifier
+    result = []
+    unmatched = []
+    ambiguous = {}
+    
+    for h in holders:
+        
+        found = []
+        if isinstance(h, str):
+            for start in pattern.finditer(h):
+                for group, text in aliasPattern.match(h, start.start()).groupdict().items():
+                    if text is not None and groupParents[group] not in found:
+                        found.append(groupParents[group])
+        
+        if len(found) == 0:
+            result.append(None)
+            unmatched.append(h)
+            continue
+        
+        result.append(found[0])
+        if len(found) > 1:
+            ambiguous[h] = [found[0]] + sorted(found[1:])
+    
+    return pd.Series(result, index = holders, dtype = object), unmatched, ambiguous
+
+
+
+## Print a summary of the classification of the holders
+#  @param nbUnmatched: number of holders not mapped to any entity
+#  @param ambiguous: dictionary with the ambiguous holders (see classifyHolders)
+#
+def reportClassification(nbUnmatched, ambiguous):
+    
+    print(str(nbUnmatched) + ' holders not mapped to any entity')
+    for h in ambiguous.keys():
+        print('ambiguous holder: ' + str(h) + ' mapped to ' + ambiguous[h][0] + ' (also matches ' + ', '.join(ambiguous[h][1:]) + ')')
+
+
+
 ##  This function uses raw data (originated by Factset) in csv files representing the percentage of each financial company from a 
 #   selected list owned by any other financial insitution in the world (including the other institution in the list)
 #   The data are aggregated and consolidated in order to show for each company in the selected list the $amount owned by the other
 #   companie in the list (methodology in the [1]). The final result is stored in a dataframe.
+#   @param data: dataFrame with the raw data (index are the holders, columns are the nodes)
+#   @param mapNodes: dictionary with the node information (see createNodesAttributes)
+#   @param classifier: compiled alias table (see compileAliases), the table in settings.ENTITY_ALIASES is used by default
+#   @param report: if True print the number of holders not mapped to any entity and the holders matching several entities
+#
+def cleanRawdata(data, mapNodes, classifier = None, report = True):
+    
+    if classifier is None:
+        classifier = compileAliases(loadEntityAliases(settings.ENTITY_ALIASES))
+    
+    # Map each holder to its parent entity and aggregate ownership data from subsidiaries of the same entity
+    newData, unmatched, ambiguous = aggregateHolders(data, classifier)
+    if report:
+        reportClassification(len(unmatched), ambiguous)
+    
+    return ownershipNetwork(newData, mapNodes)
+
+
+
+##  Same as cleanRawdata but reading the raw data file by chunks: the holders of each chunk are mapped to their parent entity
+#   and the ownership of the parent entities is accumulated, so that the memory needed depends on the size of the chunks 
+#   and not on the size of the file.
+#   @param fileName: csv file with the raw data (first column are the holders, other columns are the nodes)
+#   @param mapNodes: dictionary with the node information (see createNodesAttributes)
+#   @param chunkSize: number of rows read at once
+#   @param classifier, report: see cleanRawdata
+#
+def cleanRawdataChunked(fileName, mapNodes, chunkSize, classifier = None, report = True):
+    
+    if classifier is None:
+        classifier = compileAliases(loadEntityAliases(settings.ENTITY_ALIASES))
+    
+    newData = None
+    nbUnmatched = 0
+    ambiguous = {}
+    
+    # the first row after the header is skipped as in the full load of the file
+    for data in pd.read_csv(fileName, index_col = 0, skiprows = [1], chunksize = chunkSize):
+        
+        data = data.apply(pd.to_numeric)
+        chunkData, unmatched, chunkAmbiguous = aggregateHolders(data, classifier)
+        
+        newData = chunkData if newData is None else newData + chunkData
+        nbUnmatched = nbUnmatched + len(unmatched)
+        ambiguous.update(chunkAmbiguous)
+    
+    if report:
+        reportClassification(nbUnmatched, ambiguous)
+    
+    return ownershipNetwork(newData, mapNodes)
+
+
+
+##  Aggregate the ownership data of the holders belonging to the same parent entity 
+#   @param data: dataFrame with the raw data (index are the holders, columns are the nodes)
+#   @param classifier: compiled alias table (see compileAliases)
+#   @return dataFrame with the percentage of each node (rows) owned by each parent entity (columns), and the 
+#           unmatched and ambiguous holders (see classifyHolders)
 #
-def cleanRawdata(data, mapNodes):
-    
-    #Aggregate ownership data from subsidiaries of the same entity    
-    newData = pd.DataFrame([])
-    newData['JP Morgan Chase'] = data[data.index.str.contains("JPM")==True].sum()
-    newData['Morgan Stanley'] = data[data.index.str.contains('Morgan Stanley')==True].sum()
-    newData['Royal Bank of Canada'] = data[data.index.str.contains(r'RBC |[Rr]oyal.*[Bb]ank.*Canada')==True].sum()
-    newData['Royal Bank of Scotland'] = data[data.index.str.contains("Royal Bank of Scotland")==True].sum()
-    newData['Santander'] = data[data.index.str.contains("Santander")==True].sum()
-    newData['Société Generale'] = data[data.index.str.contains(r'[Ss]ociete [Gg]enerale|^SG ')==True].sum()
-    newData['Standard Chartered'] = data[data.index.str.contains("Standard Chartered")==True].sum()
-    newData['State Street'] = data[data.index.str.contains(r'State Street')==True].sum()
-    newData['Sumitomo Mitsui FG'] = data[data.index.str.contains("Sumitomo Mitsui")==True].sum()
-    newData['UBS'] = data[data.index.str.contains("UBS")==True].sum()
-    newData['Unicredit Group'] = data[data.index.str.contains(r'Uni[Cc]redit')==True].sum()
-    newData['Bank of New York Mellon'] = data[data.index.str.contains("Mellon")==True].sum()
-    newData['Credit Suisse'] = data[data.index.str.contains(r'[Cc]redit [sS]uisse|^CS ')==True].sum()
-    newData['Groupe Crédit Agricole'] = data[data.index.str.contains("Credit Agricole")==True].sum()
-    newData['ING'] = data[data.index.str.contains(r'^ING')==True].sum()
-    newData['Mizuho FG'] = data[data.index.str.contains("Mizuho")==True].sum()
-    newData['Nordea'] = data[data.index.str.contains("Nordea")==True].sum()
-    newData['Bank of America'] = data[data.index.str.contains(r'Ban[ck] of America|Merrill Lynch')==True].sum()
-    newData['Citigroup'] = data[data.index.str.contains(r'Citigroup|Citicorp|Citibank')==True].sum()
-    newData['Deutsche Bank'] = data[data.index.str.contains(r'Deutsche Bank|Deutsche Asset|Deutsche Invest|^DB ')==True].sum()
-    newData['HSBC'] = data[data.index.str.contains("HSBC")==True].sum()
-    newData['Barclays'] = data[data.index.str.contains("Barclays")==True].sum()
-    newData['BNP Paribas'] = data[data.index.str.contains("BNP ")==True].sum()
-    newData['Goldman Sachs'] = data[data.index.str.contains("Goldman Sachs")==True].sum()
-    newData['Industrial and Commercial Bank of China Limited'] = data[data.index.str.contains("ICBC")==True].sum()
-    newData['Mitsubishi UFJ FG'] = data[data.index.str.contains("Mitsubishi UFJ")==True].sum()
-    newData['Wells Fargo'] = data[data.index.str.contains("Wells Fargo")==True].sum()
-    newData['Bank of China'] = data[data.index.str.contains("Bank of China")==True].sum()
-    newData['China Construction Bank'] = data[data.index.str.contains("China Construction Bank")==True].sum()
-    newData['Agricultural Bank of China'] = data[data.index.str.contains("Agricultural Bank of China")==True].sum()
+def aggregateHolders(data, classifier):
+    
+    parents, unmatched, ambiguous = classifyHolders(data.index, classifier)
+    
+    newData = data.groupby(parents.values).sum().T
+    newData = newData.reindex(columns = classifier[2], fill_value = 0)
+    
+    return newData, unmatched, ambiguous
+
+
+
+##  Generate the network matrix from the percentage of each node owned by each parent entity (see aggregateHolders)
+#   @param newData: dataFrame with the percentage of each node (rows, factset names) owned by each parent entity (columns)
+#   @param mapNodes: dictionary with the node information (see createNodesAttributes)
+#
+def ownershipNetwork(newData, mapNodes):
     
     # Transform ownership data in $ terms
     for c in newData.columns:
@@ -158,48 +285,207 @@ def cleanRawdata(data, mapNodes):
 
 
 
+##  Generate the correlation network: position (i,j) contains the correlation of the excess returns of i and j over the 
+#   last 'window' days, if above settings.CORRELATION_THRESHOLD (0 otherwise). See correlationEdges
+#   @param allPrices: dataframe - index are days, columns labelled using nodes_id and benchmarks - values are closing prices
+#   @param period: number of days over which the returns are calculated
+#   @param window: number of returns used for the correlation
+#   @param nodesAttributes: dictionary with the nodes attributes (see createNodesAttributes)
+#   @return dataframe with rows and columns labelled with the keys of nodesAttributes
+#
 def correlationNetwork(allPrices, period, window, nodesAttributes):
-    allReturns = allPrices.pct_change(period)
-    allReturns = allReturns.drop(allReturns.index[0:period-1])
+    
+    matrix, nodes = correlationEdges(allPrices, period, window, nodesAttributes)
+    
+    return pd.DataFrame(matrix.toarray(), index = nodes, columns = nodes)
+
+
 
-    for k in nodesAttributes.keys():
-        symbol = nodesAttributes[k][1]
-        index = nodesAttributes[k][3]
-        allReturns[symbol + '-ER'] = allReturns[symbol] - allReturns[index] #calculate excess return series
+##  Blockwise version of the correlation network for large sets of nodes. The correlation matrix is computed by tiles
+#   of tileSize x tileSize nodes, distributed over a pool of threads; the threshold is applied to each tile and only the 
+#   surviving edges are kept, so the memory needed depends on the size of the tiles and on the number of edges.
+#   As in dataframe.corr(), for each pair of nodes only the days where both have a return are used.
+#   @param allPrices, period, window, nodesAttributes: see correlationNetwork
+#   @param tileSize: number of nodes in each tile
+#   @param nbWorkers: number of threads (default is the number of cores)
+#   @return scipy.sparse CSR matrix with the network and list of nodes (keys of nodesAttributes)
+#
+def correlationEdges(allPrices, period, window, nodesAttributes, tileSize = None, nbWorkers = None):
     
-    excessReturns = allReturns[[nodesAttributes[i][1] + '-ER' for i in nodesAttributes.keys()]]
-    excessReturns = excessReturns.iloc[-window:,:] # select only the last 'window' returns to calculate the correl
-    correlationMatrix = excessReturns.corr()
+    if tileSize is None:
+        tileSize = settings.CORRELATION_TILE
     
-    correlationMatrix[correlationMatrix<=0.3] = 0
-    correlationMatrix[correlationMatrix==1] = 0
+    # only the prices needed for the last 'window' returns are used
+    symbols = [nodesAttributes[k][1] for k in nodesAttributes.keys()]
+    benchmarks = list(dict.fromkeys(nodesAttributes[k][3] for k in nodesAttributes.keys()))
+    relevantPrices = allPrices[list(dict.fromkeys(symbols + benchmarks))].iloc[-(window + period):, :]
     
-    # transform the correlation into a distance
-    distances = correlationMatrix#np.sqrt(2*(1-correlationMatrix))
+    returns = excessReturns(relevantPrices, period, nodesAttributes).iloc[-window:, :]
+    nodes = list(returns.columns)
+    mask = ~np.isnan(returns.values)
+    X = np.where(mask, returns.values, 0)
+    M = mask.astype(float)
+    N = len(nodes)
     
-    inverseMap = {}
-    for k in nodesAttributes.keys():
-        inverseMap[nodesAttributes[k][1]] = k
+    tiles = [(i, j) for i in range(0, N, tileSize) for j in range(i, N, tileSize)]
     
-    # rename columns and indices using nodes keys
-    distances = distances.rename(columns=lambda x: x.replace('-ER', ''))
-    distances = distances.rename(index=lambda x: x.replace('-ER', ''))
+    with ThreadPoolExecutor(nbWorkers) as pool:
+        results = list(pool.map(lambda tile: _correlationTile(X, M, tile[0], tile[1], tileSize), tiles))
     
+    rows = np.concatenate([r[0] for r in results] + [np.zeros(0, dtype = int)])
+    cols = np.concatenate([r[1] for r in results] + [np.zeros(0, dtype = int)])
+    values = np.concatenate([r[2] for r in results] + [np.zeros(0)])
     
-    for i in inverseMap.keys():
-        distances = distances.rename(columns = {i:inverseMap[i] })
-        distances = distances.rename(index = {i:inverseMap[i] })
+    return sp.csr_matrix((values, (rows, cols)), shape = (N, N)), nodes
+
+
 
-    return distances
+##  Correlations between the nodes [i0, i0 + tileSize) and [j0, j0 + tileSize) above the threshold. The tiles below 
+#   the diagonal are not computed: the edges of the tiles above the diagonal are returned in both directions.
+#   @return rows, columns and values of the edges
+#
+def _correlationTile(X, M, i0, j0, tileSize):
+    
+    Xi, Mi = X[:, i0:i0 + tileSize], M[:, i0:i0 + tileSize]
+    Xj, Mj = X[:, j0:j0 + tileSize], M[:, j0:j0 + tileSize]
+    
+    # pairwise sums over the days where both nodes have a return
+    n = Mi.T @ Mj
+    Sx, Sy = Xi.T @ Mj, Mi.T @ Xj
+    Sxx, Syy = (Xi ** 2).T @ Mj, Mi.T @ (Xj ** 2)
+    Sxy = Xi.T @ Xj
+    
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        correlation = (n * Sxy - Sx * Sy) / np.sqrt((n * Sxx - Sx ** 2) * (n * Syy - Sy ** 2))
+    
+    keep = (correlation > settings.CORRELATION_THRESHOLD) & (correlation < 1)
+    rows, cols = np.nonzero(keep)
+    values = correlation[rows, cols]
+    rows, cols = rows + i0, cols + j0
+    
+    if i0 == j0:
+        offDiagonal = rows != cols
+        return rows[offDiagonal], cols[offDiagonal], values[offDiagonal]
+    
+    return np.concatenate([rows, cols]), np.concatenate([cols, rows]), np.concatenate([values, values])
 
 
 
-def main():
+## Excess return of each node over its market benchmark
+#  @param allPrices: dataframe - index are days, columns labelled using nodes_id and benchmarks - values are closing prices
+#  @param period: number of days over which the returns are calculated
+#  @param nodesAttributes: dictionary with the nodes attributes (see createNodesAttributes)
+#  @return dataframe - index are days, columns are the nodes (keys of nodesAttributes)
+#
+def excessReturns(allPrices, period, nodesAttributes):
+    allReturns = allPrices.pct_change(period)
+    allReturns = allReturns.drop(allReturns.index[0:period-1])
+    
+    symbols = [nodesAttributes[k][1] for k in nodesAttributes.keys()]
+    indices = [nodesAttributes[k][3] for k in nodesAttributes.keys()]
     
-    extensionList = ['2010-08-10', '2018-08-10']
+    return pd.DataFrame(allReturns[symbols].values - allReturns[indices].values, 
+                        index = allReturns.index, columns = list(nodesAttributes.keys()))
+
+
+
+## Generate the correlation network (as in correlationNetwork) for every day, each one based on the last 'window' excess
+#  returns up to and including that day. The window is moved one day at a time by adding the newest return and removing
+#  the oldest one from the running sums (rank-one updates), instead of recomputing the correlation of each window.
+#  The running sums are pairwise (only the days where both nodes have a return are used, as in dataframe.corr()) and 
+#  are recomputed from scratch every 'refresh' days to avoid the accumulation of rounding errors.
+#  @param allPrices, period, window, nodesAttributes: see correlationNetwork
+#  @param start: first day for which the network is generated (default is the first day with a full window)
+#  @param refresh: number of days between two full recomputations of the running sums (default is window)
+#  @return list of days, list of nodes (keys of nodesAttributes) and numpy array (days x nodes x nodes, float32) with 
+#          the network of each day
+#
+def rollingCorrelationNetworks(allPrices, period, window, nodesAttributes, start = None, refresh = None):
+    
+    returns = excessReturns(allPrices, period, nodesAttributes)
+    days = list(returns.index)
+    mask = ~np.isnan(returns.values)
+    X = np.where(mask, returns.values, 0)
+    M = mask.astype(float)
+    T, N = X.shape
+    
+    if refresh is None:
+        refresh = window
+    
+    # days for which a network is generated
+    first = window - 1
+    if start is not None:
+        first = max(first, int(np.searchsorted(np.array(days, dtype = str), start)))
+    networks = np.zeros((max(T - first, 0), N, N), dtype = np.float32)
+    
+    # pairwise running sums: number of observations, sum of x, sum of x^2 and sum of x*y for each pair (x,y)
+    n = np.zeros((N, N))
+    Sx = np.zeros((N, N))
+    Sxx = np.zeros((N, N))
+    Sxy = np.zeros((N, N))
+    
+    for t in range(T):
+        
+        if t % refresh == 0:
+            # full recomputation over the current window
+            lo = max(0, t - window + 1)
+            Xw, Mw = X[lo:t + 1], M[lo:t + 1]
+            n, Sx, Sxx, Sxy = Mw.T @ Mw, Xw.T @ Mw, (Xw ** 2).T @ Mw, Xw.T @ Xw
+        else:
+            # add the new day and remove the day leaving the window
+            n += np.outer(M[t], M[t])
+            Sx += np.outer(X[t], M[t])
+            Sxx += np.outer(X[t] ** 2, M[t])
+            Sxy += np.outer(X[t], X[t])
+            if t >= window:
+                old = t - window
+                n -= np.outer(M[old], M[old])
+                Sx -= np.outer(X[old], M[old])
+                Sxx -= np.outer(X[old] ** 2, M[old])
+                Sxy -= np.outer(X[old], X[old])
+        
+        if t >= first:
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                Sy, Syy = Sx.T, Sxx.T
+                correlation = (n * Sxy - Sx * Sy) / np.sqrt((n * Sxx - Sx ** 2) * (n * Syy - Sy ** 2))
+            
+            correlation[correlation <= settings.CORRELATION_THRESHOLD] = 0
+            correlation[correlation >= 1] = 0
+            np.fill_diagonal(correlation, 0)
+            networks[t - first] = correlation
+    
+    return days[first:], list(nodesAttributes.keys()), networks
+
+
+
+## Generate the database. 
+#  @param incremental: if False all the tables are created and populated from scratch. If True the existing database is updated:
+#                      missing tables are created, nodes are upserted, only the prices after the last stored date of each node
+#                      are appended and only the weights snapshots not yet stored are added
+#
+def main(incremental = False):
+    
+    extensionList = sorted(settings.EXTRACTION_DATES.values())
     networkAdj = {}
     correlationAdj = {}
     
+    # tables and weights snapshots already in the database. A database built before the nodesEdges table
+    # is migrated first, so that the snapshots already done are read from nodesEdges (used by Graph_Builder)
+    tables = set()
+    snapshots = set()
+    weightsSnapshots = set()
+    if incremental:
+        tables = db.getTables(settings.DB)
+        if 'nodesWeights' in tables:
+            if 'nodesEdges' not in tables:
+                db.createNodesEdges(settings.DB)
+                migrated = db.migrateNodesWeights(settings.DB)
+                tables.add('nodesEdges')
+                print('nodesEdges: ' + str(len(migrated)) + ' snapshots migrated from nodesWeights')
+            weightsSnapshots = db.getSnapshots(settings.DB, 'nodesWeights')
+        if 'nodesEdges' in tables:
+            snapshots = db.getSnapshots(settings.DB, 'nodesEdges')
+    
     # creates nodes attributes
     nodesAttributes, mapNodes = createNodesAttributes()
   
@@ -221,42 +507,59 @@ def main():
         year = extension[0:4]
         position = allPrices.index.get_loc(extension)
         
-        # Raw exposures data from facsect
-        data = pd.read_csv(settings.PATH + "RawData_" + year +".csv")
-        data.index = data.loc[:,data.columns[0]]
-        del data[data.columns[0]]
-        data = data.drop(data.index[0])
-        data = data.apply(pd.to_numeric)
-        
-        # consolidate and clean raw data
-        networkAdj[year] = cleanRawdata(data, mapNodes)
+        if (year, 'equityOwnership') not in snapshots:
+            
+            # Raw exposures data from facsect, consolidated and cleaned while reading the file by chunks
+            networkAdj[year] = cleanRawdataChunked(settings.PATH + "RawData_" + year +".csv", mapNodes, settings.RAW_CHUNK_SIZE)
         
         # Get the return data and calculate correlation only if there are at leat 100 datapoints available
-        if position >=100:
+        if position >=100 and (year, 'correlation') not in snapshots:
             relevantPrices = allPrices.iloc[:position,:]
             correlationAdj[year] = correlationNetwork(relevantPrices, settings.PERIOD, settings.WINDOW, nodesAttributes)
 
     
     # load data into sql tables
-    db.createNodesAttributes(settings.DB)
-    db.populateNodes(settings.DB, nodesAttributes)
-    
-    db.createNodesWeights(settings.DB, nodesAttributes)
-    
-    db.createPriceHistory(settings.DB)
-    db.populatePriceHistory(settings.DB, nodesAttributes, allPrices)
-    
-    db.createPriceHistoryUSD(settings.DB)
-    db.populatePriceHistoryUSD(settings.DB, nodesAttributes, allPricesUSD)
-    
-    for extension in extensionList:
-        year = extension[0:4]
-        position = allPrices.index.get_loc(extension)
-        db.populateNodesWeights(settings.DB, year, nodesAttributes, networkAdj[year], 'equityOwnership')
+    if 'nodesStatic' not in tables:
+        db.createNodesAttributes(settings.DB)
+    db.populateNodes(settings.DB, nodesAttributes, incremental)
+    
+    if 'nodesWeights' not in tables:
+        db.createNodesWeights(settings.DB, nodesAttributes)
+    else:
+        db.addNodesWeightsColumns(settings.DB, nodesAttributes)
+    if 'nodesEdges' not in tables:
+        db.createNodesEdges(settings.DB)
+    
+    if 'priceHistory' not in tables:
+        db.createPriceHistory(settings.DB)
+    nbRows, rowsPerSec = db.populatePriceHistory(settings.DB, nodesAttributes, allPrices, incremental)
+    print('priceHistory: ' + str(nbRows) + ' rows, ' + str(int(rowsPerSec)) + ' rows/sec')
+    
+    if 'priceHistoryUSD' not in tables:
+        db.createPriceHistoryUSD(settings.DB)
+    nbRows, rowsPerSec = db.populatePriceHistoryUSD(settings.DB, nodesAttributes, allPricesUSD, incremental)
+    print('priceHistoryUSD: ' + str(nbRows) + ' rows, ' + str(int(rowsPerSec)) + ' rows/sec')
+    
+    for year in networkAdj.keys():
+        if (year, 'equityOwnership') not in weightsSnapshots:
+            db.populateNodesWeights(settings.DB, year, nodesAttributes, networkAdj[year], 'equityOwnership')
+        db.populateNodesEdges(settings.DB, year, nodesAttributes, networkAdj[year], 'equityOwnership')
         
-        if position >=100:
+    for year in correlationAdj.keys():
+        if (year, 'correlation') not in weightsSnapshots:
             db.populateNodesWeights(settings.DB, year, nodesAttributes, correlationAdj[year], 'correlation')
+        db.populateNodesEdges(settings.DB, year, nodesAttributes, correlationAdj[year], 'correlation')
+    
+    # daily correlation networks (only the days after the last one already stored in incremental mode)
+    if settings.ROLLING_CORRELATION:
+        last = db.getLastSnapshotDate(settings.DB, 'rollingCorrelation') if incremental else None
+        newDays = [d for d in allPrices.index if last is None or d > str(last)]
+        if len(newDays) > 0:
+            days, nodes, networks = rollingCorrelationNetworks(allPrices, settings.PERIOD, settings.WINDOW, nodesAttributes, newDays[0])
+            nbRows, rowsPerSec = db.populateNodesEdgesHistory(settings.DB, days, nodes, nodesAttributes, networks, 'rollingCorrelation')
+            print('rollingCorrelation: ' + str(len(days)) + ' days, ' + str(nbRows) + ' rows, ' + str(int(rowsPerSec)) + ' rows/sec')
 
 
 
-main()
\ No newline at end of file
+# use "python DB_Generation.py --incremental" to update an existing database
+main('--incremental' in sys.argv)
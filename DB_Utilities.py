@@ -6,8 +6,130 @@ Description: set of functions to convert data from csv and json files into sqlli
 """
 
 import sqlite3
+import time
+import threading
+from contextlib import contextmanager
+from urllib.request import pathname2url
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 
+import settings
+
+
+
+
+##  Shared connections to a database, to be passed instead of the name of the database to the functions of this module.
+#   Each thread reads through its own connection (opened once, optionally read-only with a memory-mapped page cache)
+#   and all the writes go through a single connection in WAL mode, one transaction at a time. Can be used as a context
+#   manager that closes all the connections at the end. A pool must not be shared between processes.
+#
+class ConnectionPool():
+
+    ## @param DB is a string with the name and path of the database
+    #  @param readOnly: if True the read connections are opened with a mode=ro URI
+    #  @param mmapMB: size in MB of the memory-mapped page cache of the read connections (0 = no memory mapping)
+    #
+    def __init__(self, DB, readOnly = True, mmapMB = settings.SQLITE_MMAP_MB):
+
+        self.DB = DB
+        self.readOnly = readOnly
+        self.mmapMB = mmapMB
+        self._local = threading.local()     # read connection of each thread
+        self._readers = []                  # all the read connections (see close)
+        self._lock = threading.Lock()       # protects _readers
+        self._writeLock = threading.RLock() # held for the whole duration of a write transaction
+        self._writer = None
+
+
+    ## Return the read connection of the calling thread
+    #
+    def reader(self):
+
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            if self.readOnly:
+                db = sqlite3.connect('file:' + pathname2url(self.DB) + '?mode=ro', uri = True, check_same_thread = False)
+            else:
+                db = sqlite3.connect(self.DB, check_same_thread = False)
+            db.execute("PRAGMA mmap_size = " + str(int(self.mmapMB * 1024 * 1024)))
+            db.execute("PRAGMA cache_size = " + str(-int(settings.SQLITE_CACHE_KB)))
+            self._local.db = db
+            with self._lock:
+                self._readers.append(db)
+
+        return db
+
+
+    ## Context manager giving the write connection inside a transaction (committed at the end, rolled back on error)
+    #
+    @contextmanager
+    def writer(self):
+
+        with self._writeLock:
+            if self._writer is None:
+                self._writer = _bulkConnection(self.DB, check_same_thread = False)
+            with self._writer:
+                yield self._writer
+
+
+    ## Close all the connections
+    #
+    def close(self):
+
+        with self._lock:
+            for db in self._readers:
+                db.close()
+            self._readers = []
+            self._local = threading.local()
+        with self._writeLock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+## Connection used for the reads: the connection of the thread for a ConnectionPool, otherwise a new
+#  connection closed at the end
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#
+@contextmanager
+def _reader(DB):
+    if isinstance(DB, ConnectionPool):
+        yield DB.reader()
+    else:
+        db = sqlite3.connect(DB)
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+
+## Connection used for the writes, inside a transaction committed at the end: the write connection for a
+#  ConnectionPool, otherwise a new connection (tuned for bulk writes if bulk is True, see _bulkConnection)
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#
+@contextmanager
+def _writer(DB, bulk = False):
+    if isinstance(DB, ConnectionPool):
+        with DB.writer() as db:
+            yield db
+    else:
+        db = _bulkConnection(DB) if bulk else sqlite3.connect(DB)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
 
 
 
@@ -16,42 +138,43 @@ import pandas as pd
 #  name    is the comapny name
 #  currency is the currency denomination of the stock price
 #  benchmark is the relevant market benchmark, identified by the yahoo ticker
-#  @param DB is a string with the name and path of the database
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
 #
 def createNodesAttributes(DB):
-    db = sqlite3.connect(DB)  
-    cursor = db.cursor() 
-    cursor.execute('''
-    		CREATE TABLE nodesStatic (
-    		node_id     varchar    PRIMARY KEY,
-    		name        text        NOT NULL,
-    		currency    varchar(3)  NOT NULL,
-            benchmark   varchar
-    			);
-    		''')
-    db.commit()
-    db.close()
+    with _writer(DB) as db:
+        cursor = db.cursor() 
+        cursor.execute('''
+        		CREATE TABLE nodesStatic (
+        		node_id     varchar    PRIMARY KEY,
+        		name        text        NOT NULL,
+        		currency    varchar(3)  NOT NULL,
+                benchmark   varchar
+        			);
+        		''')
 
 
 
 ## Populate the Nodes table using data from the nodesAttributes dictionary
-#  @param DB is a string with the name and path of the database
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
 #  @nodesAttributes dictionary - keys are node identifiers and values are list of attributes 
+#  @param incremental: if True existing nodes are updated instead of raising an error
 #
-def populateNodes(DB, nodesAttributes):
-    db = sqlite3.connect(DB)  
-    cursor = db.cursor()
-    
-    for k in nodesAttributes.keys():
-        name = k
-        node_id = nodesAttributes[k][1]
-        currency = nodesAttributes[k][2]
-        benchmark = nodesAttributes[k][3]
-        cursor.execute("""INSERT INTO nodesStatic VALUES (?,?,?,?)""", 
-                       (node_id, name, currency, benchmark))
+def populateNodes(DB, nodesAttributes, incremental = False):
+    with _writer(DB) as db:
+        cursor = db.cursor()
+    
+        statement = """INSERT INTO nodesStatic VALUES (?,?,?,?)"""
+        if incremental:
+            statement = statement + """ ON CONFLICT(node_id) DO UPDATE SET name = excluded.name, 
+                        currency = excluded.currency, benchmark = excluded.benchmark"""
+    
+        for k in nodesAttributes.keys():
+            name = k
+            node_id = nodesAttributes[k][1]
+            currency = nodesAttributes[k][2]
+            benchmark = nodesAttributes[k][3]
+            cursor.execute(statement, (node_id, name, currency, benchmark))
         
-    db.commit()
-    db.close()
 
 
 
@@ -60,62 +183,216 @@ def populateNodes(DB, nodesAttributes):
 #  year    is the year to which the weight refer
 #  all other columns are identified by the yahoo ticker for the companies and 
 #  contain the percentage of that company owned by the node_id
-#  @param DB is a string with the name and path of the database
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
 #  @nodesAttributes dictionary - keys are node identifiers and values are list of attributes (one attribute must be current mkt_cap)
 #  @method string with the name of the method used for the weights generation
 #
 def createNodesWeights(DB, nodesAttributes):
-    db = sqlite3.connect(DB)  
-    cursor = db.cursor() 
-    cursor.execute('''
-    		CREATE TABLE nodesWeights (
-    		node_id     varchar NOT NULL REFERENCES nodes(node_id),  --foreign key  
-    		date        YEAR         NOT NULL,
-         method      varchar NOT NULL,
-         PRIMARY KEY (node_id, date, method) 
-    			);
-    		''')
+    with _writer(DB) as db:
+        cursor = db.cursor() 
+        cursor.execute('''
+        		CREATE TABLE nodesWeights (
+        		node_id     varchar NOT NULL REFERENCES nodes(node_id),  --foreign key  
+        		date        YEAR         NOT NULL,
+             method      varchar NOT NULL,
+             PRIMARY KEY (node_id, date, method) 
+        			);
+        		''')
     
-    for k in nodesAttributes.keys():   
-        name = "OWNED_OF_" + nodesAttributes[k][1].replace(".", "_").replace("-", "_")
-        cursor.execute('''ALTER TABLE nodesWeights ADD COLUMN ''' + name + ''' varchar''')
+        for k in nodesAttributes.keys():   
+            name = "OWNED_OF_" + nodesAttributes[k][1].replace(".", "_").replace("-", "_")
+            cursor.execute('''ALTER TABLE nodesWeights ADD COLUMN ''' + name + ''' varchar''')
     
-    db.commit()
-    db.close()
 
 
 
 ## Populate the NodesWeights table using data from the Network dataframe
 #  @param year is a string with the reference year for the weights
-#  @param DB is a string with the name and path of the database
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
 #  @param nodesAttributes dictionary - keys are node identifiers and values are list of attributes (one attribute must be current mkt_cap)
 #  @param network: dataFrame - rown and columns labelled based on nodes id - position
 #  @_method string with the name of the method used for the weights generation
 #
 def populateNodesWeights(DB, year, nodesAttributes, network, _method):
-    db = sqlite3.connect(DB)  
-    cursor = db.cursor() 
+    with _writer(DB) as db:
+        cursor = db.cursor() 
    
     
-    allColumns = {}
+        allColumns = {}
     
-    for k in nodesAttributes.keys():  
-        name = "OWNED_OF_" + nodesAttributes[k][1].replace(".", "_").replace("-", "_")
-        allColumns[name] = k
+        for k in nodesAttributes.keys():  
+            name = "OWNED_OF_" + nodesAttributes[k][1].replace(".", "_").replace("-", "_")
+            allColumns[name] = k
+
+        for k in nodesAttributes.keys():
+            date = year
+            node_id = nodesAttributes[k][1]
+            cursor.execute("""INSERT INTO nodesWeights (node_id, date, method ) VALUES (?,?,?) """, 
+                           (node_id, date, _method))
+        
+            for c in allColumns.keys():
+                value = network.loc[k, allColumns[c]]
+                cursor.execute("UPDATE nodesWeights SET " + c + "=? WHERE node_id=? AND date=? AND method=?",
+                               (value, node_id, date, _method))
+        
+
+## Add to the nodesWeights table the columns of the nodes that are not yet in the table
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @nodesAttributes dictionary - keys are node identifiers and values are list of attributes
+#
+def addNodesWeightsColumns(DB, nodesAttributes):
+    with _writer(DB) as db:
+        cursor = db.cursor() 
+        cursor.execute("SELECT * FROM nodesWeights LIMIT 0")
+        existing = {d[0] for d in cursor.description}
+    
+        for k in nodesAttributes.keys():   
+            name = "OWNED_OF_" + nodesAttributes[k][1].replace(".", "_").replace("-", "_")
+            if name not in existing:
+                cursor.execute('''ALTER TABLE nodesWeights ADD COLUMN ''' + name + ''' varchar''')
+    
+
+
 
-    for k in nodesAttributes.keys():
-        date = year
-        node_id = nodesAttributes[k][1]
-        cursor.execute("""INSERT INTO nodesWeights (node_id, date, method ) VALUES (?,?,?) """, 
-                       (node_id, date, _method))
+## Create a table with the weights of the network in long format (one row per non zero edge), 
+#  alternative to nodesWeights that does not need one column per node
+#  src     is the yahoo ticker of the node exerting the impact
+#  dst     is the yahoo ticker of the node receiving the impact (i.e. the node owning src)
+#  date    is the year to which the weight refer
+#  method  is the name of the method used for the weights generation
+#  weight  is the impact of src over dst
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#
+def createNodesEdges(DB):
+    with _writer(DB) as db:
+        cursor = db.cursor() 
+        cursor.execute('''
+        		CREATE TABLE nodesEdges (
+        		src         varchar NOT NULL REFERENCES nodes(node_id),  --foreign key  
+        		dst         varchar NOT NULL REFERENCES nodes(node_id),  --foreign key  
+        		date        YEAR         NOT NULL,
+             method      varchar NOT NULL,
+             weight      REAL    NOT NULL,
+             PRIMARY KEY (date, method, src, dst) 
+        			);
+        		''')
+        cursor.execute('''CREATE INDEX nodesEdges_dst ON nodesEdges (date, method, dst, src)''')
+        cursor.execute('''CREATE INDEX nodesEdges_src ON nodesEdges (src, date, method)''')
+    
+
+
+
+## Insert into nodesEdges the non zero weights of a dataFrame where columns and rows are identified 
+#  via the yahoo ticker of the node and the position (i,j) contains the impact of j over i
+#
+def _insertEdges(cursor, date, _method, weights):
+    
+    values = np.nan_to_num(np.asarray(weights.values, dtype = float))
+    rows, cols = np.nonzero(values)
+    dst = weights.index.values[rows]
+    src = weights.columns.values[cols]
+    
+    cursor.executemany("""INSERT INTO nodesEdges (src, dst, date, method, weight) VALUES (?,?,?,?,?) """,
+                       zip(src.tolist(), dst.tolist(), [date] * len(rows), [_method] * len(rows), values[rows, cols].tolist()))
+
+
+
+## Populate the nodesEdges table using data from the Network dataframe (same parameters as populateNodesWeights)
+#  @param year is a string with the reference year for the weights
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @param nodesAttributes dictionary - keys are node identifiers and values are list of attributes
+#  @param network: dataFrame - rown and columns labelled based on nodes id - position (i,j) contains the impact of j over i
+#  @_method string with the name of the method used for the weights generation
+#
+def populateNodesEdges(DB, year, nodesAttributes, network, _method):
+    with _writer(DB) as db:
+        cursor = db.cursor() 
+    
+        tickers = {k: nodesAttributes[k][1] for k in nodesAttributes.keys()}
+        _insertEdges(cursor, year, _method, network.rename(index = tickers, columns = tickers))
         
-        for c in allColumns.keys():
-            value = network.loc[k, allColumns[c]]
-            cursor.execute("UPDATE nodesWeights SET " + c + "=? WHERE node_id=? AND date=? AND method=?",
-                           (value, node_id, date, _method))
+
+
+
+## Populate the nodesEdges table with a network stored as a sparse matrix (e.g. from DB_Generation.correlationEdges), 
+#  without building the dense dataFrame
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @param year is a string with the reference year for the weights
+#  @param nodesAttributes dictionary - keys are node identifiers and values are list of attributes
+#  @param matrix: scipy.sparse matrix - position (i,j) contains the impact of nodes[j] over nodes[i]
+#  @param nodes: list of nodes (keys of nodesAttributes), in the order of the rows and columns of the matrix
+#  @_method string with the name of the method used for the weights generation
+#  @return number of rows inserted and rows per second
+#
+def populateNodesEdgesSparse(DB, year, nodesAttributes, matrix, nodes, _method):
+    
+    tickers = np.array([nodesAttributes[k][1] for k in nodes])
+    matrix = sp.coo_matrix(matrix)
+    keep = np.nan_to_num(matrix.data) != 0
+    rows = zip(tickers[matrix.col[keep]].tolist(), tickers[matrix.row[keep]].tolist(), [year] * int(keep.sum()), 
+               [_method] * int(keep.sum()), matrix.data[keep].astype(float).tolist())
+    
+    return _bulkInsert(DB, """INSERT INTO nodesEdges (src, dst, date, method, weight) VALUES (?,?,?,?,?) """, rows)
+
+
+
+## Populate the nodesEdges table with a time series of networks (one snapshot per date), in a single transaction
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @param dates: list with the date of each snapshot
+#  @param nodes: list of nodes (keys of nodesAttributes), in the order of the rows and columns of the networks
+#  @param nodesAttributes dictionary - keys are node identifiers and values are list of attributes
+#  @param networks: numpy array (dates x nodes x nodes) - position (t,i,j) contains the impact of j over i at the date t
+#  @_method string with the name of the method used for the weights generation
+#  @return number of rows inserted and rows per second
+#
+def populateNodesEdgesHistory(DB, dates, nodes, nodesAttributes, networks, _method):
+    
+    tickers = np.array([nodesAttributes[k][1] for k in nodes])
+    dates = np.array(dates, dtype = str)
+    t, i, j = np.nonzero(np.nan_to_num(networks))
+    rows = zip(tickers[j].tolist(), tickers[i].tolist(), dates[t].tolist(), [_method] * len(t), 
+               networks[t, i, j].astype(float).tolist())
+    
+    return _bulkInsert(DB, """INSERT INTO nodesEdges (src, dst, date, method, weight) VALUES (?,?,?,?,?) """, rows)
+
+
+
+## Get the last date stored in the nodesEdges table for a method (None if there is no snapshot)
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @_method string with the name of the method used for the weights generation
+#
+def getLastSnapshotDate(DB, _method):
+    
+    with _reader(DB) as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT MAX(date) FROM nodesEdges WHERE method = ?", (_method,))
+        last = cursor.fetchone()[0]
+    
+    return last
+
+
+
+## Copy into the nodesEdges table the snapshots of the nodesWeights table that it does not contain yet
+#  (the migration can be run again safely)
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @return list of the (date, method) pairs copied
+#
+def migrateNodesWeights(DB):
+    with _writer(DB) as db:
+        cursor = db.cursor() 
+        cursor.execute("SELECT DISTINCT date, method FROM nodesWeights")
+        snapshots = cursor.fetchall()
+        cursor.execute("SELECT DISTINCT date, method FROM nodesEdges")
+        done = set(cursor.fetchall())
         
-    db.commit()
-    db.close()
+        snapshots = [s for s in snapshots if tuple(s) not in done]
+        for date, _method in snapshots:
+            _insertEdges(cursor, date, _method, getNodesWeights(DB, date, _method))
+    
+    return snapshots
+    
+
+
 
 ## Create a table with all nodes historical prices and mkt cap
 #  node_id is the yahoo company ticker
@@ -123,57 +400,58 @@ def populateNodesWeights(DB, year, nodesAttributes, network, _method):
 #  price   is the closing price in local currency
 #  market_cap is the market cap in USD
 #  nb_shares is the number of outstanding shares
-#  @param DB is a string with the name and path of the database
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
 #
 def createPriceHistoryUSD(DB):
-    db = sqlite3.connect(DB)  
-    cursor = db.cursor() 
-    cursor.execute('''
-    		CREATE TABLE priceHistoryUSD (
-    		node_id     varchar NOT NULL REFERENCES nodes(node_id),  --foreign key  
-    		date        DATE        NOT NULL,
-         price       DOUBLE,
-         market_cap  DOUBLE,
-         nb_shares   DOUBLE,
-         PRIMARY KEY (node_id, date) 
-    			);
-    		''')
+    with _writer(DB) as db:
+        cursor = db.cursor() 
+        cursor.execute('''
+        		CREATE TABLE priceHistoryUSD (
+        		node_id     varchar NOT NULL REFERENCES nodes(node_id),  --foreign key  
+        		date        DATE        NOT NULL,
+             price       DOUBLE,
+             market_cap  DOUBLE,
+             nb_shares   DOUBLE,
+             PRIMARY KEY (node_id, date) 
+        			);
+        		''')
     
-    db.commit()
-    db.close()
 
 
 
-## Populate the PriceHistory table using data from the allPrices dataframe
-#  @param DB is a string with the name and path of the database
+## Populate the PriceHistory table using data from the allPrices dataframe.
+#  Market caps and number of shares are calculated for all the nodes at once and all the rows are 
+#  written in a single transaction (see _bulkInsert)
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
 #  @param nodesAttributes dictionary - keys are node identifiers and values are list of attributes (one attribute must be current mkt_cap)
 #  @param allPrices - dataframe - index are days, columns labelled using nodes_id - values are closing prices
+#  @param incremental: if True only the dates after the last date stored for each node are written (as upserts) and the 
+#                      number of shares already stored is used for the existing nodes
+#  @return number of rows inserted and rows per second
 #
-def populatePriceHistoryUSD(DB, nodesAttributes, allPrices):
+def populatePriceHistoryUSD(DB, nodesAttributes, allPrices, incremental = False):
     
-    db = sqlite3.connect(DB)  
-    cursor = db.cursor() 
     day = '2018-06-12' #last day of available information
-    allPrices1 = allPrices.drop(day)
-
-    for k in nodesAttributes.keys():
-        
-        node_id = nodesAttributes[k][1]
-        mktCap = nodesAttributes[k][0]
-        nbShares = mktCap/allPrices.loc[day, node_id]
-        price = allPrices.loc[day, node_id]
-        cursor.execute("""INSERT INTO priceHistoryUSD (node_id, date, market_cap, nb_shares, price) VALUES (?,?,?,?,?) """, 
-                       (node_id, day,mktCap,nbShares, price))
-        
-        
-        for c in allPrices1.index:
-            value = allPrices1.loc[c, node_id]
-            mktCap = nbShares * value
-            cursor.execute("""INSERT INTO priceHistoryUSD (node_id, date, market_cap, nb_shares, price) VALUES (?,?,?,?,?) """, 
-                       (node_id, c, mktCap,nbShares, value))
-        
-    db.commit()
-    db.close()
+    tickers = [nodesAttributes[k][1] for k in nodesAttributes.keys()]
+    mktCaps = np.array([nodesAttributes[k][0] for k in nodesAttributes.keys()], dtype = float)
+    
+    prices = allPrices[tickers]
+    nbShares = mktCaps / prices.loc[day].values.astype(float)
+    
+    lastDates = None
+    statement = """INSERT INTO priceHistoryUSD (node_id, date, market_cap, nb_shares, price) VALUES (?,?,?,?,?) """
+    if incremental:
+        lastDates = getLastDates(DB, 'priceHistoryUSD')
+        storedShares = getNbShares(DB)
+        nbShares = np.array([storedShares.get(tickers[i], nbShares[i]) for i in range(len(tickers))], dtype = float)
+        statement = statement + """ON CONFLICT(node_id, date) DO UPDATE SET market_cap = excluded.market_cap, 
+                    nb_shares = excluded.nb_shares, price = excluded.price"""
+    
+    nodeIdx, dates, values = _meltPrices(prices, lastDates)
+    rows = zip(np.array(tickers)[nodeIdx].tolist(), dates.tolist(), (values * nbShares[nodeIdx]).tolist(),
+               nbShares[nodeIdx].tolist(), values.tolist())
+    
+    return _bulkInsert(DB, statement, rows)
 
 
 
@@ -182,96 +460,267 @@ def populatePriceHistoryUSD(DB, nodesAttributes, allPrices):
 #  node_id is the yahoo company ticker
 #  date    is the day
 #  price   is the closing price in local currency
-#  @param DB is a string with the name and path of the database
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
 #
 def createPriceHistory(DB):
-    db = sqlite3.connect(DB)  
-    cursor = db.cursor() 
-    cursor.execute('''
-    		CREATE TABLE priceHistory (
-    		node_id     varchar NOT NULL REFERENCES nodes(node_id),  --foreign key  
-    		date        DATE        NOT NULL,
-         price       DOUBLE,
-         PRIMARY KEY (node_id, date) 
-    			);
-    		''')
+    with _writer(DB) as db:
+        cursor = db.cursor() 
+        cursor.execute('''
+        		CREATE TABLE priceHistory (
+        		node_id     varchar NOT NULL REFERENCES nodes(node_id),  --foreign key  
+        		date        DATE        NOT NULL,
+             price       DOUBLE,
+             PRIMARY KEY (node_id, date) 
+        			);
+        		''')
     
-    db.commit()
-    db.close()
 
 
 
-## Populate the PriceHistory table using data from the allPrices dataframe
-#  @param DB is a string with the name and path of the database
+## Populate the PriceHistory table using data from the allPrices dataframe.
+#  The dataframe is reshaped once and all the rows are written in a single transaction (see _bulkInsert)
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
 #  @param nodesAttributes dictionary - keys are node identifiers and values are list of attributes 
 #  @param allPrices - dataframe - index are days, columns labelled using nodes_id - values are closing prices
+#  @param incremental: if True only the dates after the last date stored for each node are written (as upserts)
+#  @return number of rows inserted and rows per second
 #
-def populatePriceHistory(DB, nodesAttributes, allPrices):
+def populatePriceHistory(DB, nodesAttributes, allPrices, incremental = False):
+    
+    tickers = [nodesAttributes[k][1] for k in nodesAttributes.keys()]
     
-    db = sqlite3.connect(DB)  
-    cursor = db.cursor() 
+    lastDates = None
+    statement = """INSERT INTO priceHistory (node_id, date, price) VALUES (?,?,?) """
+    if incremental:
+        lastDates = getLastDates(DB, 'priceHistory')
+        statement = statement + """ON CONFLICT(node_id, date) DO UPDATE SET price = excluded.price"""
+    
+    nodeIdx, dates, values = _meltPrices(allPrices[tickers], lastDates)
+    rows = zip(np.array(tickers)[nodeIdx].tolist(), dates.tolist(), values.tolist())
+    
+    return _bulkInsert(DB, statement, rows)
 
-    for k in nodesAttributes.keys():
-        
-        node_id = nodesAttributes[k][1]
 
-        for c in allPrices.index:
-            price = allPrices.loc[c, node_id]
-            cursor.execute("""INSERT INTO priceHistory (node_id, date, price) VALUES (?,?,?) """, 
-                       (node_id, c, price))
-        
-    db.commit()
-    db.close()
 
-## Get data from the nodesAttribute DB and store them into a dictionary
+## Reshape a price dataframe (index are days, columns are nodes) into flat arrays with one element per (node, date),
+#  grouped by node
+#  @param prices: dataframe with the prices
+#  @param lastDates: optional dictionary with the last date already stored for each node. Only later dates are kept
+#  @return position of the node in the columns, date and price for each element
+#
+def _meltPrices(prices, lastDates = None):
+    
+    values = prices.values.astype(float).T
+    nbNodes, nbDates = values.shape
+    nodeIdx = np.repeat(np.arange(nbNodes), nbDates)
+    dates = np.tile(prices.index.values.astype(str), nbNodes)
+    values = values.ravel()
+    
+    if lastDates is not None:
+        last = np.array([lastDates.get(n, '') for n in prices.columns], dtype = str)[nodeIdx]
+        keep = dates > last
+        nodeIdx, dates, values = nodeIdx[keep], dates[keep], values[keep]
+    
+    return nodeIdx, dates, values
+
+
+
+## Open a connection tuned for bulk writes: WAL journal, reduced synchronisation and large page cache.
+#  The page size is applied only if the database is still empty.
 #  @param DB is a string with the name and path of the database
+#  @param check_same_thread: False if the connection is shared between threads (see ConnectionPool)
+#
+def _bulkConnection(DB, check_same_thread = True):
+    db = sqlite3.connect(DB, check_same_thread = check_same_thread)
+    db.execute("PRAGMA page_size = " + str(int(settings.SQLITE_PAGE_SIZE)))
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    db.execute("PRAGMA cache_size = " + str(-int(settings.SQLITE_CACHE_KB)))
+    
+    return db
+
+
+
+## Write all the rows with executemany inside a single transaction
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @param statement: INSERT statement with placeholders
+#  @param rows: iterable of tuples
+#  @return number of rows inserted and rows per second
+#
+def _bulkInsert(DB, statement, rows):
+    
+    start = time.perf_counter()
+    
+    with _writer(DB, bulk = True) as db:
+        cursor = db.executemany(statement, rows)
+        nbRows = cursor.rowcount
+    
+    elapsed = time.perf_counter() - start
+    
+    return nbRows, nbRows / elapsed if elapsed > 0 else float('inf')
+
+## Get the names of the tables in the database
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#
+def getTables(DB):
+    
+    with _reader(DB) as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {r[0] for r in cursor.fetchall()}
+    
+    return tables
+
+## Get the set of (date, method) pairs of the snapshots stored in a weights table
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @param table: 'nodesWeights' or 'nodesEdges'
+#
+def getSnapshots(DB, table = 'nodesWeights'):
+    
+    with _reader(DB) as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT DISTINCT date, method FROM " + table)
+        snapshots = {(str(r[0]), r[1]) for r in cursor.fetchall()}
+    
+    return snapshots
+
+## Get the market cap (in USD) of each node as of a date, i.e. on the last day before or equal to the date
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @param date: string with the date (YYYY-MM-DD)
+#
+def getMarketCapsAsOf(DB, date):
+    
+    with _reader(DB) as db:
+        cursor = db.cursor()
+        # the bare column market_cap is taken from the row with the last date
+        cursor.execute("SELECT node_id, market_cap, MAX(date) FROM priceHistoryUSD WHERE date <= ? GROUP BY node_id", (date,))
+        marketCaps = {r[0]: float(r[1]) for r in cursor.fetchall() if r[1] is not None}
+    
+    return marketCaps
+
+## Get the date of the last snapshot of a weights table for a method as of a date (None if there is none). 
+#  Snapshot dates can be years ('2018') or days ('2018-06-12'): a year is only available from the extraction date
+#  of its ownership file (settings.EXTRACTION_DATES), or from its last day if the date is not known.
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @param date: string with the date (YYYY-MM-DD)
+#  @param _method string with the name of the method used for the weights generation
+#  @param table: 'nodesWeights' or 'nodesEdges'
+#  @return the snapshot date as stored in the table (e.g. '2018')
+#
+def getSnapshotAsOf(DB, date, _method, table = 'nodesEdges'):
+    
+    available = {d: snapshotAvailability(d) for d, m in getSnapshots(DB, table) if m == _method}
+    dates = [d for d in available.keys() if available[d] <= date]
+    
+    return max(dates, key = lambda d: available[d]) if len(dates) > 0 else None
+
+## Date (YYYY-MM-DD) from which a snapshot is available (see getSnapshotAsOf)
+#
+def snapshotAvailability(snapshotDate):
+    
+    if len(snapshotDate) == 4:
+        return settings.EXTRACTION_DATES.get(snapshotDate, snapshotDate + '-12-31')
+    
+    return snapshotDate
+
+## Get the last date stored for each node in a price table
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @param table: 'priceHistory' or 'priceHistoryUSD'
+#
+def getLastDates(DB, table):
+    
+    with _reader(DB) as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT node_id, MAX(date) FROM " + table + " GROUP BY node_id")
+        lastDates = {r[0]: r[1] for r in cursor.fetchall()}
+    
+    return lastDates
+
+## Get the number of shares stored for each node in the priceHistoryUSD table
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#
+def getNbShares(DB):
+    
+    with _reader(DB) as db:
+        cursor = db.cursor()
+        # the bare column nb_shares is taken from the row with the last date
+        cursor.execute("SELECT node_id, nb_shares, MAX(date) FROM priceHistoryUSD GROUP BY node_id")
+        nbShares = {r[0]: r[1] for r in cursor.fetchall()}
+    
+    return nbShares
+
+## Get data from the nodesAttribute DB and store them into a dictionary
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
 #
 def getNodesAttributes(DB):
     
-    db = sqlite3.connect(DB)
-    cursor = db.cursor()
-    cursor.execute('''SELECT node_id, name, currency, benchmark FROM nodesStatic''')
-    all_rows = cursor.fetchall()
-    nodesAttributes = {}
+    with _reader(DB) as db:
+        cursor = db.cursor()
+        cursor.execute('''SELECT node_id, name, currency, benchmark FROM nodesStatic''')
+        all_rows = cursor.fetchall()
+        nodesAttributes = {}
     
-    for r in all_rows:
-        nodesAttributes[r[0]] = list(r[1:])
+        for r in all_rows:
+            nodesAttributes[r[0]] = list(r[1:])
         
-    db.close()
     
     return nodesAttributes
 
 ## Get data from the nodesWeights DB and store them into a dataframe where columns and rows 
 #  are identified via the yahoo ticker of the node. The position (i,j) contains the impact of 
-#  of j over i.
-#  @param DB is a string with the name and path of the database
+#  of j over i. All the weights are read with a single query.
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
 #  @param year is a string with the reference year for the weights
 #
 def getNodesWeights(DB, year, _method):
     
-    db = sqlite3.connect(DB)
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM nodesWeights WHERE date = ? AND method = ?", (year,_method))
-    all_rows = cursor.fetchall()
-    allNames = {}
-    for r in all_rows:
-        adjusted = "OWNED_OF_" + r[0].replace(".", "_").replace("-", "_")
-        allNames[adjusted] = r[0]
-
-    
+    with _reader(DB) as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT * FROM nodesWeights WHERE date = ? AND method = ?", (year,_method))
+        all_rows = cursor.fetchall()
+        columnNames = [d[0] for d in cursor.description]
     
-    weights = pd.DataFrame(index = allNames.values(), columns = allNames.keys())
+    # position of the column OWNED_OF_<node> for each node, in the same order as the rows
+    nodes = [r[0] for r in all_rows]
+    positions = [columnNames.index("OWNED_OF_" + n.replace(".", "_").replace("-", "_")) for n in nodes]
     
-    for n in allNames.values():
-        for m in allNames.keys():
-            cursor.execute("SELECT " + m + " FROM nodesWeights WHERE date = ? AND node_id = ? AND method = ?", 
-                           (year,n,_method))
-            value = cursor.fetchone()
-            weights.loc[n,m] = float(value[0])
-    
-    weights = weights.rename(columns=allNames)
-    db.close()
+    values = np.array(all_rows, dtype = object).reshape(len(all_rows), len(columnNames))[:, positions].astype(float)
+    weights = pd.DataFrame(values, index = nodes, columns = nodes)
     
     return weights
 
 
+
+## Get data from the nodesEdges DB. The nodes are all the nodes of the nodesStatic table (plus any other node
+#  found in the edges), in the order of the nodesStatic table.
+#  @param DB is a string with the name and path of the database (or a ConnectionPool)
+#  @param year is a string with the reference year for the weights
+#  @param _method string with the name of the method used for the weights generation
+#  @param sparse: if True return a scipy.sparse CSR matrix and the list of nodes, otherwise a dataFrame as getNodesWeights.
+#                 In both cases the position (i,j) contains the impact of j over i.
+#
+def getNodesEdges(DB, year, _method, sparse = False):
+    
+    with _reader(DB) as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT node_id FROM nodesStatic ORDER BY rowid")
+        nodes = [r[0] for r in cursor.fetchall()]
+        cursor.execute("SELECT src, dst, weight FROM nodesEdges WHERE date = ? AND method = ?", (year,_method))
+        all_rows = cursor.fetchall()
+    
+    nodeIndex = {nodes[i]: i for i in range(len(nodes))}
+    for r in all_rows:
+        for n in r[:2]:
+            if n not in nodeIndex:
+                nodeIndex[n] = len(nodes)
+                nodes.append(n)
+    
+    src = np.array([nodeIndex[r[0]] for r in all_rows], dtype = int)
+    dst = np.array([nodeIndex[r[1]] for r in all_rows], dtype = int)
+    values = np.array([r[2] for r in all_rows], dtype = float)
+    weights = sp.csr_matrix((values, (dst, src)), shape = (len(nodes), len(nodes)))
+    
+    if sparse:
+        return weights, nodes
+    
+    return pd.DataFrame(weights.toarray(), index = nodes, columns = nodes)
@@ -13,18 +13,35 @@ Program:                Data Science
 
 
 
+import os
+import time
+import hashlib
 import pandas as pd
 import numpy as np
 import networkx as nx
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+import Force_Layout as fl
 
 
 
 ##  Class implementing the FinancialNetwork object as a child of the Dirct Graph class from the
 #   library networkx. In addition to all the functionalities of DirecGraph, the financialNetwork class
 #   contains the following methods:
+#   - fromMatrix: Construct the network from a numpy array or a scipy.sparse matrix
 #   - debtRankCentrality: Calculate the centrality measure for each node using the debtRank algorithm
+#                         and return the full impact matrix
+#   - whatIf: Apply a batch of changes of the weights of the edges and update the results of debtRankCentrality
+#             incrementally (only the shocks that can reach the modified edges are propagated again)
 #   - mainStats: Generate a summary of all the main statistics relevant for the graph
-#   - saveNetwork: Save the graph into a .gexf file
+#   - saveNetwork: Save the graph into a .gexf file or a compact binary .npz file
+#   and the following cached attributes (built at the first access and reset by the methods adding or removing nodes
+#   and edges; clearCache must be called after a change of the weights made in place, e.g. G[u][v]['weight'] = w):
+#   - nodeList: list of the nodes in the order used for the matrices
+#   - nodeIndex: dictionary with the position of each node in nodeList
+#   - adjacencyMatrix: scipy.sparse CSR matrix where position (k,j) contains the weight of the edge from k to j
+#   - weightsSplit: split of adjacencyMatrix used by the debt rank (see WeightsSplit)
 #  
 class FinancialNetwork(nx.DiGraph):
  
@@ -35,50 +52,221 @@ class FinancialNetwork(nx.DiGraph):
     #                           the values for a list of static attributes
     #  @param attributeNames: list containing the names (as strng) of the various attributes from the 
     #                         dictionary staticAttributes
+    #  @param G: existing graph to be copied (used instead of weights)
+    #  @param threshold: only the edges with a weight above threshold are added to the graph
     #
-    def __init__(self, weights = None, staticAttributes = None, attributeNames = None, G = None):
+    def __init__(self, weights = None, staticAttributes = None, attributeNames = None, G = None, threshold = 0):
         
+        self.version = 0                # increased by each change of the nodes or of the edges (see clearCache)
+        self._matrixCache = None
+        self._matrixVersion = None      # version of the network when the cached matrices were built
+        self._splitCache = None         # WeightsSplit of the adjacency matrix (see weightsSplit)
+        self._impactCache = None        # results of the last debtRankCentrality (see whatIf)
+        self._reachabilityCache = None  # strongly connected components (see _ancestors)
         super().__init__(self)
         
-        if G != None:
+        if G is not None:
             
             nodes = G.nodes(data=True)
-            edges = G.edges(data=True)
+            edges = [e for e in G.edges(data=True) if e[2].get('weight', 1) > threshold]
             self.add_nodes_from(nodes)
             self.add_edges_from(edges)
         
-        else:
+        elif weights is not None:
         
-            #  Reorganize the dataframe weights (where the position (i,j) contains the weight of the edge from j to i)
-            #  into a list tuples where each tuple contains origin node, destination node and weight
-            
-            forGraph = []            
-            for c in weights.columns :
-                for cc in weights.index :
-                    block = []
-                    block.append(c)
-                    block.append(cc)
-                    block.append(weights.loc[cc,c])
-                    forGraph.append(block)
-            
-            self.add_weighted_edges_from(forGraph) # add all the weighted node to the graph
+            #  the dataframe weights contains in position (i,j) the weight of the edge from j to i
+            self._addWeights(np.asarray(weights.values, dtype = float), list(weights.index), 
+                             list(weights.columns), threshold)
+            self._addAttributes(staticAttributes, attributeNames)
     
-            # add all the attributes
-            
-            count = 0
-            for n in attributeNames:
-                attributes = {s : staticAttributes[s][count] for s in self}
-                nx.set_node_attributes(self, attributes, n)
-                count = count + 1
-            
+    
+    ## Construct the network from a matrix instead of a dataFrame
+    #  @param matrix: numpy array or scipy.sparse matrix (N x N). Position (i,j) contains the impact of 
+    #                 node j over node i (same convention as the dataFrame weights in the constructor)
+    #  @param nodes: list with the N node names, in the order of the rows and columns of the matrix
+    #  @param staticAttributes, attributeNames, threshold: see the constructor
+    #
+    @classmethod
+    def fromMatrix(cls, matrix, nodes, staticAttributes = None, attributeNames = None, threshold = 0):
+        
+        network = cls()
+        network._addWeights(matrix, list(nodes), list(nodes), threshold)
+        network._addAttributes(staticAttributes, attributeNames)
+        
+        return network
+    
+    
+    ## Add the nodes and the edges with a weight above threshold from a matrix where the position (i,j) 
+    #  contains the weight of the edge from colNodes[j] to rowNodes[i]. Only the non zero entries are visited
+    #
+    def _addWeights(self, matrix, rowNodes, colNodes, threshold):
+        
+        self.add_nodes_from(colNodes)
+        self.add_nodes_from(rowNodes)
+        
+        matrix = sp.coo_matrix(matrix)
+        keep = matrix.data > threshold
+        rows, cols, values = matrix.row[keep], matrix.col[keep], matrix.data[keep]
+        
+        self.add_weighted_edges_from((colNodes[c], rowNodes[r], float(v)) for r, c, v in zip(rows, cols, values))
+    
+    
+    ## Add the static attributes to all the nodes
+    #
+    def _addAttributes(self, staticAttributes, attributeNames):
+        
+        if attributeNames is None:
+            return
+        
+        count = 0
+        for n in attributeNames:
+            attributes = {s : staticAttributes[s][count] for s in self}
+            nx.set_node_attributes(self, attributes, n)
+            count = count + 1
+    
+    
+    ## Set the cached matrix representation of the network (the matrix must match the current edges)
+    #
+    def _setMatrices(self, nodes, nodeIndex, W):
+        
+        self._matrixCache = (nodes, nodeIndex, W)
+        self._matrixVersion = self.version
+    
+    
+    ## Build (if needed) and return the cached matrix representation of the network. The matrices are rebuilt
+    #  if the version of the network has changed since they were built
+    #
+    def _matrices(self):
+        
+        if self._matrixCache is None or self._matrixVersion != self.version:
+            nodes = list(self.nodes())
+            nodeIndex = {nodes[i]: i for i in range(len(nodes))}
+            adjacency = nx.to_scipy_sparse_array(self, nodelist = nodes, weight = 'weight', format = 'csr')
+            self._setMatrices(nodes, nodeIndex, sp.csr_matrix(adjacency))
+        
+        return self._matrixCache
+    
+    @property
+    def nodeList(self):
+        return self._matrices()[0]
+    
+    @property
+    def nodeIndex(self):
+        return self._matrices()[1]
+    
+    @property
+    def adjacencyMatrix(self):
+        return self._matrices()[2]
+    
+    ## Split of the adjacency matrix used by the debt rank (see WeightsSplit), built at the first access
+    #
+    @property
+    def weightsSplit(self):
+        W = self.adjacencyMatrix
+        if self._splitCache is None:
+            self._splitCache = WeightsSplit(W)
+        return self._splitCache
+    
+    ## Reset the cached attributes and increase the version of the network. Called by all the methods of DiGraph
+    #  adding or removing nodes and edges; must be called explicitly after a change of the edges made in place,
+    #  e.g. G[u][v]['weight'] = w or nx.set_edge_attributes(G, weights, 'weight')
+    #
+    def clearCache(self):
+        
+        self.version = self.version + 1
+        self._matrixCache = None
+        self._matrixVersion = None
+        self._splitCache = None
+        self._impactCache = None
+        self._reachabilityCache = None
+    
+    
+    # methods of DiGraph changing the nodes or the edges: the cached attributes are reset
+    
+    def add_node(self, *args, **kwargs):
+        super().add_node(*args, **kwargs)
+        self.clearCache()
+    
+    def add_nodes_from(self, *args, **kwargs):
+        super().add_nodes_from(*args, **kwargs)
+        self.clearCache()
+    
+    def remove_node(self, *args, **kwargs):
+        super().remove_node(*args, **kwargs)
+        self.clearCache()
+    
+    def remove_nodes_from(self, *args, **kwargs):
+        super().remove_nodes_from(*args, **kwargs)
+        self.clearCache()
+    
+    def add_edge(self, *args, **kwargs):
+        super().add_edge(*args, **kwargs)
+        self.clearCache()
+    
+    def add_edges_from(self, *args, **kwargs):
+        super().add_edges_from(*args, **kwargs)
+        self.clearCache()
+    
+    def add_weighted_edges_from(self, *args, **kwargs):
+        super().add_weighted_edges_from(*args, **kwargs)
+        self.clearCache()
+    
+    def remove_edge(self, *args, **kwargs):
+        super().remove_edge(*args, **kwargs)
+        self.clearCache()
+    
+    def remove_edges_from(self, *args, **kwargs):
+        super().remove_edges_from(*args, **kwargs)
+        self.clearCache()
+    
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.clearCache()
+    
+    def clear(self):
+        super().clear()
+        self.clearCache()
+    
+    def clear_edges(self):
+        super().clear_edges()
+        self.clearCache()
             
     
-    ## Save the network into a .gefx file
-    #  @param path: string with path and name of the destination file
+    ## Save the network into a .gefx file or into a compact binary .npz file (see loadNetwork)
+    #  @param path: string with path and name of the destination file (without extension)
+    #  @param fileFormat: 'gexf' or 'npz'
     #
-    def saveNetwork(self, path):                    
+    def saveNetwork(self, path, fileFormat = 'gexf'):                    
        
-       nx.write_gexf(self, path + ".gexf")
+       if fileFormat == 'gexf':
+           nx.write_gexf(self, path + ".gexf")
+       elif fileFormat == 'npz':
+           self._saveBinary(path + ".npz")
+       else:
+           raise ValueError('unknown format ' + str(fileFormat))
+    
+    
+    ## Save the network into a .npz file containing the arrays of the CSR adjacency matrix, the node names 
+    #  and one array for each node attribute (numeric attributes as float, the others as strings). 
+    #  Edge attributes other than the weight are not saved.
+    #
+    def _saveBinary(self, fileName):
+        
+        nodes = self.nodeList
+        W = self.adjacencyMatrix
+        arrays = {'nodes': np.array([str(n) for n in nodes]),
+                  'data': W.data, 'indices': W.indices, 'indptr': W.indptr}
+        
+        attributeNames = sorted({a for n in nodes for a in self.nodes[n].keys()})
+        for a in attributeNames:
+            values = [self.nodes[n].get(a) for n in nodes]
+            if all(isinstance(v, (int, float, np.number)) and not isinstance(v, bool) for v in values if v is not None):
+                arrays['attr_' + a] = np.array([np.nan if v is None else v for v in values], dtype = float)
+            else:
+                arrays['attr_' + a] = np.array(['' if v is None else str(v) for v in values])
+        arrays['attributeNames'] = np.array(attributeNames, dtype = str)
+        
+        np.savez(fileName, **arrays)
     
     
     ## Generate a series of basic stats for the network and store them into the 
@@ -86,15 +274,9 @@ class FinancialNetwork(nx.DiGraph):
     #  
     def mainStats(self): 
         
-        mirrorG = self.copy()
-        edges = mirrorG.edges(data=True)
-        edgesNull = []
-        for e in edges:
-            if e[2]['weight'] == 0:
-                edgesNull.append(e)
-        mirrorG.remove_edges_from(edgesNull)
-                
-            
+        # zero weight edges (e.g. copied from an existing graph with threshold < 0) are hidden through a view
+        edgesNull = [(u, v) for u, v, w in self.edges(data = 'weight') if w == 0]
+        mirrorG = nx.restricted_view(self, [], edgesNull) if edgesNull else self
         
         
         mainStats = {}    # dictionary with all the major stats for the graph
@@ -125,40 +307,151 @@ class FinancialNetwork(nx.DiGraph):
         return mainStats
     
     ## Calculate for each node a centrality measure using the DebtRank algorithm and 
-    #  store the results into a new node attribute called debtRankCentrality
+    #  store the results into a new node attribute called debtRankCentrality.
+    #  All the single node shocks are propagated at once (see debtRankImpact)
     #  @param: relevance is a dictionnary with absolute economic relevance of each node (could be Makt cap or other)
+    #  @param collector: optional DebtRankCollector recording the rounds of the propagation
+    #  @return dataFrame with the impact matrix: position (i,j) contains the final level of distress of node i 
+    #          when node j is distressed
     #
-    def debtRankCentrality(self, relevance):    
+    def debtRankCentrality(self, relevance, collector = None):    
         
         h = 1
-        R = {}
         
-        for k in self.nodes():
-            SD = [k] #list of distressed nodes
-            h = 1
-            R[k] = debtRank(self, SD, h, relevance)[0]
+        nodes = self.nodeList
+        relevance = relevanceVector(relevance, nodes)
+        R, impact = debtRankImpact(self.weightsSplit, relevance, h, collector = collector)
+        self._impactCache = {'relevance': relevance, 'h': h, 'R': R, 'impact': impact}
+        
+        nx.set_node_attributes(self, {nodes[i]: float(R[i]) for i in range(len(nodes))}, 'debtRankCentrality')
+        
+        return pd.DataFrame(impact, index = nodes, columns = nodes)
+    
+    
+    ## What-if analysis: change the weights of a batch of edges and update the results of debtRankCentrality
+    #  (node attribute debtRankCentrality and impact matrix) without propagating all the shocks again.
+    #  A shock can only be changed by an edge (k,j) if its cascade reaches k, so only the nodes that can reach
+    #  the source of a modified edge (see _ancestors) are shocked again; the other columns of the impact matrix are kept.
+    #  The network is modified in place: apply the changes returned to go back to the previous weights.
+    #  @param changes: dictionary {(k, j): weight} with the new weight of the edge from k to j (0 removes the edge)
+    #  @param relevance: dictionnary with absolute economic relevance of each node, only needed if debtRankCentrality
+    #                    has not been calculated yet (all the shocks are then propagated)
+    #  @param collector: optional DebtRankCollector recording the rounds of the propagation
+    #  @return dataFrame with the impact matrix (see debtRankCentrality), dictionary with the previous weights of the
+    #          modified edges (same format as changes) and list of the nodes whose shock has been propagated again
+    #
+    def whatIf(self, changes, relevance = None, collector = None):
+        
+        if self._impactCache is None and relevance is None:
+            raise ValueError('debtRankCentrality must be calculated first or relevance must be given')
+        
+        nodes, nodeIndex, W = self._matrices()
+        for (k, j), w in changes.items():
+            if k not in nodeIndex or j not in nodeIndex:
+                raise ValueError('unknown edge ' + str((k, j)))
+            if not w >= 0:
+                raise ValueError('the weight of the edge ' + str((k, j)) + ' must be >= 0')
+        
+        rows = np.array([nodeIndex[k] for k, j in changes.keys()], dtype = int)
+        cols = np.array([nodeIndex[j] for k, j in changes.keys()], dtype = int)
+        new = np.array(list(changes.values()), dtype = float)
+        old = np.asarray(W[rows, cols], dtype = float).ravel() if rows.size > 0 else np.zeros(0)
+        previous = {e: float(o) for e, o in zip(changes.keys(), old)}
+        
+        # the shocks that can reach the modified edges, computed on the network before the changes (a cascade that 
+        # uses a new edge must first reach its source through the edges not modified)
+        modified = np.flatnonzero(new != old)
+        seeds = np.flatnonzero(self._ancestors(rows[modified]))
+        
+        # update of the graph and of the cached matrix (the order of the nodes does not change). The methods of
+        # DiGraph are called directly to keep the cached results, which are updated below
+        for i in modified:
+            k, j = nodes[rows[i]], nodes[cols[i]]
+            if new[i] > 0:
+                nx.DiGraph.add_edge(self, k, j, weight = float(new[i]))
+            elif self.has_edge(k, j):
+                nx.DiGraph.remove_edge(self, k, j)
+        delta = sp.csr_matrix(((new - old)[modified], (rows[modified], cols[modified])), shape = W.shape)
+        W = sp.csr_matrix(W + delta)
+        W.eliminate_zeros()
+        self.version = self.version + 1
+        self._setMatrices(nodes, nodeIndex, W)
+        self._splitCache = None
+        
+        # the components are still valid if no edge has been added or removed
+        if ((old[modified] > 0) != (new[modified] > 0)).any():
+            self._reachabilityCache = None
+        
+        if relevance is not None:
+            relevance = relevanceVector(relevance, nodes)
+        cache = self._impactCache
+        if cache is None or (relevance is not None and not np.array_equal(relevance, cache['relevance'])):
+            self.debtRankCentrality(dict(zip(nodes, relevance)), collector)
+            return pd.DataFrame(self._impactCache['impact'], index = nodes, columns = nodes), previous, list(nodes)
+        
+        if seeds.size > 0:
+            R, impact = debtRankImpact(self.weightsSplit, cache['relevance'], cache['h'], seeds = seeds, collector = collector)
+            cache['R'][seeds] = R
+            cache['impact'][:, seeds] = impact
+            nx.set_node_attributes(self, {nodes[s]: float(cache['R'][s]) for s in seeds}, 'debtRankCentrality')
+        
+        return pd.DataFrame(cache['impact'], index = nodes, columns = nodes), previous, [nodes[s] for s in seeds]
+    
+    
+    ## Reachability index: the nodes that can reach at least one of the targets through the edges with a positive
+    #  weight (the targets included). The search runs on the graph of the strongly connected components, which is
+    #  built at the first call and kept as long as no edge is added or removed
+    #  @param targets: numpy array with the positions of the target nodes
+    #  @return boolean numpy array (N)
+    #
+    def _ancestors(self, targets):
+        
+        if self._reachabilityCache is None:
+            W = sp.coo_matrix(self.adjacencyMatrix)
+            positive = W.data > 0
+            A = sp.csr_matrix((np.ones(positive.sum()), (W.row[positive], W.col[positive])), shape = W.shape)
+            nbComponents, labels = csgraph.connected_components(A, directed = True, connection = 'strong')
+            keep = positive & (labels[W.row] != labels[W.col])
+            # reverse edges between the components: position (c,d) flags an edge from component d to component c
+            C = sp.csr_matrix((np.ones(keep.sum()), (labels[W.col[keep]], labels[W.row[keep]])), 
+                              shape = (nbComponents, nbComponents))
+            self._reachabilityCache = (labels, C.T.tocsr())
         
-        nx.set_node_attributes(self, R, 'debtRankCentrality')
+        labels, CT = self._reachabilityCache
+        reached = np.zeros(CT.shape[0], dtype = bool)
+        reached[labels[targets]] = True
+        frontier = reached.copy()
+        while frontier.any():
+            frontier = (CT @ frontier.astype(float) > 0) & ~reached
+            reached |= frontier
+        
+        return reached[labels]
 
 
-    ## Calculate for each node the position on a 2-dimensional chart using the 
-    #  Fruchterman-Reingold force-directed algorithm and store the results into 2 new node attributes called x and y
-    #  @param: _scale, _threshold, _k, _iterations are all the parameters required by the 
-    #           nx.spring_layout function (see relevant documentation)
+    ## Calculate for each node the position on a 2-dimensional chart using a force-directed algorithm 
+    #  (Fruchterman-Reingold with nearest neighbours repulsion, see Force_Layout) and store the results
+    #  into 2 new node attributes called x and y
+    #  @param: _scale, _threshold, _k, _iterations: scale of the final positions, threshold of convergence,
+    #          optimal distance between nodes and maximum number of iterations (same meaning as in nx.spring_layout)
+    #  @param initial: optional dictionary with the initial position (x, y) of the nodes, e.g. the layout of a previous
+    #                  network (warm start). Nodes not in the dictionary are placed next to their neighbours
+    #  @param temperature: maximum move of a node at the first iteration, as a fraction of the size of the layout
+    #  @param seed: seed of the random initial positions
+    #  @param nbWorkers: number of threads used by the layout engine
     #
-    def generateLayout(self, _scale, _threshold, _k, _iterations):    
+    def generateLayout(self, _scale, _threshold, _k, _iterations, initial = None, temperature = 0.1, seed = 0, nbWorkers = 1):    
         
-        layout = nx.spring_layout(self, scale  = _scale, threshold = _threshold, k = _k, iterations = _iterations)         
+        W, nodes = weightsMatrix(self)
         
-        x = {}
-        y = {}
+        start = None
+        if initial is not None:
+            start = np.array([initial.get(n, (np.nan, np.nan)) for n in nodes], dtype = float).reshape(len(nodes), 2)
         
-        for k in layout.keys():
-            x[k] = float(layout[k][0])
-            y[k] = float(layout[k][1])
-            
-        nx.set_node_attributes(self, x, 'x')
-        nx.set_node_attributes(self, y, 'y')
+        pos = fl.forceLayout(W, _k, _iterations, _threshold, seed, start, temperature, nbWorkers = nbWorkers)
+        pos = nx.rescale_layout(pos, scale = _scale) if len(nodes) > 0 else pos
+        
+        nx.set_node_attributes(self, {nodes[i]: float(pos[i, 0]) for i in range(len(nodes))}, 'x')
+        nx.set_node_attributes(self, {nodes[i]: float(pos[i, 1]) for i in range(len(nodes))}, 'y')
 
 
 
@@ -167,6 +460,91 @@ class FinancialNetwork(nx.DiGraph):
 # Utility Functions #######################################################################
 
 
+# codes used for the states of the nodes in the vectorized version of the debt rank
+UNDISTRESSED = 0
+DISTRESSED = 1
+INACTIVE = 2
+STATE_LABELS = np.array(['U', 'D', 'I'])
+
+# the split of the weights matrix used by the debt rank (see WeightsSplit) is dense for the networks with at most
+# DENSE_NODES nodes or with edges between at least DENSE_SHARE of the pairs of nodes (and fitting in BATCH_BYTES)
+DENSE_NODES = 256
+DENSE_SHARE = 0.1
+
+# memory budget (bytes) of the working arrays of a round of debtRankBatch: the shocks still running are propagated
+# in chunks of columns small enough for the budget
+BATCH_BYTES = 256 * 2 ** 20
+
+
+
+##  Optional instrumentation of the debt rank functions (debtRank, debtRankVectorized, debtRankMatrix, debtRankImpact
+#   and FinancialNetwork.debtRankCentrality). Each call of a function is recorded as a run with, for each round of the
+#   propagation, its duration, the number of distressed (active) nodes and the cumulative distress R so far, and the 
+#   termination reason ('converged' or 'maxIter'). The functions do not record anything when no collector is passed.
+#
+class DebtRankCollector():
+    
+    def __init__(self):
+        
+        self.runs = []
+    
+    
+    ## Start a new run
+    #  @param nbSeeds: number of nodes initially distressed (or number of shocks propagated at once)
+    #  @param h: initial level of distress
+    #
+    def start(self, nbSeeds, h):
+        
+        self._last = time.perf_counter()
+        self.runs.append({'nbSeeds': nbSeeds, 'h': float(h), 'roundTimes': [], 'nbActive': [], 'cumDistress': []})
+    
+    
+    ## Record the end of a round of the current run
+    #  @param nbActive: number of distressed nodes at the end of the round
+    #  @param cumDistress: cumulative distress R at the end of the round
+    #
+    def round(self, nbActive, cumDistress):
+        
+        now = time.perf_counter()
+        run = self.runs[-1]
+        run['roundTimes'].append(now - self._last)
+        run['nbActive'].append(nbActive)
+        run['cumDistress'].append(cumDistress)
+        self._last = now
+    
+    
+    ## End the current run
+    #  @param stopped: True if the propagation was stopped by maxIter while some nodes were still distressed
+    #
+    def stop(self, stopped):
+        
+        run = self.runs[-1]
+        run['reason'] = 'maxIter' if stopped else 'converged'
+        run['nbRounds'] = len(run['roundTimes'])
+        run['time'] = float(sum(run['roundTimes']))
+    
+    
+    ## Aggregated report of all the runs recorded: number of runs, total time, number of rounds (mean and max), 
+    #  number of runs stopped by maxIter, largest active set and details of the slowest run
+    #
+    def report(self):
+        
+        runs = [r for r in self.runs if 'reason' in r]
+        if len(runs) == 0:
+            return {'nbRuns': 0}
+        
+        nbRounds = [r['nbRounds'] for r in runs]
+        slowest = max(runs, key = lambda r: r['time'])
+        
+        return {'nbRuns': len(runs),
+                'totalTime': float(sum(r['time'] for r in runs)),
+                'meanRounds': float(np.mean(nbRounds)),
+                'maxRounds': int(max(nbRounds)),
+                'nbMaxIter': sum(r['reason'] == 'maxIter' for r in runs),
+                'maxActive': int(max([max(r['nbActive']) for r in runs if r['nbActive']] + [0])),
+                'slowestRun': {k: slowest[k] for k in ['nbSeeds', 'h', 'time', 'nbRounds', 'reason']}}
+
+
 
 
 ## Calculate the debt rank measure for a set of nodes in a graph, associated with 
@@ -178,8 +556,9 @@ class FinancialNetwork(nx.DiGraph):
 #  @param h: scalar (double) in [0,1] with the initial level of distress (equal for all nodes). 1 is default
 #  @param maxIter: maximum number of iterations
 #  @param relevance: dictionnary with absolute economic relevance of each node (could be Makt cap or other)
+#  @param collector: optional DebtRankCollector recording the rounds of the propagation
 #  
-def debtRank(graph, SD, h, relevance, maxIter = 100):
+def debtRank(graph, SD, h, relevance, maxIter = 100, collector = None):
 
     #  Construct the dictionnar S0 with the initial conditions. key are the nodes and values 
     #  are the pairs [s, h] where s can be 'D' (distressed), 'I' (inactive), 'U' (undistressed)
@@ -204,6 +583,8 @@ def debtRank(graph, SD, h, relevance, maxIter = 100):
     nbIter = 0
     R0 = sum(S0[k][1] * relevance[k] / cumRelevance  for k in S0.keys()) # cumulative initial distress
     nbDistressed = len(SD)
+    if collector is not None:
+        collector.start(nbDistressed, h)
 
     
     while nbDistressed != 0 and nbIter < maxIter:
@@ -230,8 +611,504 @@ def debtRank(graph, SD, h, relevance, maxIter = 100):
         
         SD = [s for s in S1.keys() if S1[s][0] == 'D']
         nbDistressed = len(SD)
+        if collector is not None:
+            collector.round(nbDistressed, sum(S1[k][1] * relevance[k] / cumRelevance  for k in S1.keys()) - R0)
+    
+    if collector is not None:
+        collector.stop(nbDistressed != 0)
     
     R = sum(S1[k][1] * relevance[k] / cumRelevance  for k in S1.keys()) - R0
 
     
-    return R, S1
\ No newline at end of file
+    return R, S1
+
+
+
+## Load a network saved with FinancialNetwork.saveNetwork
+#  @param fileName: string with path, name and extension (.npz or .gexf) of the file
+#  @return FinancialNetwork
+#
+def loadNetwork(fileName):
+    
+    if fileName.endswith('.gexf'):
+        return FinancialNetwork(None, None, None, nx.read_gexf(fileName))
+    
+    with np.load(fileName, allow_pickle = False) as f:
+        nodes = f['nodes'].tolist()
+        attributes = {a: f['attr_' + a].tolist() for a in f['attributeNames'].tolist()}
+        W = sp.csr_matrix((f['data'], f['indices'], f['indptr']), shape = (len(nodes), len(nodes)))
+    
+    network = FinancialNetwork()
+    network.add_nodes_from((nodes[i], {a: attributes[a][i] for a in attributes.keys()}) for i in range(len(nodes)))
+    
+    rows = np.repeat(np.arange(len(nodes)), np.diff(W.indptr))
+    network.add_weighted_edges_from((nodes[k], nodes[j], w) for k, j, w in zip(rows, W.indices.tolist(), W.data.tolist()))
+    
+    # the matrix read from the file is used directly as cached adjacencyMatrix
+    network._setMatrices(nodes, {nodes[i]: i for i in range(len(nodes))}, W)
+    
+    return network
+
+
+## Build the weights matrix of a graph. Position (k,j) contains the weight of the edge from k to j
+#  (i.e. the impact of k over j). Missing edges have weight 0. For a FinancialNetwork the cached
+#  sparse adjacencyMatrix is returned.
+#  @param graph: the graph
+#  @param nodes: list with the order of the nodes to be used for rows and columns (default is graph.nodes())
+#  @return the matrix (numpy array or scipy.sparse matrix) and the list of nodes
+#
+def weightsMatrix(graph, nodes = None):
+    
+    if nodes is None:
+        if isinstance(graph, FinancialNetwork):
+            return graph.adjacencyMatrix, graph.nodeList
+        nodes = list(graph.nodes())
+    
+    W = nx.to_numpy_array(graph, nodelist = nodes, weight = 'weight')
+    
+    return W, nodes
+
+
+## Transform a dictionnary with the absolute economic relevance of each node into a numpy array 
+#  with the relative relevance (i.e. divided by the cumulative relevance), ordered as the list nodes.
+#  An empty dictionnary means equal relevance for all the nodes.
+#  @param relevance: dictionnary with absolute economic relevance of each node (could be Makt cap or other)
+#  @param nodes: list of nodes
+#
+def relevanceVector(relevance, nodes):
+    
+    if not relevance:
+        return np.full(len(nodes), 1 / len(nodes))
+    
+    cumRelevance = sum([relevance[i] for i in relevance])
+    
+    return np.array([relevance[n] for n in nodes], dtype = float) / cumRelevance
+
+
+## Vectorized version of the debt rank working directly on the weights matrix. The states and the 
+#  levels of distress are numpy vectors, so each round of the propagation is a few matrix-vector products
+#  followed by the update of the states. The results are the same as debtRank: within a round the nodes are
+#  updated in the order of the matrix (the order of graph.nodes()), see _propagate.
+#  @param W: numpy array or scipy.sparse matrix (N x N) where position (k,j) contains the weight of the edge from k to j
+#           (or its WeightsSplit, to reuse the split of the matrix over many calls)
+#  @param SD: boolean numpy array (N) flagging the nodes initially distressed
+#  @param h: scalar (double) in [0,1] with the initial level of distress (equal for all nodes)
+#  @param relevance: numpy array (N) with the relative economic relevance of each node (see relevanceVector)
+#  @param maxIter: maximum number of iterations
+#  @param collector: optional DebtRankCollector recording the rounds of the propagation
+#  @return R, the states of the nodes (see codes above) and their level of distress
+#
+def debtRankMatrix(W, SD, h, relevance, maxIter = 100, collector = None):
+    
+    SD = np.asarray(SD, dtype = bool)
+    R0 = float(h) * relevance[SD].sum() # cumulative initial distress
+    
+    if collector is None:
+        for nbIter, state, distress in debtRankSteps(W, SD, h, maxIter):
+            pass
+    else:
+        collector.start(int(SD.sum()), h)
+        for nbIter, state, distress in debtRankSteps(W, SD, h, maxIter):
+            if nbIter > 0:
+                collector.round(int((state == DISTRESSED).sum()), float(distress @ relevance - R0))
+        collector.stop(bool((state == DISTRESSED).any()))
+    
+    R = distress @ relevance - R0
+    
+    return R, state, distress
+
+
+## Generator of the rounds of the propagation of debtRankMatrix (same parameters, without the relevance).
+#  Yields the initial conditions (round 0) and then the number of the round, the states and the levels
+#  of distress at the end of each round; the arrays yielded are not modified afterwards.
+#
+def debtRankSteps(W, SD, h, maxIter = 100):
+    
+    SD = np.asarray(SD, dtype = bool)
+    distress = np.where(SD, float(h), 0.0)
+    state = np.where(SD, DISTRESSED, UNDISTRESSED)
+    split = _split(W)
+    
+    nbIter = 0
+    active = SD
+    yield nbIter, state, distress
+    
+    while active.any() and nbIter < maxIter:
+        nbIter = nbIter + 1
+        
+        # Update the distress function using only the nodes distressed in the previous round
+        distress = _propagate(split, distress, active)
+        
+        # Update the state: distressed and inactive nodes become inactive, the others are distressed if h > 0
+        state = np.where(state != UNDISTRESSED, INACTIVE, np.where(distress > 0, DISTRESSED, UNDISTRESSED))
+        active = state == DISTRESSED
+        
+        yield nbIter, state, distress
+
+
+##  Split of the weights matrix used by the rounds of the propagation (see _propagate): transposed matrix of the
+#   edges from a node to a node placed before it or to itself in the order of the matrix (backward), and the edges 
+#   from a node to a node placed after it (forward) grouped by levels: the forward edges form an acyclic graph, and
+#   the level of a node is the length of the longest forward path ending at it.
+#   Both matrices are stored with the nodes sorted by level (order), so that each level is a block of consecutive
+#   rows receiving only from the rows above it. The matrices are dense for the small or dense networks.
+#   The split only depends on the sparsity pattern of the matrix: it can be built once and reused for all the
+#   propagations on the same network (see FinancialNetwork.weightsSplit), and the weights can be replaced in place
+#   without splitting the matrix again (see setWeights)
+#
+class WeightsSplit():
+    
+    ## @param W: numpy array or scipy.sparse matrix (N x N) where position (k,j) contains the weight of the edge from k to j
+    #
+    def __init__(self, W):
+        
+        W = sp.csr_matrix(W)
+        if not W.has_canonical_format:
+            W = W.copy()
+            W.sum_duplicates()
+        N = W.shape[0]
+        self.shape = W.shape
+        self.dense = N <= DENSE_NODES or (W.nnz >= DENSE_SHARE * N * N and 8 * N * N <= BATCH_BYTES)
+        
+        # levels of the nodes, from the pattern of the transposed forward matrix (row j lists the sources of j)
+        sources = np.repeat(np.arange(N), np.diff(W.indptr))
+        targets = W.indices
+        isForward = sources < targets
+        indptr, indices, _ = _transposedPattern(sources[isForward], targets[isForward], np.flatnonzero(isForward), N)
+        level = _levels(indptr, indices)
+        self.order = np.argsort(level, kind = 'stable')
+        position = np.empty(N, dtype = int)
+        position[self.order] = np.arange(N)
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(level, minlength = 1))))
+        
+        # transposed matrices in the order of the levels, and position of their entries in W.data
+        self._forward = _transposedPattern(position[sources[isForward]], position[targets[isForward]],
+                                           np.flatnonzero(isForward), N)
+        self._backward = _transposedPattern(position[sources[~isForward]], position[targets[~isForward]],
+                                            np.flatnonzero(~isForward), N)
+        if self.dense:
+            self.forward = np.zeros((N, N))
+            self.backward = np.zeros((N, N))
+        else:
+            self.forward = sp.csr_matrix((np.zeros(len(self._forward[1])), self._forward[1], self._forward[0]), shape = (N, N))
+            self.backward = sp.csr_matrix((np.zeros(len(self._backward[1])), self._backward[1], self._backward[0]), shape = (N, N))
+        self.setWeights(W.data)
+        
+        # block of each level > 0: first and last row, and rows of the forward matrix restricted to the rows above
+        self.levels = []
+        for l in range(1, len(bounds) - 1):
+            a, b = bounds[l], bounds[l + 1]
+            if self.dense:
+                block = self.forward[a:b, :a]
+            else:
+                indptr = self.forward.indptr[a:b + 1]
+                block = sp.csr_matrix((self.forward.data[indptr[0]:indptr[-1]], self.forward.indices[indptr[0]:indptr[-1]],
+                                       indptr - indptr[0]), shape = (b - a, a))
+                block.data = self.forward.data[indptr[0]:indptr[-1]] # view (the constructor copies), see setWeights
+            self.levels.append((a, b, block))
+    
+    
+    ## Replace the weights in place, e.g. for the perturbed weights of a scenario
+    #  @param data: numpy array with the new weights, in the order of W.data of the CSR matrix the split was built 
+    #               from (same sparsity pattern, in canonical format)
+    #
+    def setWeights(self, data):
+        
+        for matrix, (indptr, indices, ids) in [(self.forward, self._forward), (self.backward, self._backward)]:
+            if self.dense:
+                matrix[np.repeat(np.arange(len(indptr) - 1), np.diff(indptr)), indices] = data[ids]
+            else:
+                matrix.data[:] = data[ids]
+
+
+## Entries of the transposed matrix of a subset of the entries of a matrix, in CSR format
+#  @param rows, cols, ids: positions and identifiers of the entries of the matrix
+#  @return indptr, indices and identifiers of the entries of the transposed matrix, in its CSR order
+#
+def _transposedPattern(rows, cols, ids, N):
+    
+    order = np.lexsort((rows, cols))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(cols, minlength = N))))
+    
+    return indptr, rows[order], ids[order]
+
+
+## Levels of the nodes of the acyclic graph of the forward edges (see WeightsSplit), in a single sweep: the sources
+#  of the forward edges of a node are placed before it, so the nodes are visited in the order of the matrix
+#  @param indptr, indices: CSR pattern of the transposed forward matrix (row j lists the sources of the edges to j)
+#  @return numpy array (N) with the level of each node
+#
+def _levels(indptr, indices):
+    
+    level = np.zeros(len(indptr) - 1, dtype = int)
+    for j in np.flatnonzero(np.diff(indptr) > 0):
+        level[j] = level[indices[indptr[j]:indptr[j + 1]]].max() + 1
+    
+    return level
+
+
+## Split of a weights matrix, built only if W is not already a WeightsSplit
+#
+def _split(W):
+    
+    return W if isinstance(W, WeightsSplit) else WeightsSplit(W)
+
+
+## One round of the propagation of the distress, with the update order of debtRank: the nodes are updated one after
+#  the other in the order of the matrix, so a node receives from the active nodes placed before it their level of
+#  distress already updated in the same round, and from the others their level of the previous round.
+#  The nodes are updated level by level (see WeightsSplit): all the nodes of a level at once, after the levels 
+#  of the nodes they receive the updated distress from.
+#  @param split: WeightsSplit of the weights matrix
+#  @param distress: numpy array (N) or (N x M) with the levels of distress at the end of the previous round
+#  @param active: boolean numpy array (same shape) flagging the nodes distressed in the previous round
+#  @return the levels of distress at the end of the round
+#
+def _propagate(split, distress, active):
+    
+    shape = distress.shape
+    distress = distress.reshape(shape[0], -1)[split.order]
+    active = active.reshape(shape[0], -1)[split.order]
+    
+    base = distress + split.backward @ (distress * active)
+    updated = np.minimum(1, base)
+    sending = updated * active # updated distress of the active nodes
+    
+    for a, b, forward in split.levels:
+        updated[a:b] = np.minimum(1, base[a:b] + forward @ sending[:a])
+        sending[a:b] = updated[a:b] * active[a:b]
+    
+    result = np.empty_like(updated)
+    result[split.order] = updated
+    
+    return result.reshape(shape)
+
+
+## Same as debtRank (same parameters and same output) but based on the vectorized debtRankMatrix.
+#  @param W, nodes: optional weights matrix (or its WeightsSplit) and list of nodes as returned by weightsMatrix, 
+#                   to avoid rebuilding them when the same graph is used many times (default for a FinancialNetwork
+#                   is its cached weightsSplit)
+#  @param collector: optional DebtRankCollector recording the rounds of the propagation
+#
+def debtRankVectorized(graph, SD, h, relevance, maxIter = 100, W = None, nodes = None, collector = None):
+    
+    if W is None and nodes is None and isinstance(graph, FinancialNetwork):
+        W, nodes = graph.weightsSplit, graph.nodeList
+    elif W is None:
+        W, nodes = weightsMatrix(graph, nodes)
+    
+    SD = set(SD)
+    seeds = np.array([n in SD for n in nodes], dtype = bool)
+    R, state, distress = debtRankMatrix(W, seeds, h, relevanceVector(relevance, nodes), maxIter, collector)
+    
+    S1 = {nodes[i]: [str(STATE_LABELS[state[i]]), float(distress[i])] for i in range(len(nodes))}
+    
+    return float(R), S1
+
+
+## Batched version of debtRankMatrix: propagate at once the shocks on a list of single nodes (see debtRankBatch)
+#  @param W: numpy array or scipy.sparse matrix (N x N) where position (k,j) contains the weight of the edge from k to j
+#           (or its WeightsSplit, to reuse the split of the matrix over many calls)
+#  @param relevance: numpy array (N) with the relative economic relevance of each node (see relevanceVector)
+#  @param h: scalar (double) in [0,1] with the initial level of distress
+#  @param maxIter: maximum number of iterations
+#  @param seeds: list with the positions of the nodes to be shocked (default is all the nodes)
+#  @param collector: optional DebtRankCollector recording the rounds of the propagation (the M shocks are recorded
+#                    as a single run: active nodes and cumulative distress are summed over the shocks still running)
+#  @return R: numpy array (M) with the debt rank of each shocked node
+#          impact: numpy array (N x M) where position (i,s) contains the final level of distress of node i
+#                  when the node seeds[s] is distressed
+#
+def debtRankImpact(W, relevance, h = 1, maxIter = 100, seeds = None, collector = None):
+    
+    N = W.shape[0]
+    if seeds is None:
+        seeds = np.arange(N)
+    seeds = np.asarray(seeds, dtype = int)
+    M = len(seeds)
+    
+    SD = np.zeros((N, M), dtype = bool)
+    SD[seeds, np.arange(M)] = True
+    
+    return debtRankBatch(W, SD, h, relevance, maxIter, collector)
+
+
+## Batched version of debtRankMatrix: propagate at once M shocks, each one on a set of nodes.
+#  The states (int8) and the levels of distress are N x M matrices (one column for each shock);
+#  the columns whose propagation is over are removed from the computation at each round, and the others are
+#  propagated in chunks of at most chunkSize columns.
+#  @param W: numpy array or scipy.sparse matrix (N x N) where position (k,j) contains the weight of the edge from k to j
+#           (or its WeightsSplit, to reuse the split of the matrix over many calls)
+#  @param SD: boolean numpy array (N x M) where column s flags the nodes initially distressed by the shock s
+#  @param h: scalar (double) in [0,1] with the initial level of distress
+#  @param relevance: numpy array (N) with the relative economic relevance of each node (see relevanceVector)
+#  @param maxIter: maximum number of iterations
+#  @param collector: optional DebtRankCollector recording the rounds of the propagation (see debtRankImpact)
+#  @param chunkSize: maximum number of columns propagated at once (default is the number fitting in BATCH_BYTES)
+#  @return R: numpy array (M) with the debt rank of each shock
+#          distress: numpy array (N x M) with the final level of distress of each node for each shock
+#
+def debtRankBatch(W, SD, h, relevance, maxIter = 100, collector = None, chunkSize = None):
+    
+    SD = np.asarray(SD, dtype = bool)
+    N, M = SD.shape
+    R0 = float(h) * (relevance @ SD) # cumulative initial distress of each shock
+    if chunkSize is None:
+        chunkSize = max(1, BATCH_BYTES // (48 * max(N, 1))) # about 6 float64 working arrays for each column
+    
+    distress = np.where(SD, float(h), 0.0)
+    state = np.where(SD, DISTRESSED, UNDISTRESSED).astype(np.int8)
+    split = _split(W)
+    
+    nbIter = 0
+    running = np.flatnonzero(SD.any(axis = 0)) # columns where the propagation is still going on
+    if collector is not None:
+        collector.start(M, h)
+    
+    while running.size > 0 and nbIter < maxIter:
+        nbIter = nbIter + 1
+        
+        stillRunning = []
+        nbActive = 0
+        for c in range(0, running.size, chunkSize):
+            columns = running[c:c + chunkSize]
+            D = distress[:, columns]
+            S = state[:, columns]
+            D = _propagate(split, D, S == DISTRESSED)
+            S = np.where(S != UNDISTRESSED, INACTIVE, np.where(D > 0, DISTRESSED, UNDISTRESSED)).astype(np.int8)
+            distress[:, columns] = D
+            state[:, columns] = S
+            
+            active = S == DISTRESSED
+            stillRunning.append(columns[active.any(axis = 0)])
+            nbActive = nbActive + int(active.sum())
+        
+        running = np.concatenate(stillRunning)
+        if collector is not None:
+            collector.round(nbActive, float((relevance @ distress).sum() - R0.sum()))
+    
+    if collector is not None:
+        collector.stop(running.size > 0)
+    
+    R = relevance @ distress - R0
+    
+    return R, distress
+
+
+## Precompute the single node shocks of all the nodes for a grid of initial levels of distress (see debtRankImpact)
+#  @param W: numpy array or scipy.sparse matrix (N x N) where position (k,j) contains the weight of the edge from k to j
+#           (or its WeightsSplit, to reuse the split of the matrix over many calls)
+#  @param relevance: numpy array (N) with the relative economic relevance of each node (see relevanceVector)
+#  @param hGrid: list with the levels of distress of the grid (sorted in increasing order)
+#  @param maxIter: maximum number of iterations
+#  @return R: numpy array (H x N) with the debt rank of each node for each level of the grid
+#          impact: float32 numpy array (H x N x N) where position (g,i,s) contains the final level of distress
+#                  of node i when node s is distressed with the level hGrid[g]
+#
+def stressGrid(W, relevance, hGrid, maxIter = 100):
+    
+    N = W.shape[0]
+    R = np.zeros((len(hGrid), N))
+    impact = np.zeros((len(hGrid), N, N), dtype = np.float32)
+    
+    split = _split(W)
+    for g in range(len(hGrid)):
+        R[g], impact[g] = debtRankImpact(split, relevance, hGrid[g], maxIter)
+    
+    return R, impact
+
+
+## Save a grid of single node shocks (see stressGrid): the nodes, the levels of the grid, R and the fingerprint of the
+#  network (see networkFingerprint) into a .npz file and the impact into a .npy file next to it (<name>_impact.npy),
+#  transposed so that the levels of distress of each shock are contiguous (see loadStressGrid)
+#  @param fileName: string with path and name of the .npz file
+#  @param fingerprint: fingerprint of the network the grid has been calculated on
+#
+def saveStressGrid(fileName, nodes, hGrid, R, impact, fingerprint):
+    
+    np.save(_impactFile(fileName), np.ascontiguousarray(np.transpose(impact, (0, 2, 1)), dtype = np.float32))
+    np.savez(fileName, nodes = np.array([str(n) for n in nodes]), hGrid = np.asarray(hGrid, dtype = float),
+             R = R, fingerprint = np.array(fingerprint))
+
+
+## Load a grid of single node shocks saved with saveStressGrid. The impact is memory-mapped (read-only), so only
+#  the shocks that are used are read from the disk
+#  @return dictionnary with the keys nodes, index (position of each node), hGrid, R, fingerprint and impact 
+#          (H x N x N, position (g,s,i) contains the final level of distress of node i when node s is distressed
+#          with the level hGrid[g]), or None if the impact file is missing or does not match
+#
+def loadStressGrid(fileName):
+    
+    with np.load(fileName, allow_pickle = False) as f:
+        grid = {k: f[k] for k in ['hGrid', 'R']}
+        grid['nodes'] = f['nodes'].tolist()
+        grid['fingerprint'] = str(f['fingerprint'])
+    
+    N = len(grid['nodes'])
+    if not os.path.exists(_impactFile(fileName)):
+        return None
+    grid['impact'] = np.load(_impactFile(fileName), mmap_mode = 'r')
+    if grid['impact'].shape != (len(grid['hGrid']), N, N):
+        return None
+    grid['index'] = {grid['nodes'][i]: i for i in range(N)}
+    
+    return grid
+
+
+def _impactFile(fileName):
+    return os.path.splitext(fileName)[0] + '_impact.npy'
+
+
+## Fingerprint (sha256) of the inputs of the debt rank on a network: weights, order of the nodes, relevance and any 
+#  other array (e.g. the levels of a stress grid). Used to check that a file precomputed for a network still matches it
+#  @param W: numpy array or scipy.sparse matrix (N x N) with the weights (see weightsMatrix)
+#  @param nodes: list of nodes
+#  @param relevance: numpy array (N) with the relative economic relevance of each node (see relevanceVector)
+#  @return string with the hexadecimal digest
+#
+def networkFingerprint(W, nodes, relevance, *extra):
+    
+    W = sp.csr_matrix(W, dtype = float, copy = True)
+    W.sum_duplicates()
+    W.eliminate_zeros()
+    W.sort_indices()
+    
+    digest = hashlib.sha256()
+    digest.update(np.array(W.shape, dtype = np.int64).tobytes())
+    for array in [W.data, W.indices.astype(np.int64), W.indptr.astype(np.int64), np.asarray(relevance, dtype = float)]:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update('\0'.join(str(n) for n in nodes).encode('utf-8'))
+    for array in extra:
+        digest.update(np.ascontiguousarray(array, dtype = float).tobytes())
+    
+    return digest.hexdigest()
+
+
+## Debt rank of a single node shock read from a precomputed grid (see loadStressGrid). Between two levels of the
+#  grid the results are linearly interpolated: the propagation is linear in h as long as no node reaches 
+#  the maximum level of distress 1, so the interpolation is exact in most cases.
+#  @param grid: dictionnary returned by loadStressGrid
+#  @param node: the distressed node
+#  @param h: initial level of distress
+#  @return R and the dictionnary with the level of distress of each node, or None if h is outside the grid
+#
+def stressFromGrid(grid, node, h):
+    
+    hGrid = grid['hGrid']
+    if node not in grid['index'] or h < hGrid[0] or h > hGrid[-1]:
+        return None
+    
+    s = grid['index'][node]
+    g = int(np.searchsorted(hGrid, h)) # first level of the grid >= h
+    
+    if hGrid[g] == h:
+        R = grid['R'][g, s]
+        distress = grid['impact'][g, s].astype(float)
+    else:
+        w = (h - hGrid[g - 1]) / (hGrid[g] - hGrid[g - 1])
+        R = (1 - w) * grid['R'][g - 1, s] + w * grid['R'][g, s]
+        distress = (1 - w) * grid['impact'][g - 1, s].astype(float) + w * grid['impact'][g, s].astype(float)
+    
+    nodes = grid['nodes']
+    
+    return float(R), {nodes[i]: float(distress[i]) for i in range(len(nodes))}
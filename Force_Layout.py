@@ -0,0 +1,203 @@
+"""
+Year End Project
+Program:                Data Science
+@author:                Marco Corsi
+@Description: Force-directed layout engine used by FinancialNetwork.generateLayout. Same forces as the Fruchterman-Reingold
+              algorithm of networkx, with the repulsion approximated as in Barnes-Hut on a hierarchy of grids (quadtree):
+              a node is repelled exactly by the nodes of the neighbouring cells of the finest grid, and by the far nodes
+              through the total mass and the centroid of their cell, at the coarsest level where the cell is not a
+              neighbour of the cell of the node. Each pair of nodes is counted once, so each iteration costs O(N log N)
+              instead of O(N^2) with the far-field repulsion of the whole network. The repulsion can be computed over
+              several threads. The layout is reproducible (fixed seed) and can be warm-started from the coordinates of a
+              previous network, so that a series of networks gets stable layouts with few iterations.
+"""
+
+
+
+
+import os
+import numpy as np
+import scipy.sparse as sp
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+
+## Compute the positions of the nodes of a network
+#  @param W: numpy array or scipy.sparse matrix (N x N) with the weights of the edges (attraction, made symmetric)
+#  @param k: optimal distance between nodes (default 1/sqrt(N), as networkx)
+#  @param iterations: maximum number of iterations
+#  @param threshold: the iterations stop when the average move of the nodes is below threshold
+#  @param seed: seed of the random initial positions
+#  @param initial: optional numpy array (N x 2) with the initial positions (warm start). Rows with NaN are the
+#                  nodes without a previous position: they are placed at the average position of their neighbours
+#  @param temperature: maximum move of a node at the first iteration, as a fraction of the size of the layout
+#                      (decreasing linearly to 0 with the iterations)
+#  @param nodesPerCell: average number of nodes in a cell of the finest grid (sets the depth of the quadtree)
+#  @param nbWorkers: number of threads computing the repulsion (-1 for all the cores)
+#  @return numpy array (N x 2) with the positions
+#
+def forceLayout(W, k = None, iterations = 50, threshold = 1e-4, seed = 0, initial = None, temperature = 0.1,
+                nodesPerCell = 2, nbWorkers = 1):
+
+    N = W.shape[0]
+    if N == 0:
+        return np.zeros((0, 2))
+    if k is None:
+        k = np.sqrt(1.0 / N)
+
+    A = sp.csr_matrix(W, dtype = float)
+    A = sp.coo_matrix(A + A.T)
+    rows, cols, weights = A.row, A.col, A.data
+
+    rng = np.random.default_rng(seed)
+    if initial is None:
+        pos = rng.random((N, 2))
+    else:
+        pos = _placeMissing(np.array(initial, dtype = float), A, rng)
+
+    t = temperature * max(np.ptp(pos[:, 0]), np.ptp(pos[:, 1]), 1e-2)
+    dt = t / (iterations + 1)
+
+    # depth of the quadtree (at least 2: at the levels 0 and 1 all the cells are neighbours)
+    depth = max(2, int(np.ceil(np.log(max(N / nodesPerCell, 1)) / np.log(4))))
+    nbWorkers = os.cpu_count() if nbWorkers == -1 else max(1, nbWorkers)
+    chunks = np.array_split(np.arange(N), nbWorkers)
+    pool = ThreadPoolExecutor(nbWorkers) if nbWorkers > 1 else None
+
+    for i in range(iterations):
+
+        # repulsion (approximated with the quadtree)
+        tree = _Quadtree(pos, depth)
+        if pool is None:
+            displacement = tree.repulsion(chunks[0], k)
+        else:
+            displacement = np.concatenate(list(pool.map(tree.repulsion, chunks, [k] * len(chunks))))
+
+        # attraction along the edges
+        delta = pos[rows] - pos[cols]
+        distance = np.maximum(np.sqrt((delta ** 2).sum(axis = 1)), 0.01)
+        force = weights * distance / k
+        displacement[:, 0] -= np.bincount(rows, weights = delta[:, 0] * force, minlength = N)
+        displacement[:, 1] -= np.bincount(rows, weights = delta[:, 1] * force, minlength = N)
+
+        # move each node by at most t
+        length = np.maximum(np.sqrt((displacement ** 2).sum(axis = 1)), 0.01)
+        move = displacement * (t / length)[:, None]
+        pos = pos + move
+        t = t - dt
+
+        if np.linalg.norm(move) / N < threshold:
+            break
+
+    if pool is not None:
+        pool.shutdown()
+
+    return pos
+
+
+##  Hierarchy of grids over the positions of the nodes: level L splits the bounding square of the layout in
+#   2^L x 2^L cells, with the number of nodes (mass) and the centroid of each cell
+#
+class _Quadtree():
+
+    ## @param pos: numpy array (N x 2) with the positions
+    #  @param depth: level of the finest grid
+    #
+    def __init__(self, pos, depth):
+
+        self.pos = pos
+        self.depth = depth
+        low = pos.min(axis = 0)
+        size = max(np.ptp(pos[:, 0]), np.ptp(pos[:, 1]), 1e-9)
+        n = 2 ** depth
+        self.cell = np.minimum(((pos - low) / size * n).astype(int), n - 1) # cell of each node in the finest grid
+
+        # mass and centroid of the cells of each level (from level 2)
+        self.cells = {}
+        for L in range(2, depth + 1):
+            c = self.cell >> (depth - L)
+            ids = c[:, 0] * 2 ** L + c[:, 1]
+            mass = np.bincount(ids, minlength = 4 ** L).astype(float)
+            centroid = np.stack([np.bincount(ids, weights = pos[:, 0], minlength = 4 ** L),
+                                 np.bincount(ids, weights = pos[:, 1], minlength = 4 ** L)], axis = 1)
+            self.cells[L] = (mass, centroid / np.maximum(mass, 1)[:, None])
+
+        # nodes of each cell of the finest grid (positions in order, from start)
+        ids = self.cell[:, 0] * n + self.cell[:, 1]
+        self.order = np.argsort(ids, kind = 'stable')
+        counts = np.bincount(ids, minlength = n * n)
+        self.counts, self.start = counts, np.cumsum(counts) - counts
+
+
+    ## Repulsion k^2 / d of the other nodes on a set of nodes (as in Fruchterman-Reingold)
+    #  @param nodes: numpy array with the positions of the nodes in pos
+    #  @param k: optimal distance between nodes
+    #  @return numpy array (len(nodes) x 2) with the displacement of each node
+    #
+    def repulsion(self, nodes, k):
+
+        pos, cell, depth = self.pos[nodes], self.cell[nodes], self.depth
+        displacement = np.zeros((len(nodes), 2))
+
+        # far field: at each level, the cells that are children of the neighbours of the parent of the cell of the
+        # node but not neighbours of the cell itself (interaction list, at most 27 cells)
+        for L in range(2, depth + 1):
+            mass, centroid = self.cells[L]
+            c = cell >> (depth - L)
+            X = (2 * (c[:, 0] >> 1) - 2)[:, None, None] + np.arange(6)[None, :, None]
+            Y = (2 * (c[:, 1] >> 1) - 2)[:, None, None] + np.arange(6)[None, None, :]
+            X, Y = np.broadcast_arrays(X, Y)
+            valid = ((X >= 0) & (X < 2 ** L) & (Y >= 0) & (Y < 2 ** L)
+                     & ((np.abs(X - c[:, 0, None, None]) > 1) | (np.abs(Y - c[:, 1, None, None]) > 1)))
+            ids = np.where(valid, X * 2 ** L + Y, 0).reshape(len(nodes), -1)
+            weight = np.where(valid.reshape(len(nodes), -1), mass[ids], 0)
+            delta = pos[:, None, :] - centroid[ids]
+            distance2 = np.maximum((delta ** 2).sum(axis = 2), 1e-4)
+            displacement += (delta * (weight * k * k / distance2)[:, :, None]).sum(axis = 1)
+
+        # near field: exact repulsion of the nodes of the neighbouring cells of the finest grid
+        n = 2 ** depth
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                X, Y = cell[:, 0] + dx, cell[:, 1] + dy
+                valid = (X >= 0) & (X < n) & (Y >= 0) & (Y < n)
+                ids = np.where(valid, X * n + Y, 0)
+                counts = np.where(valid, self.counts[ids], 0)
+                node = np.repeat(np.arange(len(nodes)), counts)
+                first = np.cumsum(counts) - counts
+                other = self.order[np.repeat(self.start[ids] - first, counts) + np.arange(counts.sum())]
+                keep = other != nodes[node]
+                node, other = node[keep], other[keep]
+                delta = pos[node] - self.pos[other]
+                distance2 = np.maximum((delta ** 2).sum(axis = 1), 1e-4)
+                force = k * k / distance2
+                displacement[:, 0] += np.bincount(node, weights = delta[:, 0] * force, minlength = len(nodes))
+                displacement[:, 1] += np.bincount(node, weights = delta[:, 1] * force, minlength = len(nodes))
+
+        return displacement
+
+
+## Place the nodes without initial position (rows with NaN) at the average position of their neighbours
+#  that have one, or close to the center of the layout if they have none
+#
+def _placeMissing(pos, A, rng):
+
+    missing = np.isnan(pos).any(axis = 1)
+    if not missing.any():
+        return pos
+    if missing.all():
+        return rng.random(pos.shape)
+
+    known = np.flatnonzero(~missing)
+    links = sp.csr_matrix((np.ones(A.nnz), (A.row, A.col)), shape = A.shape)[:, known]
+    counts = np.asarray(links.sum(axis = 1)).ravel()
+    sums = links @ pos[known]
+
+    center = pos[known].mean(axis = 0)
+    spread = 0.05 * max(np.ptp(pos[known, 0]), np.ptp(pos[known, 1]), 1e-2)
+    for i in np.flatnonzero(missing):
+        base = sums[i] / counts[i] if counts[i] > 0 else center
+        pos[i] = base + spread * (rng.random(2) - 0.5)
+
+    return pos
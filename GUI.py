@@ -7,18 +7,22 @@ Program:                Data Science
     
 """
 
+import time
 import numpy as np
 from os.path import dirname, join
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import networkx as nx
 
 import settings
 import Financial_Network as fnc
+import Graph_Store as gs
 
 from bokeh.io import curdoc
 from bokeh.layouts import row, widgetbox, layout, column
 from bokeh.models import ColumnDataSource, Button, Select, HoverTool
-from bokeh.models.widgets import TextInput, Div
+from bokeh.models.widgets import TextInput, Div, CheckboxGroup
 from bokeh.plotting import figure
 from bokeh.models.widgets import PreText
 
@@ -37,6 +41,31 @@ distressButton = Button(label="Distress Node")
 backToOriginalButton = Button(label="Back To Original")
 dataSource = Select(title="Data", options=['G_2010', 'G_2018', 'G_2018Corr'], value= 'G_2018')
 stats = PreText(text='', width=settings.STATS_W)
+animateCascade = CheckboxGroup(labels=["Animate cascade"], active=[])
+diagnostics = PreText(text='', width=settings.STATS_W)
+
+# Edge editing panel (what-if analysis, see Financial_Network.FinancialNetwork.whatIf)
+
+edgeFrom = TextInput(value="", title="Edge From (id):")
+edgeTo = TextInput(value="", title="Edge To (id):")
+edgeWeight = TextInput(value="", title="New Weight:")
+applyEditButton = Button(label="Apply Edge Edit")
+resetEditsButton = Button(label="Reset Edits")
+
+# The simulations run in a background thread of the session, the results are applied to the plot 
+# by callbacks scheduled on the document so that the server stays responsive
+
+doc = curdoc()
+executor = ThreadPoolExecutor(max_workers=1)
+doc.on_session_destroyed(lambda sessionContext: executor.shutdown(wait=False))
+
+# edges of the current data (see Graph_Store), flag set while a redraw of the edges is scheduled and 
+# text of the diagnostics of the debt rank of the current data
+lod = {'edges': None, 'pending': False, 'buildDiagnostics': ''}
+
+# copy of the current data modified by the edge edits of the session (None if no edit), number of edits and
+# generation of the edits (increased each time the edits are dropped, see update)
+whatIf = {'source': None, 'network': None, 'nbEdits': 0, 'generation': 0}
 
 # Create Column Data Source that will be used by the plot
 
@@ -58,7 +87,7 @@ TOOLTIPS=[
 # Create plot elements
 
 plot = figure(plot_height=settings.PLOT_H, plot_width=settings.PLOT_W, title="network",
-              tools=['tap', 'reset', 'box_zoom'], 
+              tools=['tap', 'reset', 'box_zoom'], output_backend='webgl',
               x_range=[settings.X_MIN, settings.X_MAX], y_range=[settings.Y_MIN, settings.Y_MAX])
 
 
@@ -77,8 +106,9 @@ plot.add_tools(HoverTool(tooltips=TOOLTIPS, renderers=[r_circles]))
 #
 def update():
     source = dataSource.value
-    G = nx.read_gexf(settings.PATH + source + '.gexf')
-    G = fnc.FinancialNetwork(None, None, None, G)
+    entry = gs.store.get(source)
+    G = entry['network']
+    whatIf.update(source = None, network = None, nbEdits = 0, generation = whatIf['generation'] + 1)
     centrality = nx.get_node_attributes(G,'debtRankCentrality')  # dictionary with nodex centrality  
     names = nx.get_node_attributes(G,'name')
     x = nx.get_node_attributes(G,'x')
@@ -98,10 +128,13 @@ def update():
         inducedStress = len(centrality) * ['-'],
         alphas = len(centrality) * [1]       
         )
-    graphStats = pd.DataFrame.from_dict(G.mainStats(), orient='index')
+    graphStats = pd.DataFrame.from_dict(entry['stats'], orient='index')
     graphStats = graphStats.rename(columns={0: 'Stats'})
-    lines_source.data = get_edges_specs(G)
+    lod['edges'] = entry['edges']
+    draw_edges()
     stats.text = str(graphStats)
+    lod['buildDiagnostics'] = format_diagnostics('Centrality (build)', entry['diagnostics'])
+    diagnostics.text = lod['buildDiagnostics']
 
 ##  Associated to the backToOriginalButton widget. Reset the graph to its original state.
 #
@@ -119,7 +152,7 @@ def backToOriginal():
 
 ##  Associated to the distressButton widget. Apply the stress parameter specified in the widget
 #   textInput to the selecet node and simulate its propagation across the network.
-#
+#   The simulation is submitted to the executor of the session (see simulate)
 #   
 def distress_node():
 
@@ -134,23 +167,23 @@ def distress_node():
             raise ValueError
             
         source = dataSource.value  
-        G = nx.read_gexf(settings.PATH + source + '.gexf')
+        entry = gs.store.get(source)
         
         if source == "G_2018Corr":
             raise Warning(' do not apply debt rank to a correlation based network')
-            
-                               
-        #Get mkt cap data as a relevance parameter for the debtRank function
-        mktCap = nx.get_node_attributes(G,'mktCap')
-        #print(mktCap)
-        
-        # Apply stress and simulate propagation
-        R, affectedNodes = fnc.debtRank(G, {node}, distressParameter, mktCap)
-        impact = {k: affectedNodes[k][1] for k in affectedNodes.keys()}
-        # Update graph
-        nodeSource.data['inducedStress'] = [impact[t] for t in sorted(impact.keys())]
-        nodeSource.data['alphas'] = [min(1, settings.DISTRESS_SCALING * impact[t]) for t in sorted(impact.keys())]
-        textOutput.value = ""
+        
+        # after edge edits the simulation runs on the modified network (the precomputed grid is not valid any more)
+        if whatIf['source'] == source and whatIf['network'] is not None:
+            network = whatIf['network']
+            entry = dict(entry, network = network, W = network.adjacencyMatrix, nodes = network.nodeList, stress = None)
+        
+        # position in the matrices of the entry of each node of nodeSource
+        index = entry['network'].nodeIndex
+        order = np.array([index[n] for n in nodeSource.data['node_id']])
+        
+        set_busy(True)
+        textOutput.value = "Running..."
+        executor.submit(simulate, entry, source, node, distressParameter, order, 0 in animateCascade.active)
     
     except ValueError:
         
@@ -163,35 +196,266 @@ def distress_node():
     except Exception as error:
         
         textOutput.value = 'Problem with Data ' + str(error)
- 
+
+
+##  Run in the background thread: simulate the propagation of the distress of node and schedule the update of the plot.
+#   Without animation the result is read from the precomputed grid when possible (see Financial_Network.stressFromGrid),
+#   with animation each round of the propagation is sent to the plot (see show_round)
+#   @param order: numpy array with the position in entry['nodes'] of each node of nodeSource
+#
+def simulate(entry, source, node, distressParameter, order, animate):
+
+    try:
+        
+        nodes = entry['nodes']
+        
+        if animate:
+            SD = np.array([n == node for n in nodes], dtype = bool)
+            for nbIter, state, distress in fnc.debtRankSteps(entry['network'].weightsSplit, SD, distressParameter):
+                doc.add_next_tick_callback(partial(show_round, source, nbIter, distress[order]))
+                time.sleep(settings.CASCADE_DELAY)
+        
+        else:
+            result = fnc.stressFromGrid(entry['stress'], node, distressParameter) if entry['stress'] is not None else None
+            if result is not None:
+                R, impact = result
+                report = 'read from the precomputed grid'
+            else:
+                collector = fnc.DebtRankCollector()
+                R, affectedNodes = fnc.debtRankVectorized(entry['network'], {node}, distressParameter, entry['mktCap'],
+                                                          W = entry['network'].weightsSplit, nodes = nodes,
+                                                          collector = collector)
+                impact = {k: affectedNodes[k][1] for k in affectedNodes.keys()}
+                report = collector.report()
+            doc.add_next_tick_callback(partial(show_impact, source, [impact[nodes[i]] for i in order]))
+            doc.add_next_tick_callback(partial(show_diagnostics, format_diagnostics('Last simulation', report)))
+        
+        doc.add_next_tick_callback(partial(end_simulation, ""))
+    
+    except Exception as error:
+        
+        doc.add_next_tick_callback(partial(end_simulation, 'Problem with Data ' + str(error)))
+
+
+##  Replace the induced stress of all the nodes with the final result of a simulation
+#
+def show_impact(source, inducedStress):
+
+    if source != dataSource.value: # the data has been changed during the simulation
+        return
+    
+    nodeSource.data['inducedStress'] = inducedStress
+    nodeSource.data['alphas'] = [min(1, settings.DISTRESS_SCALING * t) for t in inducedStress]
+
+
+##  Send to the plot only the nodes whose level of distress has changed during a round of the propagation
+#
+def show_round(source, nbIter, distress):
+
+    if source != dataSource.value:
+        return
+    
+    if nbIter == 0:
+        changed = np.arange(len(distress))
+    else:
+        previous = np.array([0 if t == '-' else t for t in nodeSource.data['inducedStress']], dtype = float)
+        changed = np.flatnonzero(distress != previous)
+    
+    if changed.size > 0:
+        nodeSource.patch({'inducedStress': [(int(i), float(distress[i])) for i in changed],
+                          'alphas': [(int(i), min(1, settings.DISTRESS_SCALING * float(distress[i]))) for i in changed]})
+    textOutput.value = "Round " + str(nbIter)
+
+
+##  Text of the diagnostics panel for a report of Financial_Network.DebtRankCollector (or a message)
+#
+def format_diagnostics(title, report):
+
+    if report is None:
+        return title + ': not available'
+    if not isinstance(report, dict):
+        return title + ': ' + str(report)
+    
+    lines = [title]
+    for k, v in report.items():
+        if isinstance(v, dict):
+            v = ', '.join(a + '=' + (str(round(b, 4)) if isinstance(b, float) else str(b)) for a, b in v.items())
+        elif isinstance(v, float):
+            v = round(v, 4)
+        lines.append('  {:<12} {}'.format(k, v))
+    
+    return '\n'.join(lines)
+
+
+##  Show the diagnostics of the last simulation below the diagnostics of the build
+#
+def show_diagnostics(text):
+
+    diagnostics.text = lod['buildDiagnostics'] + '\n\n' + text
+
+
+##  Enable the distressButton again at the end of a simulation and show the error message (if any)
+#
+def end_simulation(message):
+
+    set_busy(False)
+    textOutput.value = message
+
+
+##  Disable the buttons starting a background task or dropping the edge edits while a simulation or an edge edit is running
+#
+def set_busy(busy):
+
+    distressButton.disabled = busy
+    applyEditButton.disabled = busy
+    resetEditsButton.disabled = busy
+
+
+##  Associated to the applyEditButton widget. Set the weight of the edge specified in the edge editing panel
+#   and update the centrality of the nodes (see edit_edges). The edits are applied to a copy of the data
+#   owned by the session and are kept until the data is changed or the edits are reset
+#
+def apply_edit():
+
+    try:
+        
+        source = dataSource.value
+        entry = gs.store.get(source)
+        index = entry['network'].nodeIndex
+        
+        edge = (edgeFrom.value.strip(), edgeTo.value.strip())
+        if edge[0] not in index or edge[1] not in index:
+            raise KeyError
+        weight = float(edgeWeight.value)
+        if not weight >= 0:
+            raise ValueError
+        
+        order = np.array([index[n] for n in nodeSource.data['node_id']])
+        
+        set_busy(True)
+        textOutput.value = "Running..."
+        executor.submit(edit_edges, entry, source, {edge: weight}, order, whatIf['generation'])
+    
+    except KeyError:
         
+        textOutput.value = 'Unknown node id'
+    
+    except ValueError:
         
+        textOutput.value = 'Weight must be a number >=0'
 
+
+##  Run in the background thread: apply the changes of the weights to the copy of the data of the session
+#   (created at the first edit, with a full calculation of the centrality) and schedule the update of the plot
+#   @param changes: dictionary {(from, to): weight}
+#   @param order: numpy array with the position in entry['nodes'] of each node of nodeSource
+#   @param generation: generation of the edits when the edit was applied (see show_what_if)
+#
+def edit_edges(entry, source, changes, order, generation):
+
+    try:
+        
+        network = whatIf['network'] if whatIf['source'] == source else None
+        collector = fnc.DebtRankCollector()
+        if network is None:
+            network = fnc.FinancialNetwork(G = entry['network'])
+            impact, previous, recomputed = network.whatIf(changes, entry['mktCap'], collector)
+        else:
+            impact, previous, recomputed = network.whatIf(changes, collector = collector)
+        
+        nodes = network.nodeList
+        centrality = nx.get_node_attributes(network, 'debtRankCentrality')
+        edges = gs.edgeArrays(network, network.adjacencyMatrix, nodes)
+        report = collector.report()
+        report['nbRecomputed'] = len(recomputed)
+        
+        doc.add_next_tick_callback(partial(show_what_if, source, generation, network, [centrality[nodes[i]] for i in order], edges, report))
+        doc.add_next_tick_callback(partial(end_simulation, str(len(recomputed)) + ' node shocks propagated again'))
     
+    except Exception as error:
+        
+        doc.add_next_tick_callback(partial(end_simulation, 'Problem with Data ' + str(error)))
 
-##  Create edges for the graphs and define the the intensity of their colour
+
+##  Show the centrality and the edges of the modified network. The edit is dropped if the data has been
+#   changed or the edits have been reset since it was applied
 #
+def show_what_if(source, generation, network, nodesCentrality, edges, report):
+
+    if source != dataSource.value or generation != whatIf['generation']:
+        return
+    
+    whatIf.update(source = source, network = network, nbEdits = whatIf['nbEdits'] + 1)
+    nodeSource.data['centrality'] = nodesCentrality
+    nodeSource.data['sizeParameter'] = [settings.SIZE_CIRCLE_1 + settings.SIZE_CIRCLE_2 * t / max(nodesCentrality) for t in nodesCentrality]
+    lod['edges'] = edges
+    draw_edges()
+    show_diagnostics(format_diagnostics('What-if (' + str(whatIf['nbEdits']) + ' edits)', report))
+
+
+##  Associated to the resetEditsButton widget. Drop the edge edits and reload the original data
 #
-def get_edges_specs(graph):
-    d = dict(xs=[], ys=[], alphas=[], weights=[])
-    weights = [d['weight'] for u, v, d in graph.edges(data=True)]
-    max_weight = max(weights)
-    calcAlpha = lambda h:  settings.EDGE_SCALING * (h / max_weight)
-    x = nx.get_node_attributes(graph,'x')
-    y = nx.get_node_attributes(graph,'y')
+def reset_edits():
+
+    update()
+    textOutput.value = ""
+
 
-    for u, v, data in graph.edges(data=True):
-        d['xs'].append([x[u], x[v]])
-        d['ys'].append([y[u], y[v]])
-        d['alphas'].append(calcAlpha(data['weight']))
-        d['weights'].append(data['weight'])
+##  Create edges for the graphs and define the the intensity of their colour.
+#   Level of detail: only the edges with a weight above settings.EDGE_THRESHOLD that cross the visible area
+#   are kept, and at most the settings.MAX_EDGES heaviest of them
+#   @param edges: dictionary of arrays sorted by decreasing weight (see Graph_Store)
+#   @param bounds: visible area (xMin, xMax, yMin, yMax), None for the whole plot
+#
+def get_edges_specs(edges, bounds = None):
+    weights = edges['weights']
+    if len(weights) == 0:
+        return dict(xs=[], ys=[], alphas=[], weights=[])
+    max_weight = weights[0]
+    
+    x0, y0, x1, y1 = edges['x0'], edges['y0'], edges['x1'], edges['y1']
+    keep = weights > settings.EDGE_THRESHOLD
+    if bounds is not None:
+        xMin, xMax, yMin, yMax = bounds
+        keep &= (np.minimum(x0, x1) <= xMax) & (np.maximum(x0, x1) >= xMin)
+        keep &= (np.minimum(y0, y1) <= yMax) & (np.maximum(y0, y1) >= yMin)
+    selected = np.flatnonzero(keep)[:settings.MAX_EDGES]  # edges are sorted by decreasing weight
     
-    return d
+    return dict(xs = np.column_stack((x0[selected], x1[selected])).tolist(),
+                ys = np.column_stack((y0[selected], y1[selected])).tolist(),
+                alphas = (settings.EDGE_SCALING * weights[selected] / max_weight).tolist(),
+                weights = weights[selected].tolist())
+
+
+##  Draw the edges for the visible area of the plot
+#
+def draw_edges():
+    lod['pending'] = False
+    if lod['edges'] is not None:
+        bounds = (plot.x_range.start, plot.x_range.end, plot.y_range.start, plot.y_range.end)
+        lines_source.data = get_edges_specs(lod['edges'], bounds)
+
+
+##  Associated to the ranges of the plot: refine the edges after a zoom. The changes of the 4 bounds
+#   are grouped into a single redraw
+#
+def refine_edges(attr, old, new):
+    if not lod['pending']:
+        lod['pending'] = True
+        doc.add_timeout_callback(draw_edges, settings.LOD_DELAY)
+
+
+for r in [plot.x_range, plot.y_range]:
+    r.on_change('start', refine_edges)
+    r.on_change('end', refine_edges)
 
 
 
 # Create and populate layout
 
+applyEditButton.on_click(apply_edit)
+resetEditsButton.on_click(reset_edits)
+
 controls = [distressButton, backToOriginalButton, dataSource]
 for control in controls:
     if control == backToOriginalButton:
@@ -207,7 +471,8 @@ for control in controls:
         
 sizingMode = 'fixed' 
 
-inputs = row(widgetbox(distressButton, backToOriginalButton, textInput, textOutput, dataSource, stats))
+inputs = row(widgetbox(distressButton, backToOriginalButton, textInput, animateCascade, textOutput, dataSource, stats, diagnostics),
+             widgetbox(edgeFrom, edgeTo, edgeWeight, applyEditButton, resetEditsButton))
 
 l = layout([
     [desc],
@@ -217,4 +482,4 @@ l = layout([
 
 update()  # initial load of the data
 
-curdoc().add_root(l)
\ No newline at end of file
+doc.add_root(l)
\ No newline at end of file
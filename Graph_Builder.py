@@ -3,81 +3,270 @@ Year End Project
 Program:                Data Science
 @author:                Marco Corsi
 @Description:  Construct 3 different graphs based on ownership data (in 2010 and 2018) and correlation data (for 2018).
-For each graph the centrality debtRank measure is calculated on each node. The final graphs and attributes are then stored 
-in .gexf files.
+For each graph the centrality debtRank measure is calculated on each node. The final graphs and attributes are then stored
+in .npz files (and exported in .gexf files), together with the precomputed single node shocks used by the GUI.
+Optionally (see settings.SNAPSHOT_START) build the networks for a list of dates and methods in parallel and store the
+debtRank centrality of all the snapshots into a single panel.
 """
 
 
 
 
+import os
+import json
 import pandas as pd
 import numpy as np
 import networkx as nx
-import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 import DB_Utilities as dbm
 import settings
 import Financial_Network as fn
+import Build_Cache as bc
+
+
+listAttributes = ['name', 'currency', 'benchmark']
+
+
+## Build a network with its attributes: market cap, layout (i.e. chart coordinates) and debt rank centrality.
+#  If the build cache is enabled (settings.BUILD_CACHE_MB > 0), each step (weights -> graph, graph -> layout,
+#  graph + market caps -> centrality) is skipped when its inputs have not changed since a previous build.
+#  @param weights: dataFrame with the weights (see FinancialNetwork) or pair (sparse matrix, list of nodes)
+#  @param nodesAttributes: dictionary with the static attributes of the nodes (see DB_Utilities.getNodesAttributes)
+#  @param marketCaps: dictionary with the market cap of each node
+#  @param collector: optional Financial_Network.DebtRankCollector recording the propagation of the centrality
+#                    (the centrality is then always recomputed)
+#  @param initial: optional dictionary with the position (x, y) of the nodes in a previous network. The layout is then
+#                  warm-started from these positions and refined with settings.WARM_ITERATIONS iterations
+#
+def buildNetwork(weights, nodesAttributes, marketCaps, collector = None, initial = None):
+
+    cache = None
+    if settings.BUILD_CACHE_MB > 0:
+        cache = bc.BuildCache(settings.BUILD_CACHE, settings.BUILD_CACHE_MB * 1e6)
+
+    # weights -> graph
+    graphKey = cache.key('graph', weights, nodesAttributes, listAttributes) if cache else None
+    G = cache.get(graphKey) if cache else None
+    if G is None:
+        if isinstance(weights, pd.DataFrame):
+            G = fn.FinancialNetwork(weights, nodesAttributes, listAttributes)
+        else:
+            G = fn.FinancialNetwork.fromMatrix(weights[0], weights[1], nodesAttributes, listAttributes)
+        if cache:
+            cache.put(graphKey, G)
+
+    nx.set_node_attributes(G, marketCaps, 'mktCap')
+
+    # graph -> layout
+    iterations, temperature = (settings.MAX_ITER, 0.1) if initial is None else (settings.WARM_ITERATIONS, settings.WARM_TEMPERATURE)
+    layoutKey = cache.key('layout', graphKey, settings.SCALE, settings.LIMIT, settings.IDEAL_DIST, iterations, temperature,
+                          settings.LAYOUT_SEED, initial) if cache else None
+    layout = cache.get(layoutKey) if cache else None
+    if layout is None:
+        G.generateLayout(settings.SCALE, settings.LIMIT, settings.IDEAL_DIST, iterations, initial, temperature,
+                         settings.LAYOUT_SEED, settings.LAYOUT_WORKERS)
+        layout = {'x': nx.get_node_attributes(G, 'x'), 'y': nx.get_node_attributes(G, 'y')}
+        if cache:
+            cache.put(layoutKey, layout)
+    else:
+        nx.set_node_attributes(G, layout['x'], 'x')
+        nx.set_node_attributes(G, layout['y'], 'y')
+
+    # graph + market caps -> centrality
+    centralityKey = cache.key('centrality', graphKey, marketCaps) if cache else None
+    centrality = cache.get(centralityKey) if cache and collector is None else None
+    if centrality is None:
+        G.debtRankCentrality(marketCaps, collector)
+        if cache:
+            cache.put(centralityKey, nx.get_node_attributes(G, 'debtRankCentrality'))
+    else:
+        nx.set_node_attributes(G, centrality, 'debtRankCentrality')
+
+    return G
+
+
+## Positions (x, y) of the nodes of a network, to be used as initial positions of the layout of another network
+#
+def layoutOf(G):
+
+    return {n: (G.nodes[n]['x'], G.nodes[n]['y']) for n in G.nodes()}
+
+
+## Print the aggregated report of the propagation of the debt rank (see Financial_Network.DebtRankCollector) and
+#  save it into the file <path>_diagnostics.json (shown by the GUI), with the fingerprint of the network
+#  @param collector: DebtRankCollector
+#  @param path: string with path and name of the network file (without extension)
+#  @param G: FinancialNetwork whose centrality has been recorded
+#
+def saveDiagnostics(collector, path, G):
+
+    report = collector.report()
+    print(os.path.basename(path), report)
+    with open(path + "_diagnostics.json", 'w') as f:
+        json.dump(dict(report, fingerprint = fingerprintOf(G)), f, indent = 1)
+
+
+## Fingerprint of the weights, nodes and market caps (node attribute mktCap) of a network (see Financial_Network.networkFingerprint)
+#  @param hGrid: optional levels of distress of a stress grid
+#
+def fingerprintOf(G, hGrid = ()):
+
+    W, nodes = fn.weightsMatrix(G)
+
+    return fn.networkFingerprint(W, nodes, fn.relevanceVector(nx.get_node_attributes(G, 'mktCap'), nodes), hGrid)
+
+
+## Precompute the single node shocks of all the nodes of a network for the levels of distress in settings.STRESS_GRID
+#  and save them next to the network in the files <path>_stress.npz and <path>_stress_impact.npy (used by the GUI,
+#  see Financial_Network.stressFromGrid), with the fingerprint of the network (see fingerprintOf).
+#  The grid is taken from the build cache when the network and the market caps have not changed.
+#  @param G: FinancialNetwork
+#  @param marketCaps: dictionary with the market cap of each node
+#  @param path: string with path and name of the network file (without extension)
+#
+def buildStressGrid(G, marketCaps, path):
+
+    W, nodes = fn.weightsMatrix(G)
+    marketCaps = {n: marketCaps[n] for n in nodes} # same relevance as the simulations of the GUI (node attribute mktCap)
+
+    cache = None
+    if settings.BUILD_CACHE_MB > 0:
+        cache = bc.BuildCache(settings.BUILD_CACHE, settings.BUILD_CACHE_MB * 1e6)
+
+    gridKey = cache.key('stressGrid', W, nodes, marketCaps, settings.STRESS_GRID) if cache else None
+    grid = cache.get(gridKey) if cache else None
+    if grid is None:
+        grid = fn.stressGrid(W, fn.relevanceVector(marketCaps, nodes), settings.STRESS_GRID)
+        if cache:
+            cache.put(gridKey, grid)
+
+    fn.saveStressGrid(path + "_stress.npz", nodes, settings.STRESS_GRID, grid[0], grid[1], fingerprintOf(G, settings.STRESS_GRID))
+
+
+# connections of the worker processes of buildHistory (see _initWorker)
+_worker = {}
+
+
+## Initializer of the worker processes of buildHistory: open the connections to the database once per process
+#
+def _initWorker():
+
+    _worker['pool'] = dbm.ConnectionPool(settings.DB)
+
+
+## Build the network of a method as of a date: the last weights snapshot available at the date (from the nodesEdges table)
+#  and the market caps of the date. The network is saved in the file G_<method>_<date>.npz
+#  @param date: string with the date (YYYY-MM-DD)
+#  @param _method: string with the name of the method used for the weights generation
+#  @param initial: optional initial positions of the layout (see buildNetwork)
+#  @return date, method, dictionary with the debt rank centrality of each node and layout of the network 
+#          (None and None if no weights or no market caps are available). The nodes without a market cap as of
+#          the date are reported and get a relevance of 0
+#
+def buildSnapshot(date, _method, initial = None):
+
+    DB = _worker.get('pool', settings.DB)
+
+    weightsDate = dbm.getSnapshotAsOf(DB, date, _method)
+    if weightsDate is None:
+        return date, _method, None, None
+
+    # without market caps the relevance would silently be equal for all the nodes
+    marketCaps = dbm.getMarketCapsAsOf(DB, date)
+    if len(marketCaps) == 0:
+        print('snapshot ' + _method + ' ' + date + ' skipped: no market caps as of this date')
+        return date, _method, None, None
+
+    nodesAttributes = dbm.getNodesAttributes(DB)
+    weights = dbm.getNodesEdges(DB, weightsDate, _method, sparse = True)
+
+    # the nodes not priced as of the date (e.g. not listed yet) are kept, with relevance 0
+    missing = [n for n in weights[1] if n not in marketCaps]
+    if len(missing) > 0:
+        print('snapshot ' + _method + ' ' + date + ': no market cap as of this date for ' + ', '.join(map(str, missing))
+              + ' (relevance 0)')
+        marketCaps = dict(marketCaps, **dict.fromkeys(missing, 0.0))
+
+    G = buildNetwork(weights, nodesAttributes, marketCaps, initial = initial)
+    G.saveNetwork(settings.PATH + "G_" + _method + "_" + date, 'npz')
+
+    return date, _method, nx.get_node_attributes(G, 'debtRankCentrality'), layoutOf(G)
+
+
+## Build the snapshots for all the combinations of dates and methods over a pool of processes and store the debt rank
+#  centrality of all the snapshots into a single panel (rows are (method, date), columns are the nodes).
+#  For each method the first snapshot is built first and its layout is used to warm-start the layouts of the others,
+#  so that the nodes keep similar positions over time
+#  @param dates: list of dates (YYYY-MM-DD)
+#  @param methods: list of methods used for the weights generation
+#  @param nbWorkers: number of processes (default is the number of cores)
+#  @return the panel as a dataframe
+#
+def buildHistory(dates, methods, nbWorkers = None):
+
+    results = []
+    tasks = []
+    for m in methods:
+        reference = None
+        for d in dates:
+            if reference is None:
+                results.append(buildSnapshot(d, m))
+                reference = results[-1][3]
+            else:
+                tasks.append((d, m, reference))
+
+    with ProcessPoolExecutor(nbWorkers, initializer = _initWorker) as pool:
+        results = results + list(pool.map(buildSnapshot, *zip(*tasks))) if len(tasks) > 0 else results
+
+    centrality = {(m, d): c for d, m, c, layout in results if c is not None}
+    panel = pd.DataFrame.from_dict(centrality, orient = 'index')
+    if len(centrality) > 0:
+        panel.index = pd.MultiIndex.from_tuples(panel.index, names = ['method', 'date'])
+        panel = panel.sort_index()
+    panel.to_csv(settings.PATH + "debtRankCentrality.csv")
+
+    return panel
 
 
 def main():
-    
-    listAttributes = ['name', 'currency', 'benchmark']
-    
-    # get weighst and nodes attributes
-    nodesAttributes = dbm.getNodesAttributes(settings.DB)
-    weights2010 = dbm.getNodesWeights(settings.DB, '2010', 'equityOwnership')
-    weights2018 = dbm.getNodesWeights(settings.DB, '2018', 'equityOwnership')
-    weights2018Corr = dbm.getNodesWeights(settings.DB, '2018', 'correlation')
-    
-    G2010 = fn.FinancialNetwork(weights2010, nodesAttributes, listAttributes)
-    G2018 = fn.FinancialNetwork(weights2018, nodesAttributes, listAttributes)
-    G2018Corr = fn.FinancialNetwork(weights2018Corr, nodesAttributes, listAttributes)
-    
-    # Get market cap for each node as of the last available day (in USD)
-    db = sqlite3.connect(settings.DB)
-    cursor = db.cursor()
-    cursor.execute("SELECT node_id, market_cap FROM priceHistoryUSD WHERE date = '2018-06-12' ")
-    all_rows = cursor.fetchall()
-    marketCaps2018 = {}
-    for i in range(len(all_rows)):
-        marketCaps2018[all_rows[i][0]] = float(all_rows[i][1])
-    db.close()
-    
-    # Get market cap for each node as of the last available day (in USD)
-    db = sqlite3.connect(settings.DB)
-    cursor = db.cursor()
-    cursor.execute("SELECT node_id, market_cap FROM priceHistoryUSD WHERE date = '2010-07-21' ")
-    all_rows = cursor.fetchall()
-    marketCaps2010 = {}
-    for i in range(len(all_rows)):
-        marketCaps2010[all_rows[i][0]] = float(all_rows[i][1])
-    db.close()    
-    
-    # add mkt cap as attribute
-    nx.set_node_attributes(G2010, marketCaps2010, 'mktCap')
-    nx.set_node_attributes(G2018, marketCaps2018, 'mktCap')
-    nx.set_node_attributes(G2018Corr, marketCaps2018, 'mktCap')
-    
-    # add layout (i.e. chart coordinates) as attribute
-    G2010.generateLayout(settings.SCALE, settings.LIMIT, settings.IDEAL_DIST, settings.MAX_ITER)
-    G2018.generateLayout(settings.SCALE, settings.LIMIT, settings.IDEAL_DIST, settings.MAX_ITER)
-    G2018Corr.generateLayout(settings.SCALE, settings.LIMIT, settings.IDEAL_DIST, settings.MAX_ITER)
-    
-    # add debt rank centrality as attribute
-    G2010.debtRankCentrality(marketCaps2010)
-    G2018.debtRankCentrality(marketCaps2018)
-    G2018Corr.debtRankCentrality(marketCaps2018)
-    
-    # save
-    G2010.saveNetwork(settings.PATH + "G_2010")
-    G2018.saveNetwork(settings.PATH + "G_2018")
-    G2018Corr.saveNetwork(settings.PATH + "G_2018Corr")
-
-
-
-main()
 
+    # get weighst and nodes attributes, and market cap for each node as of the last available day (in USD)
+    with dbm.ConnectionPool(settings.DB) as pool:
+        nodesAttributes = dbm.getNodesAttributes(pool)
+        weights2010 = dbm.getNodesWeights(pool, '2010', 'equityOwnership')
+        weights2018 = dbm.getNodesWeights(pool, '2018', 'equityOwnership')
+        weights2018Corr = dbm.getNodesWeights(pool, '2018', 'correlation')
+        marketCaps2018 = dbm.getMarketCapsAsOf(pool, '2018-06-12')
+        marketCaps2010 = dbm.getMarketCapsAsOf(pool, '2010-07-21')
+
+    # add mkt cap, layout and debt rank centrality as attributes (with the diagnostics of the debt rank if required)
+    collectors = {name: fn.DebtRankCollector() if settings.DEBTRANK_DIAGNOSTICS else None for name in ['G_2010', 'G_2018', 'G_2018Corr']}
+    # the layouts of 2018 are warm-started from 2010, so that the nodes keep similar positions in the GUI
+    G2010 = buildNetwork(weights2010, nodesAttributes, marketCaps2010, collectors['G_2010'])
+    G2018 = buildNetwork(weights2018, nodesAttributes, marketCaps2018, collectors['G_2018'], layoutOf(G2010))
+    G2018Corr = buildNetwork(weights2018Corr, nodesAttributes, marketCaps2018, collectors['G_2018Corr'], layoutOf(G2010))
+    if settings.DEBTRANK_DIAGNOSTICS:
+        networks = {'G_2010': G2010, 'G_2018': G2018, 'G_2018Corr': G2018Corr}
+        for name in collectors.keys():
+            saveDiagnostics(collectors[name], settings.PATH + name, networks[name])
+
+    # save (binary file used by the GUI and .gexf export)
+    for fileFormat in ['npz', 'gexf']:
+        G2010.saveNetwork(settings.PATH + "G_2010", fileFormat)
+        G2018.saveNetwork(settings.PATH + "G_2018", fileFormat)
+        G2018Corr.saveNetwork(settings.PATH + "G_2018Corr", fileFormat)
+
+    # single node shocks served by the GUI (the debt rank is not applied to the correlation network)
+    if len(settings.STRESS_GRID) > 0:
+        buildStressGrid(G2010, marketCaps2010, settings.PATH + "G_2010")
+        buildStressGrid(G2018, marketCaps2018, settings.PATH + "G_2018")
 
+    # centrality history
+    if settings.SNAPSHOT_START is not None:
+        dates = list(pd.date_range(settings.SNAPSHOT_START, settings.SNAPSHOT_END, freq = settings.SNAPSHOT_FREQ).strftime('%Y-%m-%d'))
+        buildHistory(dates, settings.SNAPSHOT_METHODS)
 
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Year End Project
+Program:                Data Science
+@author:                Marco Corsi
+@Description: Process-level store of the networks used by the GUI. Each network file is parsed only once and kept in memory
+              together with its weights matrix, node order and main stats. The store is a module level object, so it is shared
+              by all the sessions of the Bokeh server running in the same process.
+"""
+
+
+
+
+import os
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+
+import settings
+import Financial_Network as fn
+
+
+
+
+##  Bounded store of parsed networks with a Least Recently Used eviction policy.
+#   Entries are identified by the name of the dataset and by the modification time of the file,
+#   so a network is parsed again only if its file has been rebuilt.
+#   The entries are shared between sessions and must be treated as read-only.
+#
+class GraphStore():
+
+    ## @param path: folder containing the network files
+    #  @param maxSize: maximum number of networks kept in memory
+    #
+    def __init__(self, path, maxSize):
+
+        self.path = path
+        self.maxSize = maxSize
+        self._entries = OrderedDict()   # (name, mtime) -> entry
+        self._lock = threading.Lock()   # protects _entries and _loading
+        self._loading = {}              # name -> lock held while the file is being parsed
+
+
+    ## Return the entry for the dataset name, parsing the file only if it is not in the store.
+    #  The binary .npz file is used when available, otherwise the .gexf file
+    #  @param name: name of the dataset (e.g. 'G_2018')
+    #  @return dictionary with the keys network, W, nodes, stats, mktCap, stress, edges, diagnostics, mtime
+    #
+    def get(self, name):
+
+        fileName = self.path + name + '.npz'
+        if not os.path.exists(fileName):
+            fileName = self.path + name + '.gexf'
+        key = (name, os.path.getmtime(fileName))
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        # only one session parses a given file, the others wait for its result
+        with loading:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key]
+
+            entry = self._load(fileName)
+            entry['mtime'] = key[1]
+
+            with self._lock:
+                # older versions of the same dataset are not needed any more
+                for k in [k for k in self._entries.keys() if k[0] == name]:
+                    del self._entries[k]
+                self._entries[key] = entry
+                while len(self._entries) > self.maxSize:
+                    self._entries.popitem(last = False)
+
+        return entry
+
+
+    ## Remove all the entries from the store
+    #
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+
+
+    ## Parse a network file and precompute everything the GUI needs. The single node shocks
+    #  precomputed by Graph_Builder (file <name>_stress.npz, impact memory-mapped) and the diagnostics of the 
+    #  debt rank (file <name>_diagnostics.json) are loaded if available and if their fingerprint matches the
+    #  network (None otherwise, e.g. for the files left by a previous build)
+    #
+    def _load(self, fileName):
+
+        G = fn.loadNetwork(fileName)
+        W, nodes = fn.weightsMatrix(G)
+        mktCap = nx.get_node_attributes(G, 'mktCap')
+        relevance = fn.relevanceVector(mktCap, nodes)
+
+        stress = None
+        stressFile = os.path.splitext(fileName)[0] + '_stress.npz'
+        if os.path.exists(stressFile):
+            stress = fn.loadStressGrid(stressFile)
+            if stress is None or stress['fingerprint'] != fn.networkFingerprint(W, nodes, relevance, stress['hGrid']):
+                print('stress grid ' + stressFile + ' ignored: it does not match the network')
+                stress = None
+
+        diagnostics = None
+        diagnosticsFile = os.path.splitext(fileName)[0] + '_diagnostics.json'
+        if os.path.exists(diagnosticsFile):
+            with open(diagnosticsFile) as f:
+                diagnostics = json.load(f)
+            if diagnostics.pop('fingerprint', None) != fn.networkFingerprint(W, nodes, relevance, ()):
+                print('diagnostics ' + diagnosticsFile + ' ignored: they do not match the network')
+                diagnostics = None
+
+        return {'network': G,
+                'W': W,
+                'nodes': nodes,
+                'stats': G.mainStats(),
+                'mktCap': mktCap,
+                'stress': stress,
+                'edges': edgeArrays(G, W, nodes),
+                'diagnostics': diagnostics}
+
+
+
+## Arrays describing the edges with a positive weight, sorted by decreasing weight, with the coordinates
+#  of their ends (used by the level of detail rendering of the GUI)
+#  @return dictionary with the keys x0, y0, x1, y1 (numpy arrays) and weights
+#
+def edgeArrays(G, W, nodes):
+
+    W = sp.coo_matrix(W)
+    keep = W.data > 0
+    src, dst, weights = W.row[keep], W.col[keep], W.data[keep]
+
+    order = np.argsort(-weights, kind = 'stable')
+    x = np.array([G.nodes[n]['x'] for n in nodes], dtype = float)
+    y = np.array([G.nodes[n]['y'] for n in nodes], dtype = float)
+    src, dst = src[order], dst[order]
+
+    return {'x0': x[src], 'y0': y[src], 'x1': x[dst], 'y1': y[dst], 'weights': weights[order]}
+
+
+
+# store shared by all the sessions of the process
+store = GraphStore(settings.PATH, settings.GRAPH_STORE_SIZE)
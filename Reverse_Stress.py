@@ -0,0 +1,229 @@
+"""
+Year End Project
+Program:                Data Science
+@author:                Marco Corsi
+@Description: Reverse stress testing: find the smallest set of nodes whose joint distress causes a debt rank R above a target
+              (optionally with a budget, the maximum number of nodes of the set). The exhaustive search over the subsets is
+              not feasible, so the set is built greedily, adding at each step the node with the largest marginal gain of R.
+              The marginal gains are evaluated lazily (CELF): the gains of the previous steps are used as upper bounds and
+              only the best candidates are evaluated again. The candidates are scored in batches (one propagation for many
+              sets, see Financial_Network.debtRankBatch) over a pool of processes sharing the weights matrix.
+              Finally the nodes that are not needed to reach the target are removed from the set.
+"""
+
+# File Structure:
+#       1. Libraries
+#       2. Scoring of the candidates (in the current process or over a pool of processes)
+#       3. Greedy search
+
+
+
+
+import os
+import heapq
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+from concurrent.futures import ProcessPoolExecutor
+
+import settings
+import Financial_Network as fn
+import Stress_Scenarios as ss
+
+
+
+
+# Scoring ##################################################################################
+
+
+## Debt rank of the sets base + {c} for each candidate c (one column of a batched propagation for each candidate)
+#  @param base: list with the positions of the nodes already in the set
+#  @param candidates: list with the positions of the candidates
+#  @return numpy array with the debt rank of each set
+#
+def _score(W, relevance, base, candidates, h, maxIter):
+
+    SD = np.zeros((W.shape[0], len(candidates)), dtype = bool)
+    SD[base, :] = True
+    SD[candidates, np.arange(len(candidates))] = True
+
+    return fn.debtRankBatch(W, SD, h, relevance, maxIter)[0]
+
+
+## Score a chunk of candidates in a worker process, on the weights matrix in shared memory, split in levels once
+#  by the worker (see Stress_Scenarios._initWorker)
+#
+def _scoreChunk(base, candidates, h, maxIter):
+
+    return _score(ss._worker['split'], ss._worker['arrays']['relevance'], base, candidates, h, maxIter)
+
+
+##  Scoring of the candidates of the greedy search: the candidates are split in chunks of at most chunkSize sets
+#   (and at least one chunk for each worker), scored in the current process (nbWorkers = 1) or over a pool of processes
+#
+class Scorer():
+
+    def __init__(self, W, relevance, h, maxIter, nbWorkers, chunkSize):
+
+        self.W = W
+        self.split = fn.WeightsSplit(W) # built once for all the sets scored in the current process
+        self.relevance = relevance
+        self.h = h
+        self.maxIter = maxIter
+        self.chunkSize = chunkSize
+        self.nbWorkers = nbWorkers
+        self.nbEvaluations = 0
+        self._pool = None
+        self._blocks = {}
+
+        if nbWorkers > 1:
+            descriptions = {}
+            for k, array in [('data', W.data), ('indices', W.indices), ('indptr', W.indptr), ('relevance', relevance)]:
+                self._blocks[k], descriptions[k] = ss._toSharedMemory(array)
+            self._pool = ProcessPoolExecutor(nbWorkers, initializer = ss._initWorker, initargs = (descriptions, W.shape))
+
+
+    ## Debt rank of the sets base + {c} for each candidate c
+    #  @return numpy array with the debt rank of each set
+    #
+    def score(self, base, candidates):
+
+        candidates = list(candidates)
+        self.nbEvaluations += len(candidates)
+        size = max(1, min(self.chunkSize, -(-len(candidates) // self.nbWorkers))) # at least one chunk per worker
+        chunks = [candidates[c:c + size] for c in range(0, len(candidates), size)]
+        if len(chunks) == 0:
+            return np.zeros(0)
+
+        if self._pool is None or len(chunks) == 1:
+            results = [_score(self.split, self.relevance, base, c, self.h, self.maxIter) for c in chunks]
+        else:
+            results = self._pool.map(_scoreChunk, [base] * len(chunks), chunks, [self.h] * len(chunks),
+                                     [self.maxIter] * len(chunks))
+
+        return np.concatenate(list(results))
+
+
+    ## Stop the pool of processes and release the shared memory
+    #
+    def close(self):
+
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for k in self._blocks.keys():
+            self._blocks[k].close()
+            self._blocks[k].unlink()
+        self._blocks = {}
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+
+# Greedy search ############################################################################
+
+
+## Find the smallest set of nodes whose joint distress causes a debt rank R >= target.
+#  The set is built greedily with lazy evaluation of the marginal gains (CELF): the gains computed at the previous
+#  steps are upper bounds of the current gains when R is submodular, so at each step only the candidates with the
+#  largest bounds are evaluated again (batchSize at a time) until the best candidate has an up to date gain.
+#  The debt rank is not always submodular, so the result is a heuristic (as the greedy search itself).
+#  @param network: FinancialNetwork
+#  @param relevance: dictionnary with absolute economic relevance of each node (could be Makt cap or other)
+#  @param target: target level of the debt rank R
+#  @param budget: maximum number of nodes of the set (None for no limit)
+#  @param h: initial level of distress of the nodes of the set
+#  @param candidates: list of the nodes that can be distressed (default is all the nodes)
+#  @param batchSize: number of candidates evaluated again at once at each step
+#  @param nbWorkers: number of processes scoring the candidates (default is the number of cores, 1 for no pool)
+#  @param chunkSize: maximum number of sets scored in a single batched propagation
+#  @param maxIter: maximum number of iterations of the debt rank
+#  @return dictionary with the keys seeds (list of nodes, in the order of selection), R (debt rank of the set),
+#          reached (True if R >= target), path (debt rank after each selection) and nbEvaluations (number of sets scored)
+#
+def reverseStress(network, relevance, target, budget = None, h = 1, candidates = None, batchSize = 16,
+                  nbWorkers = None, chunkSize = 256, maxIter = 100):
+
+    W, nodes = fn.weightsMatrix(network)
+    W = sp.csr_matrix(W)
+    rel = fn.relevanceVector(relevance, nodes)
+    index = {nodes[i]: i for i in range(len(nodes))}
+
+    candidates = np.arange(len(nodes)) if candidates is None else np.array([index[c] for c in candidates], dtype = int)
+    if budget is None:
+        budget = len(candidates)
+    if nbWorkers is None:
+        nbWorkers = os.cpu_count()
+
+    seeds, path = [], []
+    R = 0.0
+
+    with Scorer(W, rel, h, maxIter, nbWorkers, chunkSize) as scorer:
+
+        # heap of (-upper bound of the gain, candidate, step of the evaluation), initialised with the single node shocks
+        gains = scorer.score([], candidates)
+        heap = [(-gains[i], int(candidates[i]), 0) for i in range(len(candidates))]
+        heapq.heapify(heap)
+
+        while R < target and len(seeds) < budget and heap:
+            step = len(seeds)
+
+            # evaluate again the best candidates until the best one has an up to date gain
+            while heap[0][2] != step:
+                stale = []
+                while heap and heap[0][2] != step and len(stale) < batchSize:
+                    stale.append(heapq.heappop(heap)[1])
+                values = scorer.score(seeds, stale) - R
+                for c, v in zip(stale, values):
+                    heapq.heappush(heap, (-v, c, step))
+
+            gain, c, _ = heapq.heappop(heap)
+            seeds.append(c)
+            R = R - gain
+            path.append(float(R))
+
+        # remove the nodes that are not needed to reach the target (the last selected is tried first)
+        if R >= target:
+            removed = True
+            while removed and len(seeds) > 1:
+                removed = False
+                for s in reversed(seeds):
+                    rest = [t for t in seeds if t != s]
+                    value = scorer.score(rest[:-1], rest[-1:])[0]
+                    if value >= target:
+                        seeds, R, removed = rest, float(value), True
+                        break
+
+        nbEvaluations = scorer.nbEvaluations
+
+    return {'seeds': [nodes[s] for s in seeds],
+            'R': float(R),
+            'reached': bool(R >= target),
+            'path': path,
+            'nbEvaluations': nbEvaluations}
+
+
+
+def main():
+
+    for source in ['G_2010', 'G_2018']:
+
+        G = fn.loadNetwork(settings.PATH + source + '.gexf')
+        mktCap = nx.get_node_attributes(G, 'mktCap')
+
+        result = reverseStress(G, mktCap, settings.REVERSE_TARGET, settings.REVERSE_BUDGET, settings.REVERSE_H)
+
+        print(source)
+        for k, v in result.items():
+            print('    ', k, v)
+
+
+
+if __name__ == '__main__':
+    main()
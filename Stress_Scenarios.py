@@ -0,0 +1,296 @@
+"""
+Year End Project
+Program:                Data Science
+@author:                Marco Corsi
+@Description: Headless Monte Carlo runner for stress scenarios. Each scenario distresses a random set of nodes with a random
+              level of distress on a randomly perturbed version of the network and measures the debt rank R of the shock.
+              The scenarios are split in chunks and run over a pool of processes that share the (read-only) weights
+              matrix; the distribution of R is aggregated on the fly so that memory does not depend on the number of scenarios.
+"""
+
+# File Structure:
+#       1. Libraries
+#       2. Streaming aggregation of the loss distribution
+#       3. Workers (shared memory and simulation of a chunk of scenarios)
+#       4. Scenario runner
+
+
+
+
+import os
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import settings
+import Financial_Network as fn
+
+
+
+
+##  Streaming aggregation of the distribution of the losses R (R is always in [0,1]).
+#   The losses are accumulated in a fixed number of bins (count and sum of the losses for each bin)
+#   so that the quantiles (VaR) and the expected shortfall (ES) can be estimated at any time with
+#   a memory that depends only on the number of bins.
+#
+class LossDistribution():
+
+    ## @param nbBins: number of bins used to discretize [0,1]
+    #
+    def __init__(self, nbBins = 10000):
+
+        self.nbBins = nbBins
+        self.counts = np.zeros(nbBins, dtype = np.int64)
+        self.sums = np.zeros(nbBins)
+        self.count = 0
+        self.total = 0.0
+        self.totalSquares = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+
+    ## Add a batch of losses to the distribution
+    #  @param losses: numpy array with the losses
+    #
+    def add(self, losses):
+
+        losses = np.clip(np.asarray(losses, dtype = float), 0, 1)
+        if losses.size == 0:
+            return
+
+        bins = np.minimum((losses * self.nbBins).astype(int), self.nbBins - 1)
+        self.counts += np.bincount(bins, minlength = self.nbBins)
+        self.sums += np.bincount(bins, weights = losses, minlength = self.nbBins)
+        self.count += losses.size
+        self.total += losses.sum()
+        self.totalSquares += (losses ** 2).sum()
+        self.min = min(self.min, losses.min())
+        self.max = max(self.max, losses.max())
+
+
+    ## Merge into the distribution another distribution with the same number of bins
+    #
+    def merge(self, other):
+
+        self.counts += other.counts
+        self.sums += other.sums
+        self.count += other.count
+        self.total += other.total
+        self.totalSquares += other.totalSquares
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+
+    ## Value at Risk: quantile of the losses at the level alpha (linear interpolation inside the bin)
+    #
+    def var(self, alpha):
+
+        target = alpha * self.count
+        cumCounts = np.cumsum(self.counts)
+        b = min(int(np.searchsorted(cumCounts, target)), self.nbBins - 1)
+        before = cumCounts[b] - self.counts[b]
+        fraction = (target - before) / self.counts[b] if self.counts[b] > 0 else 1
+
+        return (b + fraction) / self.nbBins
+
+
+    ## Expected Shortfall: average of the losses above the Value at Risk at the level alpha
+    #
+    def es(self, alpha):
+
+        target = alpha * self.count
+        cumCounts = np.cumsum(self.counts)
+        b = min(int(np.searchsorted(cumCounts, target)), self.nbBins - 1)
+
+        # the bin containing the VaR contributes only with the share of its losses above the VaR
+        share = (cumCounts[b] - target) / self.counts[b] if self.counts[b] > 0 else 0
+        tailCount = self.count - target
+        tailSum = self.sums[b + 1:].sum() + share * self.sums[b]
+
+        return tailSum / tailCount if tailCount > 0 else self.max
+
+
+    ## Summary of the distribution: number of scenarios, mean, standard deviation, min, max,
+    #  VaR and ES for each level in alphas (NaN if the distribution is empty)
+    #
+    def summary(self, alphas = (0.95, 0.99)):
+
+        if self.count == 0:
+            keys = ['mean', 'std', 'min', 'max'] + [s + str(a) for a in alphas for s in ('VaR_', 'ES_')]
+            return dict({'nbScenarios': 0}, **dict.fromkeys(keys, np.nan))
+
+        mean = self.total / self.count
+        summary = {'nbScenarios': self.count,
+                   'mean': mean,
+                   'std': np.sqrt(max(self.totalSquares / self.count - mean ** 2, 0)),
+                   'min': self.min,
+                   'max': self.max}
+
+        for a in alphas:
+            summary['VaR_' + str(a)] = self.var(a)
+            summary['ES_' + str(a)] = self.es(a)
+
+        return summary
+
+
+
+
+# Workers ##################################################################################
+
+
+# state of each worker process: shared memory blocks and the objects built on top of them
+_worker = {}
+
+
+## Copy an array into a new block of shared memory
+#  @return the shared memory block and the description (name, shape, dtype) needed to attach to it
+#
+def _toSharedMemory(array):
+
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf)[:] = array
+
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+## Initializer of the worker processes: attach to the shared memory blocks containing the CSR arrays
+#  of the weights matrix (in canonical format) and the relevance vector, and split the weights matrix in levels
+#  once (the scenarios only replace its weights, see WeightsSplit.setWeights)
+#
+def _initWorker(descriptions, shape):
+
+    arrays = {}
+    for k in descriptions.keys():
+        name, arrayShape, dtype = descriptions[k]
+        block = shared_memory.SharedMemory(name = name)
+        _worker[k + 'Block'] = block
+        arrays[k] = np.ndarray(arrayShape, dtype = dtype, buffer = block.buf)
+
+    _worker['arrays'] = arrays
+    _worker['shape'] = shape
+    _worker['split'] = fn.WeightsSplit(sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape = shape))
+
+
+## Simulate a chunk of scenarios and return the aggregated distribution of the losses
+#  @param chunkId: identifier of the chunk, used together with seed to generate the random numbers
+#  @param nbScenarios: number of scenarios in the chunk
+#  @param params: dictionary with the parameters of the scenarios (see runScenarios)
+#
+def _runChunk(chunkId, nbScenarios, params):
+
+    arrays = _worker['arrays']
+    data, relevance, split = arrays['data'], arrays['relevance'], _worker['split']
+    N = _worker['shape'][0]
+
+    rng = np.random.default_rng([params['seed'], chunkId])
+    losses = np.zeros(nbScenarios)
+
+    for s in range(nbScenarios):
+
+        # random set of distressed nodes and level of distress
+        nbSeeds = rng.integers(1, min(params['maxSeeds'], N) + 1)
+        SD = np.zeros(N, dtype = bool)
+        SD[rng.choice(N, nbSeeds, replace = False)] = True
+        h = rng.uniform(params['hMin'], params['hMax'])
+
+        # random multiplicative perturbation of the weights (the structure of the matrix and its levels are shared)
+        if params['weightNoise'] > 0:
+            noise = np.exp(params['weightNoise'] * rng.standard_normal(data.size))
+            split.setWeights(np.minimum(1, data * noise))
+
+        losses[s] = fn.debtRankMatrix(split, SD, h, relevance, params['maxIter'])[0]
+
+    distribution = LossDistribution(params['nbBins'])
+    distribution.add(losses)
+
+    return distribution
+
+
+
+
+# Scenario runner ##########################################################################
+
+
+## Run nbScenarios random stress scenarios on the network over a pool of processes and return the
+#  distribution of the losses R.
+#  @param network: FinancialNetwork
+#  @param relevance: dictionnary with absolute economic relevance of each node (could be Makt cap or other)
+#  @param nbScenarios: number of scenarios
+#  @param maxSeeds: maximum number of nodes distressed in a scenario (the number is uniform in [1, maxSeeds])
+#  @param hRange: pair with the bounds of the (uniform) initial level of distress
+#  @param weightNoise: standard deviation of the lognormal multiplicative perturbation of the weights (0 = no perturbation)
+#  @param chunkSize: number of scenarios in each work unit
+#  @param nbWorkers: number of processes (default is the number of cores)
+#  @param seed: seed of the random numbers (the results do not depend on nbWorkers)
+#  @param maxIter: maximum number of iterations of the debt rank
+#  @param nbBins: number of bins of the LossDistribution
+#
+def runScenarios(network, relevance, nbScenarios, maxSeeds = 3, hRange = (0.1, 1), weightNoise = 0.1,
+                 chunkSize = 500, nbWorkers = None, seed = 0, maxIter = 100, nbBins = 10000):
+
+    W, nodes = fn.weightsMatrix(network)
+    W = sp.csr_matrix(W)
+    W.sum_duplicates() # canonical format, as WeightsSplit.setWeights expects
+    rel = fn.relevanceVector(relevance, nodes)
+
+    params = {'maxSeeds': maxSeeds, 'hMin': hRange[0], 'hMax': hRange[1], 'weightNoise': weightNoise,
+              'seed': seed, 'maxIter': maxIter, 'nbBins': nbBins}
+
+    # the weights matrix and the relevance are placed once in shared memory
+    blocks = {}
+    descriptions = {}
+    for k, array in [('data', W.data), ('indices', W.indices), ('indptr', W.indptr), ('relevance', rel)]:
+        blocks[k], descriptions[k] = _toSharedMemory(array)
+
+    if nbWorkers is None:
+        nbWorkers = os.cpu_count()
+
+    distribution = LossDistribution(nbBins)
+    chunks = [(c, min(chunkSize, nbScenarios - c * chunkSize)) for c in range(-(-nbScenarios // chunkSize))]
+
+    try:
+        with ProcessPoolExecutor(nbWorkers, initializer = _initWorker, initargs = (descriptions, W.shape)) as pool:
+
+            # keep a bounded number of chunks in flight and merge the results as soon as they arrive
+            maxPending = 2 * nbWorkers
+            pending = set()
+            for chunkId, size in chunks:
+                pending.add(pool.submit(_runChunk, chunkId, size, params))
+                if len(pending) >= maxPending:
+                    done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                    for f in done:
+                        distribution.merge(f.result())
+
+            for f in pending:
+                distribution.merge(f.result())
+
+    finally:
+        for k in blocks.keys():
+            blocks[k].close()
+            blocks[k].unlink()
+
+    return distribution
+
+
+
+def main():
+
+    for source in ['G_2010', 'G_2018']:
+
+        G = fn.loadNetwork(settings.PATH + source + '.gexf')
+        mktCap = nx.get_node_attributes(G, 'mktCap')
+
+        distribution = runScenarios(G, mktCap, settings.NB_SCENARIOS, settings.MAX_SEEDS,
+                                    (settings.H_MIN, settings.H_MAX), settings.WEIGHT_NOISE, settings.SCENARIO_CHUNK)
+
+        print(source)
+        for k, v in distribution.summary(settings.VAR_LEVELS).items():
+            print('    ', k, np.round(v, 4))
+
+
+
+if __name__ == '__main__':
+    main()
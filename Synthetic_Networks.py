@@ -0,0 +1,115 @@
+"""
+Year End Project
+Program:                Data Science
+@author:                Marco Corsi
+@Description: Generator of synthetic ownership networks of any size, used to test and benchmark the project beyond the
+              30 institutions of the real data. Five structures are available: core-periphery (a small dense core of large
+              institutions), scale-free (heavy-tailed degrees), block-structured (dense communities, e.g. countries),
+              dense (cross-holdings between about half of the pairs of institutions, as in the real ownership networks)
+              and complete DAG (each institution holds all the ones before it, the deepest chain of holdings).
+              The weights follow a lognormal distribution, rescaled so that the share of each institution held by the
+              others is realistic, and the market caps are lognormal (larger for the core).
+"""
+
+
+
+
+import numpy as np
+import scipy.sparse as sp
+
+
+
+
+KINDS = ['corePeriphery', 'scaleFree', 'block', 'dense', 'completeDAG']
+
+# share of the pairs of nodes linked in the dense networks
+DENSITY = 0.5
+
+# largest dense or complete DAG network generated (the number of edges grows as N^2)
+MAX_DENSE_NODES = 1000
+
+
+## Generate a synthetic ownership network
+#  @param N: number of nodes
+#  @param kind: structure of the network (see KINDS)
+#  @param seed: seed of the random numbers
+#  @param avgDegree: average number of holdings of each node (not used by the dense and complete DAG networks)
+#  @return weights: scipy.sparse CSR matrix (N x N) where position (i,j) contains the impact of node j over node i
+#                   (i.e. the share of j owned by i, same convention as DB_Utilities.getNodesEdges)
+#          nodes: list with the names of the nodes
+#          staticAttributes: dictionary with the static attributes of each node (see DB_Utilities.getNodesAttributes)
+#          marketCaps: dictionary with the market cap of each node (in USD)
+#
+def syntheticNetwork(N, kind = 'corePeriphery', seed = 0, avgDegree = 5):
+
+    rng = np.random.default_rng(seed)
+    size = np.ones(N)
+
+    if kind == 'corePeriphery':
+        nbCore = max(5, N // 20)
+        core, periphery = np.arange(nbCore), np.arange(nbCore, N)
+        pairs = [_blockEdges(rng, core, core, min(0.5, 4 * avgDegree / nbCore)),
+                 _blockEdges(rng, core, periphery, avgDegree / 2 / nbCore),
+                 _blockEdges(rng, periphery, core, avgDegree / 2 / nbCore),
+                 _blockEdges(rng, periphery, periphery, avgDegree / 5 / N)]
+        size[core] = 10
+
+    elif kind == 'scaleFree':
+        # Chung-Lu model: the probability of an edge is proportional to the product of the propensities of its ends
+        outPropensity = rng.pareto(1.1, N) + 1
+        inPropensity = rng.pareto(1.1, N) + 1
+        nbEdges = avgDegree * N
+        pairs = [(rng.choice(N, nbEdges, p = outPropensity / outPropensity.sum()),
+                  rng.choice(N, nbEdges, p = inPropensity / inPropensity.sum()))]
+        size = np.sqrt(inPropensity)
+
+    elif kind == 'block':
+        nbBlocks = max(2, N // 100)
+        blocks = np.array_split(rng.permutation(N), nbBlocks)
+        pairs = [_blockEdges(rng, b, b, min(1, 0.8 * avgDegree / len(b))) for b in blocks]
+        pairs.append(_blockEdges(rng, np.arange(N), np.arange(N), 0.2 * avgDegree / N))
+
+    elif kind == 'dense':
+        if N > MAX_DENSE_NODES:
+            raise ValueError('dense networks are limited to ' + str(MAX_DENSE_NODES) + ' nodes')
+        pairs = [_blockEdges(rng, np.arange(N), np.arange(N), DENSITY)]
+
+    elif kind == 'completeDAG':
+        # node i holds all the nodes j < i: every edge goes forward in the order of the nodes, over N levels
+        if N > MAX_DENSE_NODES:
+            raise ValueError('complete DAG networks are limited to ' + str(MAX_DENSE_NODES) + ' nodes')
+        pairs = [np.tril_indices(N, -1)]
+
+    else:
+        raise ValueError('unknown kind of network ' + str(kind))
+
+    rows = np.concatenate([p[0] for p in pairs])
+    cols = np.concatenate([p[1] for p in pairs])
+    keep = rows != cols
+    rows, cols = rows[keep], cols[keep]
+
+    # lognormal holdings, rescaled so that the share of each node held by the others is between 5% and 60%
+    values = rng.lognormal(-3, 1.5, rows.size)
+    weights = sp.csr_matrix((values, (rows, cols)), shape = (N, N))
+    weights.sum_duplicates()
+    colSums = np.asarray(weights.sum(axis = 0)).ravel()
+    heldShare = rng.uniform(0.05, 0.6, N)
+    scale = np.divide(heldShare, colSums, out = np.zeros(N), where = colSums > 0)
+    weights = sp.csr_matrix(weights @ sp.diags(scale))
+
+    nodes = ['N' + str(i).zfill(len(str(N - 1))) for i in range(N)]
+    mktCaps = rng.lognormal(np.log(1e10), 1.5, N) * size
+    staticAttributes = {nodes[i]: [nodes[i], 'USD', 'SPX'] for i in range(N)}
+    marketCaps = {nodes[i]: float(mktCaps[i]) for i in range(N)}
+
+    return weights, nodes, staticAttributes, marketCaps
+
+
+## Random pairs (row, column) between two groups of nodes, each pair being drawn with probability p
+#  (pairs drawn twice are merged when the matrix is built)
+#
+def _blockEdges(rng, rowNodes, colNodes, p):
+
+    nbEdges = rng.binomial(len(rowNodes) * len(colNodes), min(1, p))
+
+    return rng.choice(rowNodes, nbEdges), rng.choice(colNodes, nbEdges)
@@ -34,6 +34,10 @@ SCALE = 1.5
 LIMIT = 0.00001
 IDEAL_DIST = 2.5
 MAX_ITER = 100
+LAYOUT_SEED = 0 # seed of the initial positions (the layouts are reproducible)
+LAYOUT_WORKERS = 1 # threads used by the layout engine (-1 for all the cores)
+WARM_ITERATIONS = 30 # iterations when the layout starts from the positions of a previous network (see Graph_Builder)
+WARM_TEMPERATURE = 0.05 # maximum move at the first iteration of a warm start, as a fraction of the size of the layout
 
 
 # Parameters for the FUNCTION  backToOriginal() and update() in GUI
@@ -44,9 +48,76 @@ SIZE_CIRCLE_2 = 20
 # Parameter for the FUNCTION distress_node in GUI
 DISTRESS_SCALING = 1.3
 
+# levels of distress of the single node shocks precomputed by Graph_Builder for the GUI (no precomputation if empty).
+# The GUI interpolates between the levels and runs the debt rank only for levels outside the grid
+STRESS_GRID = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+
+# seconds between two rounds of the propagation when the cascade is animated in the GUI
+CASCADE_DELAY = 0.5
+
 ##  Parameter for the Function get_edges_specs in GUI
 EDGE_SCALING = 0.6
+EDGE_THRESHOLD = 0 # edges with a weight below or equal to the threshold are not drawn
+MAX_EDGES = 2000 # maximum number of edges sent to the browser (the heaviest edges of the visible area)
+LOD_DELAY = 200 # milliseconds between a zoom and the redraw of the edges
 
 # PArameters for correlation network
 PERIOD = 5 #(5 means returns over 5 business day)
-WINDOW = 200 # data points for the calculation of the correll
\ No newline at end of file
+WINDOW = 200 # data points for the calculation of the correll
+CORRELATION_THRESHOLD = 0.3 # correlations below or equal to the threshold are set to 0
+CORRELATION_TILE = 512 # number of nodes in each tile of the blockwise correlation (DB_Generation.correlationEdges)
+ROLLING_CORRELATION = False # if True DB_Generation stores the correlation network of every day in nodesEdges (method 'rollingCorrelation')
+
+
+# Parameters for the Monte Carlo stress scenarios (Stress_Scenarios)
+NB_SCENARIOS = 20000
+MAX_SEEDS = 3 # maximum number of nodes distressed in a scenario
+H_MIN = 0.1 # range of the initial level of distress
+H_MAX = 1
+WEIGHT_NOISE = 0.1 # std of the lognormal perturbation of the weights
+SCENARIO_CHUNK = 500 # scenarios per work unit
+VAR_LEVELS = [0.95, 0.99]
+
+
+# Parameters for the reverse stress test (Reverse_Stress)
+REVERSE_TARGET = 0.1 # target level of the debt rank R
+REVERSE_BUDGET = None # maximum number of distressed nodes (None for no limit)
+REVERSE_H = 1 # initial level of distress of the distressed nodes
+
+
+# Maximum number of networks kept in memory by the GUI (Graph_Store)
+GRAPH_STORE_SIZE = 8
+
+
+# SQLite tuning for the bulk writes in DB_Utilities
+SQLITE_PAGE_SIZE = 8192 # bytes, applied only when the database is created
+SQLITE_CACHE_KB = 65536 # page cache
+SQLITE_MMAP_MB = 256 # memory-mapped page cache of the read connections of DB_Utilities.ConnectionPool
+
+
+# table of aliases used to map the ownership holders to their parent entity (DB_Generation.cleanRawdata)
+ENTITY_ALIASES = join(PATH , 'entityAliases.json')
+
+# number of rows of the raw ownership files read at once (DB_Generation.cleanRawdataChunked)
+RAW_CHUNK_SIZE = 2000
+
+# Parameters for the history of networks built by Graph_Builder (no history if SNAPSHOT_START is None)
+SNAPSHOT_START = None # e.g. '2011-01-01'
+SNAPSHOT_END = '2018-06-12'
+SNAPSHOT_FREQ = 'MS' # pandas frequency of the snapshot dates ('MS' monthly, 'W' weekly)
+SNAPSHOT_METHODS = ['equityOwnership'] # methods of the weights (see nodesEdges)
+# date of the extraction of the yearly ownership files: a year snapshot ('2010') is only available from this date
+# (the years not listed are available from their last day)
+EXTRACTION_DATES = {'2010': '2010-08-10', '2018': '2018-08-10'}
+
+# On-disk cache of the build steps of Graph_Builder (the cache is disabled if BUILD_CACHE_MB is 0)
+BUILD_CACHE = join(PATH , 'buildCache')
+BUILD_CACHE_MB = 500
+
+# if True Graph_Builder records the propagation of the debt rank centrality of each network (rounds, active nodes,
+# time, termination) and saves the report in G_<name>_diagnostics.json
+DEBTRANK_DIAGNOSTICS = False
+
+# Scaling benchmarks on synthetic networks (Benchmarks.py)
+BENCHMARK_SIZES = [300, 1000] # number of nodes of the synthetic networks (e.g. --sizes 3000 30000 for the scaling)
+BENCHMARK_FILE = join(PATH , 'benchmarks.json')
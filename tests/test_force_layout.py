@@ -0,0 +1,80 @@
+"""
+Year End Project
+Program:                Data Science
+@author:                Marco Corsi
+@Description: Tests of the layout engine against the Fruchterman-Reingold layout of networkx
+"""
+
+
+
+
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+
+import Force_Layout as fl
+
+
+
+
+## Network with a dense cluster of nbCluster nodes (10 edges each) and a sparse periphery (2 edges each)
+#
+def _clusterNetwork(nbCluster = 200, nbPeriphery = 300, seed = 0):
+
+    rng = np.random.default_rng(seed)
+    N = nbCluster + nbPeriphery
+    rows, cols = [], []
+    for i in range(N):
+        targets = rng.choice(nbCluster, 10, replace = False) if i < nbCluster else rng.choice(N, 2, replace = False)
+        for j in targets:
+            if i != j:
+                rows.append(i)
+                cols.append(j)
+    W = sp.csr_matrix((rng.uniform(0.1, 1, len(rows)), (rows, cols)), shape = (N, N))
+    W.sum_duplicates()
+    return W
+
+
+## Average distance of the nodes of the cluster from its center, relative to the whole layout
+#
+def _spread(pos, nbCluster):
+
+    pos = nx.rescale_layout(pos.copy())
+    cluster = pos[:nbCluster]
+    return (np.linalg.norm(cluster - cluster.mean(axis = 0), axis = 1).mean()
+            / np.linalg.norm(pos - pos.mean(axis = 0), axis = 1).mean())
+
+
+def test_large_cluster_matches_networkx():
+
+    W = _clusterNetwork()
+    G = nx.from_scipy_sparse_array(W + W.T)
+    reference = nx.spring_layout(G, iterations = 50, seed = 1)
+    reference = np.array([reference[n] for n in range(W.shape[0])])
+
+    pos = fl.forceLayout(W, iterations = 50)
+
+    assert np.isfinite(pos).all()
+    assert abs(_spread(pos, 200) - _spread(reference, 200)) < 0.05
+
+
+def test_repulsion_close_to_exact():
+
+    rng = np.random.default_rng(1)
+    pos = rng.random((1000, 2))
+    k = 0.03
+    approx = fl._Quadtree(pos, 4).repulsion(np.arange(1000), k)
+
+    delta = pos[:, None, :] - pos[None, :, :]
+    distance2 = np.maximum((delta ** 2).sum(axis = 2), 1e-4)
+    np.fill_diagonal(distance2, np.inf)
+    exact = (delta * (k * k / distance2)[:, :, None]).sum(axis = 1)
+
+    error = np.linalg.norm(approx - exact, axis = 1) / np.linalg.norm(exact, axis = 1)
+    assert np.median(error) < 0.01
+
+
+def test_threads_give_the_same_layout():
+
+    W = _clusterNetwork(50, 100)
+    assert np.allclose(fl.forceLayout(W, iterations = 10), fl.forceLayout(W, iterations = 10, nbWorkers = 3))
@@ -0,0 +1,38 @@
+"""
+Year End Project
+Program:                Data Science
+@author:                Marco Corsi
+@Description: Tests of the construction of the snapshots of the history
+"""
+
+
+
+
+import scipy.sparse as sp
+
+import settings
+import DB_Utilities as dbm
+import Graph_Builder as gb
+
+
+
+
+def test_snapshot_with_unpriced_node(monkeypatch, tmp_path, capsys):
+
+    nodes = ['A', 'B', 'C']
+    W = sp.csr_matrix([[0, 0.5, 0], [0.2, 0, 0.4], [0.3, 0, 0]])
+    attributes = {n: [n, 'USD', '^GSPC'] for n in nodes}
+
+    monkeypatch.setattr(settings, 'PATH', str(tmp_path) + '/')
+    monkeypatch.setattr(settings, 'BUILD_CACHE_MB', 0)
+    monkeypatch.setattr(dbm, 'getSnapshotAsOf', lambda DB, date, _method: '2018')
+    monkeypatch.setattr(dbm, 'getMarketCapsAsOf', lambda DB, date: {'A': 100.0, 'B': 50.0})
+    monkeypatch.setattr(dbm, 'getNodesAttributes', lambda DB: attributes)
+    monkeypatch.setattr(dbm, 'getNodesEdges', lambda DB, year, _method, sparse = False: (W, nodes))
+
+    date, method, centrality, layout = gb.buildSnapshot('2018-06-29', 'ownership')
+
+    assert set(centrality.keys()) == set(nodes)
+    assert set(layout.keys()) == set(nodes)
+    assert 'C' in capsys.readouterr().out
+    assert (tmp_path / 'G_ownership_2018-06-29.npz').exists()
@@ -0,0 +1,37 @@
+"""
+Year End Project
+Program:                Data Science
+@author:                Marco Corsi
+@Description: Tests of the distribution of the losses of the stress scenarios
+"""
+
+
+
+
+import numpy as np
+
+import Stress_Scenarios as ss
+
+
+
+
+def test_summary_of_empty_distribution():
+
+    summary = ss.LossDistribution().summary((0.95,))
+
+    assert summary['nbScenarios'] == 0
+    assert set(summary.keys()) == {'nbScenarios', 'mean', 'std', 'min', 'max', 'VaR_0.95', 'ES_0.95'}
+    assert np.isnan(summary['mean'])
+
+
+def test_summary_after_merge():
+
+    a, b = ss.LossDistribution(100), ss.LossDistribution(100)
+    a.add(np.array([0.1, 0.2]))
+    b.add(np.array([0.3]))
+    a.merge(b)
+    summary = a.summary()
+
+    assert summary['nbScenarios'] == 3
+    assert np.isclose(summary['mean'], 0.2)
+    assert summary['min'] == 0.1 and summary['max'] == 0.3